@@ -0,0 +1,153 @@
+# app/admission.py
+#
+# Admission control for the expensive analytics endpoints. Each decorated endpoint has a cost
+# (roughly how much of the catalogue it holds in memory at once) and all of them share a budget of
+# ADMISSION_CAPACITY cost units per worker. A request that does not fit waits in a FIFO queue for
+# at most ADMISSION_QUEUE_TIMEOUT seconds; when the queue is full it is turned away at once with
+# 429, and when its wait times out it gets 503, both with a Retry-After header. CRUD routes are
+# never decorated, so they bypass the queue entirely and stay responsive while analytics is
+# saturated.
+#
+# Apply it below @singleflight(), so requests coalesced onto one computation take one slot.
+
+import asyncio
+import functools
+import logging
+from collections import defaultdict, deque
+from typing import Optional
+
+from fastapi import HTTPException
+
+from app.config import (
+    ADMISSION_CAPACITY,
+    ADMISSION_ENABLED,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_RETRY_AFTER,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per endpoint: requests admitted, waiting and running now, and rejected
+admission_stats = defaultdict(lambda: {
+    'admitted': 0, 'queued': 0, 'running': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0,
+})
+
+
+class WeightedLimiter:
+    """
+    Weighted FIFO semaphore: grants `cost` units out of `capacity`, in arrival order.
+    """
+
+    def __init__(self, capacity: int, max_queue: int):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.in_use = 0
+        self._waiters = deque()  # (cost, future)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _wake(self):
+        while self._waiters and self.in_use + self._waiters[0][0] <= self.capacity:
+            cost, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_use += cost
+            future.set_result(None)
+
+    async def acquire(self, cost: int, timeout: float) -> bool:
+        """
+        Waits for `cost` units. Returns False if the queue is full, raises asyncio.TimeoutError
+        if the wait times out.
+        """
+        if not self._waiters and self.in_use + cost <= self.capacity:
+            self.in_use += cost
+            return True
+        if len(self._waiters) >= self.max_queue:
+            return False
+
+        entry = (cost, asyncio.get_running_loop().create_future())
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(entry[1], timeout)
+        except BaseException:
+            # Timed out or cancelled; the units may have been granted just before
+            if entry[1].done() and not entry[1].cancelled():
+                self.release(cost)
+            else:
+                try:
+                    self._waiters.remove(entry)
+                except ValueError:
+                    pass
+                # Leaving may unblock the requests queued behind this one
+                self._wake()
+            raise
+        return True
+
+    def release(self, cost: int):
+        self.in_use -= cost
+        self._wake()
+
+
+_limiter: Optional[WeightedLimiter] = None
+
+
+def get_limiter() -> WeightedLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = WeightedLimiter(ADMISSION_CAPACITY, ADMISSION_MAX_QUEUE)
+    return _limiter
+
+
+def _rejection(status_code: int, detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status_code, detail=detail, headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+    )
+
+
+def admission(cost: int = 1, name: Optional[str] = None):
+    """
+    Decorates an async endpoint so it only runs when `cost` units of the analytics budget are free.
+
+    Parameters:
+        cost (int): Units the endpoint holds while it runs (capped at the capacity).
+        name (str): Stats name; defaults to the function name.
+    """
+    def decorator(function):
+        stats_name = name or function.__name__
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return await function(*args, **kwargs)
+
+            limiter = get_limiter()
+            units = min(cost, limiter.capacity)
+            stats = admission_stats[stats_name]
+            stats['queued'] += 1
+            try:
+                admitted = await limiter.acquire(units, ADMISSION_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                stats['rejected_timeout'] += 1
+                logger.warning(f"{stats_name}: no analytics capacity within {ADMISSION_QUEUE_TIMEOUT} s.")
+                raise _rejection(503, "The analytics service is busy. Please retry shortly.")
+            finally:
+                stats['queued'] -= 1
+            if not admitted:
+                stats['rejected_queue_full'] += 1
+                logger.warning(f"{stats_name}: analytics queue full ({limiter.queue_depth} waiting).")
+                raise _rejection(429, "Too many analytics requests are waiting. Please retry shortly.")
+
+            stats['admitted'] += 1
+            stats['running'] += 1
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                stats['running'] -= 1
+                limiter.release(units)
+        return wrapper
+    return decorator
@@ -0,0 +1,314 @@
+# app/aggregates.py
+
+import heapq
+import math
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+
+class CoMoments:
+    """
+    Online co-moment accumulator (Welford / Chan et al.) over a fixed set of numeric columns.
+    Keeps only the count, the column means and the matrix of co-moments, so memory is
+    constant in the number of rows. Accumulators built over different chunks, cursors or
+    workers can be merged, and the result is the Pearson correlation matrix of all rows.
+    """
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.n = 0
+        self.mean = [0.0] * size
+        self.comoment = [[0.0] * size for _ in range(size)]
+
+    def add(self, row: Sequence[float]):
+        """
+        Adds a single row (one value per column, in column order).
+        """
+        self.n += 1
+        delta = [value - mean for value, mean in zip(row, self.mean)]
+        self.mean = [mean + d / self.n for mean, d in zip(self.mean, delta)]
+        delta_after = [value - mean for value, mean in zip(row, self.mean)]
+        for i, d in enumerate(delta):
+            comoment_row = self.comoment[i]
+            for j, d_after in enumerate(delta_after):
+                comoment_row[j] += d * d_after
+
+    def add_batch(self, matrix) -> "CoMoments":
+        """
+        Adds a 2-D numpy array of complete rows (no NaNs) with vectorized arithmetic,
+        by summarizing the batch and merging it in.
+        """
+        import numpy as np
+
+        rows = np.asarray(matrix, dtype="float64")
+        if rows.shape[0] == 0:
+            return self
+        batch = CoMoments(self.columns)
+        batch.n = int(rows.shape[0])
+        batch_mean = rows.mean(axis=0)
+        centered = rows - batch_mean
+        batch.mean = batch_mean.tolist()
+        batch.comoment = (centered.T @ centered).tolist()
+        return self.merge(batch)
+
+    def merge(self, other: "CoMoments") -> "CoMoments":
+        """
+        Merges another accumulator over the same columns into this one.
+        """
+        if other.columns != self.columns:
+            raise ValueError("Cannot merge co-moments over different columns.")
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n = other.n
+            self.mean = list(other.mean)
+            self.comoment = [list(row) for row in other.comoment]
+            return self
+
+        n = self.n + other.n
+        delta = [b - a for a, b in zip(self.mean, other.mean)]
+        factor = self.n * other.n / n
+        for i in range(len(self.columns)):
+            for j in range(len(self.columns)):
+                self.comoment[i][j] += other.comoment[i][j] + delta[i] * delta[j] * factor
+        self.mean = [a + d * other.n / n for a, d in zip(self.mean, delta)]
+        self.n = n
+        return self
+
+    def covariance(self, i: int, j: int) -> Optional[float]:
+        # Sample covariance (ddof=1), like pandas
+        if self.n < 2:
+            return None
+        return self.comoment[i][j] / (self.n - 1)
+
+    def correlation(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        Returns the Pearson correlation matrix in the same shape as DataFrame.corr().to_dict().
+        Undefined entries (fewer than two rows or a constant column) are None.
+        """
+        result: Dict[str, Dict[str, Optional[float]]] = {}
+        for j, column_j in enumerate(self.columns):
+            result[column_j] = {}
+            for i, column_i in enumerate(self.columns):
+                denominator = self.comoment[i][i] * self.comoment[j][j]
+                if self.n < 2 or denominator <= 0:
+                    value = None
+                elif i == j:
+                    value = 1.0
+                else:
+                    value = max(-1.0, min(1.0, self.comoment[i][j] / math.sqrt(denominator)))
+                result[column_j][column_i] = value
+        return result
+
+    def to_dict(self) -> dict:
+        """
+        Serializes the accumulator so it can be shipped between workers or stored.
+        """
+        return {"columns": self.columns, "n": self.n, "mean": self.mean, "comoment": self.comoment}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CoMoments":
+        accumulator = cls(data["columns"])
+        accumulator.n = int(data["n"])
+        accumulator.mean = [float(value) for value in data["mean"]]
+        accumulator.comoment = [[float(value) for value in row] for row in data["comoment"]]
+        return accumulator
+
+
+def main_category(category) -> str:
+    """
+    Returns the top-level category of a 'Main|Sub|...' category path.
+    """
+    if not isinstance(category, str) or not category.strip():
+        return 'Unknown'
+    return category.split('|')[0].strip()
+
+
+
+class PowerSums:
+    """
+    Shifted power sums over a fixed set of numeric columns: the count, the sums of
+    (x - shift) and the sums of pairwise products of (x - shift). Unlike CoMoments they are
+    plain sums, so they can be updated atomically with $inc from any worker and support
+    removing rows. Shifting by a value close to the mean keeps the later
+    subtraction numerically stable.
+    """
+
+    def __init__(self, columns: Sequence[str], shift: Optional[Sequence[float]] = None):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.shift = list(shift) if shift is not None else [0.0] * size
+        self.n = 0
+        self.s1 = [0.0] * size
+        self.s2 = [[0.0] * size for _ in range(size)]
+
+    def increments(self, row: Sequence[float], weight: int = 1) -> Dict[str, float]:
+        """
+        Returns the per-field deltas that add (weight=1) or remove (weight=-1) a row,
+        keyed the way they are stored: 'n', 's1.<i>' and 's2.<i>_<j>' for i <= j.
+        """
+        centered = [value - shift for value, shift in zip(row, self.shift)]
+        deltas = {"n": weight}
+        for i, ci in enumerate(centered):
+            deltas[f"s1.{i}"] = weight * ci
+            for j in range(i, len(centered)):
+                deltas[f"s2.{i}_{j}"] = weight * ci * centered[j]
+        return deltas
+
+    def add(self, row: Sequence[float], weight: int = 1):
+        self.apply(self.increments(row, weight))
+
+    def apply(self, deltas: Dict[str, float]):
+        """
+        Applies stored-format deltas (or a stored document's sums) to this accumulator.
+        """
+        for key, delta in deltas.items():
+            if key == "n":
+                self.n += int(delta)
+            elif key.startswith("s1."):
+                self.s1[int(key[3:])] += delta
+            elif key.startswith("s2."):
+                i, j = (int(part) for part in key[3:].split("_"))
+                self.s2[i][j] += delta
+                if i != j:
+                    self.s2[j][i] += delta
+
+    @classmethod
+    def from_comoments(cls, moments: CoMoments, shift: Optional[Sequence[float]] = None) -> "PowerSums":
+        """
+        Converts exact co-moments into power sums around `shift` (defaults to the means).
+        """
+        sums = cls(moments.columns, shift if shift is not None else moments.mean)
+        sums.n = moments.n
+        offset = [mean - s for mean, s in zip(moments.mean, sums.shift)]
+        sums.s1 = [moments.n * o for o in offset]
+        sums.s2 = [
+            [moments.comoment[i][j] + moments.n * offset[i] * offset[j] for j in range(len(offset))]
+            for i in range(len(offset))
+        ]
+        return sums
+
+    def to_comoments(self) -> CoMoments:
+        moments = CoMoments(self.columns)
+        moments.n = self.n
+        if self.n <= 0:
+            return moments
+        moments.mean = [shift + s / self.n for shift, s in zip(self.shift, self.s1)]
+        moments.comoment = [
+            [self.s2[i][j] - self.s1[i] * self.s1[j] / self.n for j in range(len(self.columns))]
+            for i in range(len(self.columns))
+        ]
+        return moments
+
+    def to_document(self) -> dict:
+        """
+        Stored form: the shift plus the same keys produced by `increments`, as nested fields.
+        """
+        doc = {"shift": self.shift, "n": self.n, "s1": {}, "s2": {}}
+        for i in range(len(self.columns)):
+            doc["s1"][str(i)] = self.s1[i]
+            for j in range(i, len(self.columns)):
+                doc["s2"][f"{i}_{j}"] = self.s2[i][j]
+        return doc
+
+    @classmethod
+    def from_document(cls, columns: Sequence[str], doc: dict) -> "PowerSums":
+        sums = cls(columns, doc.get("shift"))
+        deltas = {"n": doc.get("n", 0)}
+        deltas.update({f"s1.{key}": value for key, value in doc.get("s1", {}).items()})
+        deltas.update({f"s2.{key}": value for key, value in doc.get("s2", {}).items()})
+        sums.apply(deltas)
+        return sums
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitters sketch: approximate counts of the most frequent items of a stream
+    in at most `capacity` counters, whatever the number of distinct items. Each kept item has a
+    count that overestimates its true count by at most its `error`, itself at most
+    total / capacity; every item seen more than total / capacity times is kept. Sketches over
+    different chunks or workers can be merged with the same guarantee (Agarwal et al.,
+    "Mergeable Summaries"), and serialized with to_dict.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("A Space-Saving sketch needs at least one counter.")
+        self.capacity = capacity
+        self.total = 0
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    @property
+    def floor(self) -> int:
+        # What an item not kept may have been seen; 0 while there is room for every item
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    @property
+    def max_error(self) -> int:
+        return max(self.errors.values(), default=0)
+
+    def update(self, counts: Mapping[str, int]) -> "SpaceSaving":
+        """
+        Adds the exact counts of a chunk of the stream (e.g. a Counter of one batch).
+        """
+        return self._combine(counts, {}, 0, sum(counts.values()))
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """
+        Merges another sketch into this one; the capacity of this one is kept.
+        """
+        return self._combine(other.counts, other.errors, other.floor, other.total)
+
+    def _combine(self, counts: Mapping[str, int], errors: Mapping[str, int], floor: int, total: int) -> "SpaceSaving":
+        own_floor = self.floor
+        combined = {}
+        for item in self.counts.keys() | counts.keys():
+            combined[item] = (
+                self.counts.get(item, own_floor) + counts.get(item, floor),
+                self.errors.get(item, own_floor) + errors.get(item, floor),
+            )
+        if len(combined) > self.capacity:
+            kept = heapq.nlargest(self.capacity, combined.items(), key=lambda entry: entry[1][0])
+        else:
+            kept = combined.items()
+        self.counts = {item: count for item, (count, _) in kept}
+        self.errors = {item: error for item, (_, error) in kept}
+        self.total += total
+        return self
+
+    def top(self, k: int) -> List[Tuple[str, int]]:
+        """
+        The k items with the highest counts, highest first.
+        """
+        return heapq.nlargest(k, self.counts.items(), key=lambda entry: entry[1])
+
+    def guaranteed(self, k: int) -> bool:
+        """
+        Whether top(k) is exactly the set of the k most frequent items: each of them has been
+        seen at least as often as any item outside could have been.
+        """
+        ranked = self.top(k + 1)
+        if len(ranked) <= k:
+            return self.floor == 0
+        outside = max(ranked[k][1], self.floor)
+        return all(count - self.errors[item] >= outside for item, count in ranked[:k])
+
+    def to_dict(self) -> dict:
+        """
+        Serializes the sketch so it can be shipped between workers or stored.
+        """
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "items": [[item, count, self.errors[item]] for item, count in self.counts.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SpaceSaving":
+        sketch = cls(int(data["capacity"]))
+        sketch.total = int(data["total"])
+        for item, count, error in data["items"]:
+            sketch.counts[item] = int(count)
+            sketch.errors[item] = int(error)
+        return sketch
@@ -0,0 +1,232 @@
+# app/cleaning.py
+
+from __future__ import annotations
+
+import logging
+import math
+import re
+from typing import TYPE_CHECKING, Any, Iterable, NamedTuple, Optional, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Anything that is not a digit (of any script, like clean_number's \d) or a decimal point (₹, %,
+# commas, whitespace, stray text). pandas runs the pattern with Python's re on object columns but
+# with Arrow's RE2 on pyarrow strings, where \d only matches ASCII digits.
+NON_NUMERIC_PATTERN = r'[^\d.]'
+NON_NUMERIC_PATTERN_ARROW = r'[^\p{Nd}.]'
+
+# numpy and pandas are only imported by the column helpers, so the scalar helpers can be
+# used from the CRUD write path without loading the analytics stack.
+
+
+def clean_number(number_input: Optional[Union[str, int, float]]) -> Optional[float]:
+    """
+    Cleans a string representing a number by removing currency symbols, commas, and percentage signs.
+    Converts the cleaned string to a float. Returns None if conversion fails or input is invalid.
+
+    Parameters:
+        number_input (Optional[Union[str, int, float]]): The input to clean and convert.
+
+    Returns:
+        Optional[float]: The cleaned float value or None.
+    """
+    if not number_input:
+        return None
+
+    # If the input is not a string, attempt to convert it to a string
+    if not isinstance(number_input, str):
+        try:
+            number_str = str(number_input)
+        except Exception as e:
+            logger.error(f"Error converting input to string: {e}")
+            return None
+    else:
+        number_str = number_input
+
+    # Remove currency symbols, commas, percentage signs, and whitespace
+    cleaned_str = re.sub(r'[₹%,]', '', number_str).strip()
+
+    # Remove any remaining non-numeric characters except the decimal point
+    cleaned_str = re.sub(r'[^\d\.]', '', cleaned_str)
+
+    # If the cleaned string is empty, return None
+    if not cleaned_str:
+        logger.warning(f"clean_number: Cleaned string is empty after cleaning '{number_str}'. Setting to None.")
+        return None
+
+    try:
+        return float(cleaned_str)
+    except ValueError:
+        logger.error(f"ValueError: Cannot convert '{cleaned_str}' to float.")
+        return None
+
+
+def safe_float_conversion(value: Optional[Union[str, int, float]]) -> Optional[float]:
+    """
+    Safely converts a value to float. Returns None if conversion fails.
+
+    Parameters:
+        value (Optional[Union[str, int, float]]): The value to convert.
+
+    Returns:
+        Optional[float]: The converted float value or None.
+    """
+    if not value:
+        return None
+    try:
+        float_value = float(value)
+        if not math.isfinite(float_value):
+            logger.warning(f"safe_float_conversion: Non-finite float '{float_value}'. Setting to None.")
+            return None
+        return float_value
+    except (ValueError, TypeError):
+        logger.error(f"safe_float_conversion: Cannot convert '{value}' to float.")
+        return None
+
+
+def clean_text(text: str) -> str:
+    """
+    Cleans review text by removing special characters and digits, keeping only alphabets and spaces.
+    Converts text to lowercase.
+
+    Parameters:
+        text (str): The review text to clean.
+
+    Returns:
+        str: The cleaned text.
+    """
+    return re.sub(r'[^a-zA-Z\s]', '', text.lower())
+
+
+class CleanedColumn(NamedTuple):
+    """
+    Result of cleaning a whole column of raw values.
+
+    Attributes:
+        values (np.ndarray): float64 array, NaN wherever the input was missing or rejected.
+        mask (np.ndarray): Boolean array, True where the value is null.
+        rejected (int): Number of non-empty inputs that could not be converted.
+    """
+    values: np.ndarray
+    mask: np.ndarray
+    rejected: int
+
+    def to_list(self) -> list:
+        """
+        Returns the values as a list of Python floats with None for nulls (JSON friendly).
+        """
+        return [None if null else float(value) for value, null in zip(self.values, self.mask)]
+
+
+def _as_object_series(values: Any) -> pd.Series:
+    """
+    Normalizes a pandas Series, Arrow array or any iterable into an object-dtype Series.
+    """
+    import pandas as pd
+
+    if isinstance(values, pd.Series):
+        series = values
+    elif hasattr(values, "to_pandas"):  # pyarrow.Array / ChunkedArray
+        series = values.to_pandas()
+    else:
+        series = pd.Series(list(values), dtype=object)
+    return series.reset_index(drop=True).astype(object)
+
+
+def _falsy_mask(series: pd.Series) -> np.ndarray:
+    """
+    Flags values the scalar helpers treat as 'no value' (None, NaN, 0, False and '').
+    """
+    return (series.isna() | series.isin([0, ""])).to_numpy(dtype=bool)
+
+
+def _parse_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return math.nan
+
+
+def _reparse(result: np.ndarray, values: pd.Series, retry: np.ndarray) -> None:
+    """
+    Parses again, with the scalar helpers' float(), the entries pandas rejected: float() also
+    reads digits of other scripts ('١٢') and underscores between digits ('1_000'). Only rejected
+    entries get here, so the Python loop stays off the common path.
+    """
+    import numpy as np
+
+    if retry.any():
+        result[retry] = np.fromiter((_parse_float(value) for value in values[retry]), dtype="float64", count=int(retry.sum()))
+
+
+def _finish(values: np.ndarray, falsy: np.ndarray, name: Optional[str], helper: str) -> CleanedColumn:
+    import numpy as np
+
+    mask = np.isnan(values)
+    rejected = int(np.count_nonzero(mask & ~falsy))
+    if rejected:
+        logger.warning(f"{helper}: {rejected} of {len(values)} '{name or 'values'}' entries could not be converted. Setting to None.")
+    return CleanedColumn(values=values, mask=mask, rejected=rejected)
+
+
+def clean_number_column(values: Iterable[Any], name: Optional[str] = None) -> CleanedColumn:
+    """
+    Vectorized equivalent of `clean_number` over a whole column.
+    Strips currency symbols, percentage signs, commas and any other non-numeric characters
+    in a single pass and parses the remainder as float.
+
+    Parameters:
+        values (Iterable): Raw column values (pandas Series, Arrow array or any iterable).
+        name (str, optional): Column name used in the aggregated rejection log message.
+
+    Returns:
+        CleanedColumn: float64 values, null mask and the number of rejected entries.
+    """
+    import numpy as np
+    import pandas as pd
+
+    series = _as_object_series(values)
+    falsy = _falsy_mask(series)
+
+    text = series.where(~falsy, "").astype(str)
+    pattern = NON_NUMERIC_PATTERN_ARROW if getattr(text.dtype, "storage", None) == "pyarrow" else NON_NUMERIC_PATTERN
+    cleaned = text.str.replace(pattern, "", regex=True)
+    present = (cleaned != "").to_numpy(dtype=bool)
+    parsed = pd.to_numeric(cleaned.where(present, None), errors="coerce")
+    result = parsed.to_numpy(dtype="float64", na_value=np.nan, copy=True)
+    result[falsy] = np.nan
+    _reparse(result, cleaned.to_numpy(dtype=object), np.isnan(result) & present & ~falsy)
+
+    return _finish(result, falsy, name, "clean_number_column")
+
+
+def safe_float_column(values: Iterable[Any], name: Optional[str] = None) -> CleanedColumn:
+    """
+    Vectorized equivalent of `safe_float_conversion` over a whole column.
+    Parses every entry as float and nulls out missing, unparsable and non-finite values.
+
+    Parameters:
+        values (Iterable): Raw column values (pandas Series, Arrow array or any iterable).
+        name (str, optional): Column name used in the aggregated rejection log message.
+
+    Returns:
+        CleanedColumn: float64 values, null mask and the number of rejected entries.
+    """
+    import numpy as np
+    import pandas as pd
+
+    series = _as_object_series(values)
+    falsy = _falsy_mask(series)
+
+    parsed = pd.to_numeric(series.where(~falsy, None), errors="coerce")
+    result = parsed.to_numpy(dtype="float64", na_value=np.nan, copy=True)
+    _reparse(result, series.to_numpy(dtype=object), np.isnan(result) & ~falsy)
+    result[falsy | ~np.isfinite(result)] = np.nan
+
+    return _finish(result, falsy, name, "safe_float_column")
@@ -0,0 +1,308 @@
+# app/compression.py
+#
+# Compressed responses. The encoding is negotiated from the request's Accept-Encoding among
+# COMPRESSION_ENCODINGS, in that order of preference: zstd and br when their modules (zstandard,
+# brotli) are installed, gzip always. CompressionMiddleware compresses JSON, NDJSON and text
+# responses of every router; bodies under COMPRESSION_MIN_SIZE bytes are sent as they are, since
+# compressing them saves less than it costs, and bodies from COMPRESSION_THREAD_MIN_SIZE bytes are
+# compressed in a worker thread so a large payload does not stall the event loop. Streamed bodies
+# (NDJSON pages) are compressed chunk by chunk, each chunk flushed so the client can read it.
+#
+# Results of the coalesced analytics endpoints (see app/singleflight.py) are encoded once per
+# computation: EncodedResult holds the JSON body and, per encoding, its compressed bytes, made
+# the first time a client asks for that encoding, so requests served a held result send bytes
+# that are already compressed. EncodedJSONResponse sends them; the middleware leaves responses
+# that already carry a Content-Encoding alone.
+
+import asyncio
+import functools
+import gzip
+import json
+import logging
+import zlib
+from typing import Dict, Optional
+
+from fastapi.encoders import jsonable_encoder
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+from app.config import (
+    COMPRESSION_BROTLI_QUALITY,
+    COMPRESSION_ENABLED,
+    COMPRESSION_ENCODINGS,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_MIN_SIZE,
+    COMPRESSION_THREAD_MIN_SIZE,
+    COMPRESSION_ZSTD_LEVEL,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Content types worth compressing; images and archives are compressed already
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class _GzipStream:
+    def __init__(self):
+        self._compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _GzipCodec:
+    def compress(self, body: bytes) -> bytes:
+        return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+    def stream(self) -> _GzipStream:
+        return _GzipStream()
+
+
+class _BrotliStream:
+    def __init__(self, brotli):
+        self._compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _BrotliCodec:
+    def __init__(self):
+        import brotli
+
+        self._brotli = brotli
+
+    def compress(self, body: bytes) -> bytes:
+        return self._brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+
+    def stream(self) -> _BrotliStream:
+        return _BrotliStream(self._brotli)
+
+
+class _ZstdStream:
+    def __init__(self, zstandard):
+        self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self._compressor = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(self._flush_block)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _ZstdCodec:
+    def __init__(self):
+        import zstandard
+
+        self._zstandard = zstandard
+
+    def compress(self, body: bytes) -> bytes:
+        # A ZstdCompressor is not safe to share between threads; compress() runs in any of them
+        return self._zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compress(body)
+
+    def stream(self) -> _ZstdStream:
+        return _ZstdStream(self._zstandard)
+
+
+_CODECS = {'gzip': _GzipCodec, 'br': _BrotliCodec, 'zstd': _ZstdCodec}
+
+
+@functools.lru_cache(maxsize=None)
+def codecs() -> Dict[str, object]:
+    """
+    The configured encodings whose module is installed, in order of preference.
+    """
+    available = {}
+    for name in COMPRESSION_ENCODINGS:
+        if name not in _CODECS:
+            logger.warning(f"Unknown compression encoding '{name}' in DASHBOARD_COMPRESSION_ENCODINGS; skipped.")
+            continue
+        try:
+            available[name] = _CODECS[name]()
+        except ImportError:
+            logger.info(f"Compression encoding '{name}' is not available (its module is not installed).")
+    return available
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    The encoding to send a response in, given the request's Accept-Encoding header.
+
+    Returns:
+        str: The available encoding with the highest q-value (ties go to the preferred one), or
+        None if compression is disabled or the client accepts none of them.
+    """
+    if not COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.partition(";")
+        weight = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for name in codecs():
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+def _vary(headers: MutableHeaders):
+    # The response differs by Accept-Encoding, whether or not this one is compressed
+    if "accept-encoding" not in headers.get("vary", "").lower():
+        headers.add_vary_header("Accept-Encoding")
+
+
+def compressible(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+async def _off_loop(function, data: bytes) -> bytes:
+    # Small payloads compress faster than a thread hand-off takes
+    if len(data) >= COMPRESSION_THREAD_MIN_SIZE:
+        return await asyncio.to_thread(function, data)
+    return function(data)
+
+
+class CompressionMiddleware:
+    """
+    Compresses response bodies in the encoding negotiated from Accept-Encoding.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        start = None
+        # None until the first body chunk decides; then "pass" or the stream compressing the body
+        mode = None
+
+        async def send_compressed(message):
+            nonlocal start, mode
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or mode == "pass":
+                await send(message)
+                return
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if mode is None:
+                headers = MutableHeaders(scope=start)
+                if "content-encoding" in headers or not compressible(headers.get("content-type")):
+                    mode = "pass"
+                    await send(start)
+                    await send(message)
+                    return
+                _vary(headers)
+                if encoding is None or (not more_body and len(body) < self.minimum_size):
+                    mode = "pass"
+                    await send(start)
+                    await send(message)
+                    return
+
+                headers["Content-Encoding"] = encoding
+                if not more_body:
+                    body = await _off_loop(codecs()[encoding].compress, body)
+                    headers["Content-Length"] = str(len(body))
+                    mode = "pass"
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                # A streamed body: its length is not known until it ends
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                mode = codecs()[encoding].stream()
+                await send(start)
+
+            data = await _off_loop(mode.compress, body) if body else b""
+            if not more_body:
+                data += mode.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _render(content) -> tuple:
+    # The same JSON JSONResponse renders for a returned value, so the bytes do not change
+    content = jsonable_encoder(content)
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    return content, body
+
+
+class EncodedResult:
+    """
+    A JSON result encoded once, and its compressed bytes per encoding, made when first asked for.
+    """
+
+    def __init__(self, content, body: bytes):
+        self.content = content
+        self.body = body
+        self._compressed: Dict[str, bytes] = {}
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def encode(cls, result) -> "EncodedResult":
+        """
+        Encodes an endpoint's result to JSON in a worker thread.
+        """
+        return cls(*await asyncio.to_thread(_render, result))
+
+    async def compressed(self, encoding: str) -> bytes:
+        """
+        The body in `encoding`; compressed once, however many requests ask for it.
+        """
+        if encoding not in self._compressed:
+            async with self._lock:
+                if encoding not in self._compressed:
+                    self._compressed[encoding] = await _off_loop(codecs()[encoding].compress, self.body)
+        return self._compressed[encoding]
+
+
+class EncodedJSONResponse(Response):
+    """
+    Sends an EncodedResult, compressed in the encoding the request accepts if it is large enough.
+    """
+
+    media_type = "application/json"
+
+    def __init__(self, entry: EncodedResult, status_code: int = 200, headers: Optional[dict] = None):
+        self.entry = entry
+        super().__init__(content=entry.body, status_code=status_code, headers=headers)
+
+    async def __call__(self, scope, receive, send):
+        body = self.body
+        _vary(self.headers)
+        if len(body) >= COMPRESSION_MIN_SIZE:
+            encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+            if encoding is not None:
+                body = await self.entry.compressed(encoding)
+                self.headers["Content-Encoding"] = encoding
+                self.headers["Content-Length"] = str(len(body))
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": body})
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,200 @@
+# app/config.py
+
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Reads an integer setting from the environment.
+    """
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    Reads a float setting from the environment.
+    """
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_list(name: str, default: list) -> list:
+    """
+    Reads a comma separated list of floats from the environment.
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    return [float(item) for item in value.split(",") if item.strip()]
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    """
+    Reads a boolean flag from the environment ('1', 'true', 'yes', 'on' are truthy).
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Mount the /analytics router in this process. Workers that only serve CRUD
+# traffic can set DASHBOARD_ANALYTICS_ENABLED=0 so they never import the
+# analytics stack (pandas, scikit-learn) at all.
+ANALYTICS_ENABLED = _env_flag("DASHBOARD_ANALYTICS_ENABLED", True)
+
+# Price buckets for /analytics/price_discount_analysis. Statistics are kept per base bucket of
+# PRICE_BUCKET_BASE_WIDTH, so any edges that are multiples of it can be served without a rescan.
+PRICE_BUCKET_BASE_WIDTH = _env_float("DASHBOARD_PRICE_BUCKET_BASE_WIDTH", 500.0)
+PRICE_BUCKET_EDGES = _env_list("DASHBOARD_PRICE_BUCKET_EDGES", [0, 5000, 10000, 15000, 20000, 25000, 30000])
+
+# Resolution of the discount percentage histogram used for medians (exact for whole percentages)
+DISCOUNT_SKETCH_RESOLUTION = _env_float("DASHBOARD_DISCOUNT_SKETCH_RESOLUTION", 0.1)
+
+# Rebuilds of the precomputed analytics collections (see app/rebuilds.py): seconds a process may
+# hold a rebuild lock before another may take it over, and seconds between checks while waiting
+REBUILD_LOCK_SECONDS = _env_float("DASHBOARD_REBUILD_LOCK_SECONDS", 600.0)
+REBUILD_LOCK_POLL = _env_float("DASHBOARD_REBUILD_LOCK_POLL", 0.5)
+
+# Number of documents cleaned and aggregated at a time by streaming analytics scans
+ANALYTICS_SCAN_BATCH_SIZE = _env_int("DASHBOARD_ANALYTICS_SCAN_BATCH_SIZE", 5000)
+
+# Cursor batch size for analytics scans (documents per getMore round trip)
+ANALYTICS_FETCH_BATCH_SIZE = _env_int("DASHBOARD_ANALYTICS_FETCH_BATCH_SIZE", 10000)
+
+# Partitioned scans for the full-catalogue analytics (see app/partitioned_scan.py): _id ranges read
+# by concurrent cursors (1 keeps a single streaming cursor in the worker), processes decoding and
+# reducing them (defaults to the number of cores), and ids sampled per range to place boundaries
+SCAN_PARTITIONS = _env_int("DASHBOARD_SCAN_PARTITIONS", 1)
+SCAN_WORKERS = _env_int("DASHBOARD_SCAN_WORKERS", os.cpu_count() or 1)
+SCAN_PARTITION_SAMPLE = _env_int("DASHBOARD_SCAN_PARTITION_SAMPLE", 64)
+
+# Number of evenly spaced predictions /analytics/price_trend returns by default, and the most a caller may ask for
+PRICE_TREND_POINTS = _env_int("DASHBOARD_PRICE_TREND_POINTS", 100)
+PRICE_TREND_MAX_POINTS = _env_int("DASHBOARD_PRICE_TREND_MAX_POINTS", 1000)
+
+# Sentiment thresholds for /analytics/sentiment_distribution: ratings >= POSITIVE_MIN are positive,
+# ratings > NEUTRAL_ABOVE are neutral and the rest negative. Changing them rebuilds the rollup.
+SENTIMENT_POSITIVE_MIN = _env_float("DASHBOARD_SENTIMENT_POSITIVE_MIN", 4.0)
+SENTIMENT_NEUTRAL_ABOVE = _env_float("DASHBOARD_SENTIMENT_NEUTRAL_ABOVE", 3.3)
+
+# Directory for analytical snapshots (Parquet for offline readers, Arrow IPC for memory-mapping at
+# startup). Unset disables snapshots and every scan reads MongoDB directly.
+SNAPSHOT_DIR = os.getenv("DASHBOARD_SNAPSHOT_DIR") or None
+
+# Number of snapshot generations kept on disk
+SNAPSHOT_KEEP = _env_int("DASHBOARD_SNAPSHOT_KEEP", 2)
+
+# Overlap, in seconds, between a snapshot's watermark and the scan that produced it. Writes stamped
+# within this window are replayed by the catch-up, which absorbs clock skew between app servers.
+SNAPSHOT_WATERMARK_OVERLAP = _env_float("DASHBOARD_SNAPSHOT_WATERMARK_OVERLAP", 5.0)
+
+# How long deletion tombstones are kept; snapshots older than this can no longer be caught up
+SNAPSHOT_TOMBSTONE_TTL = _env_int("DASHBOARD_SNAPSHOT_TOMBSTONE_TTL", 7 * 24 * 3600)
+
+# Seconds between snapshot generations written in the background (0 disables it; write them with
+# POST /analytics/snapshot or python -m app.snapshot). Every worker runs the builder, but only one
+# writes each generation.
+SNAPSHOT_BUILD_INTERVAL = _env_int("DASHBOARD_SNAPSHOT_BUILD_INTERVAL", 0)
+
+# Artifacts built once into each snapshot generation and memory-mapped by every worker, instead of
+# built by each worker: "sentiment_model" (the /analytics/sentiment_analysis classifier)
+SNAPSHOT_ARTIFACTS = [
+    name.strip() for name in os.getenv("DASHBOARD_SNAPSHOT_ARTIFACTS", "sentiment_model").split(",") if name.strip()
+]
+
+# Engine for the heavy analytics endpoints (summary, sentiment_distribution, price_discount_analysis,
+# top_products): "pandas" (default) or "duckdb", which runs them as SQL in an embedded DuckDB over
+# the memory-mapped snapshot. Without a loaded snapshot the pandas engine is used.
+ANALYTICS_ENGINE = os.getenv("DASHBOARD_ANALYTICS_ENGINE", "pandas").strip().lower()
+
+# Bulk product writes (POST/PATCH /products/bulk): products per bulk_write round trip, and the
+# most products one request may carry
+PRODUCT_BULK_BATCH_SIZE = _env_int("DASHBOARD_PRODUCT_BULK_BATCH_SIZE", 500)
+PRODUCT_BULK_MAX_ITEMS = _env_int("DASHBOARD_PRODUCT_BULK_MAX_ITEMS", 10000)
+
+# GET /users/ and GET /reviews/: documents per page by default, the most a page may hold, the most a
+# streamed (NDJSON) page may hold, and how long clients may cache a page
+LIST_PAGE_SIZE = _env_int("DASHBOARD_LIST_PAGE_SIZE", 100)
+LIST_MAX_PAGE_SIZE = _env_int("DASHBOARD_LIST_MAX_PAGE_SIZE", 1000)
+LIST_STREAM_MAX_ITEMS = _env_int("DASHBOARD_LIST_STREAM_MAX_ITEMS", 50000)
+LIST_CACHE_SECONDS = _env_int("DASHBOARD_LIST_CACHE_SECONDS", 10)
+
+# Coalescing of identical concurrent analytics requests (see app/singleflight.py), and how long a
+# finished result keeps being served to identical requests
+SINGLEFLIGHT_ENABLED = _env_flag("DASHBOARD_SINGLEFLIGHT_ENABLED", True)
+SINGLEFLIGHT_HOLD_SECONDS = _env_float("DASHBOARD_SINGLEFLIGHT_HOLD_SECONDS", 1.0)
+
+# Admission control for expensive analytics endpoints (see app/admission.py): cost units that may
+# run at once per worker, requests that may wait for them, seconds a request waits before a 503,
+# and the Retry-After sent with 429/503 rejections
+ADMISSION_ENABLED = _env_flag("DASHBOARD_ADMISSION_ENABLED", True)
+ADMISSION_CAPACITY = _env_int("DASHBOARD_ADMISSION_CAPACITY", 8)
+ADMISSION_MAX_QUEUE = _env_int("DASHBOARD_ADMISSION_MAX_QUEUE", 32)
+ADMISSION_QUEUE_TIMEOUT = _env_float("DASHBOARD_ADMISSION_QUEUE_TIMEOUT", 10.0)
+ADMISSION_RETRY_AFTER = _env_int("DASHBOARD_ADMISSION_RETRY_AFTER", 5)
+
+# Training of the /analytics/sentiment_analysis classifier: "streaming" (default) hashes review
+# text into 2**SENTIMENT_HASH_BITS features and trains incrementally in chunks of
+# SENTIMENT_TRAIN_CHUNK_SIZE reviews with bounded memory; "batch" fits TF-IDF and logistic
+# regression on every review in memory. SENTIMENT_HOLDOUT_PERCENT of reviews are held out for
+# evaluation, and a streaming model is retrained once incremental updates have added
+# SENTIMENT_RETRAIN_FRACTION of the reviews it was trained on.
+SENTIMENT_TRAINING = os.getenv("DASHBOARD_SENTIMENT_TRAINING", "streaming").strip().lower()
+SENTIMENT_HASH_BITS = _env_int("DASHBOARD_SENTIMENT_HASH_BITS", 18)
+SENTIMENT_TRAIN_CHUNK_SIZE = _env_int("DASHBOARD_SENTIMENT_TRAIN_CHUNK_SIZE", 5000)
+SENTIMENT_HOLDOUT_PERCENT = _env_int("DASHBOARD_SENTIMENT_HOLDOUT_PERCENT", 20)
+SENTIMENT_RETRAIN_FRACTION = _env_float("DASHBOARD_SENTIMENT_RETRAIN_FRACTION", 0.2)
+
+# Background rescoring of stored review sentiment after the scoring model changes (see
+# app/sentiment.py): documents per batch, and seconds to pause between batches. Every worker
+# looks for a newly published scoring model every SENTIMENT_MODEL_POLL seconds.
+SENTIMENT_RESCORE_BATCH_SIZE = _env_int("DASHBOARD_SENTIMENT_RESCORE_BATCH_SIZE", 1000)
+SENTIMENT_RESCORE_PAUSE = _env_float("DASHBOARD_SENTIMENT_RESCORE_PAUSE", 0.05)
+SENTIMENT_MODEL_POLL = _env_float("DASHBOARD_SENTIMENT_MODEL_POLL", 30.0)
+
+# Word and bigram counting for /analytics/sentiment_wordcloud: "exact" keeps a counter per
+# distinct word and bigram; "approximate" keeps a fixed-size Space-Saving sketch per list (see
+# SpaceSaving in app/aggregates.py) whose counts overestimate by at most WORDCLOUD_SKETCH_ERROR
+# times the number of words (or bigrams) counted
+WORDCLOUD_COUNTING = os.getenv("DASHBOARD_WORDCLOUD_COUNTING", "exact").strip().lower()
+WORDCLOUD_SKETCH_ERROR = _env_float("DASHBOARD_WORDCLOUD_SKETCH_ERROR", 0.0002)
+
+# Background analytics jobs (POST /analytics/jobs, see app/jobs.py). Each API process runs
+# JOB_WORKERS job workers (0 leaves the jobs to `python -m app.jobs` processes); idle workers
+# look for new jobs every JOB_POLL_INTERVAL seconds. A running job is leased to its worker for
+# JOB_LEASE_SECONDS at a time, renewed while it runs, so the job of a worker that died is run
+# again, up to JOB_MAX_ATTEMPTS times. A job refused by admission control is retried after
+# JOB_RETRY_DELAY seconds. Finished jobs and their results are kept for JOB_RESULT_TTL seconds.
+JOB_WORKERS = _env_int("DASHBOARD_JOB_WORKERS", 1)
+JOB_POLL_INTERVAL = _env_float("DASHBOARD_JOB_POLL_INTERVAL", 2.0)
+JOB_LEASE_SECONDS = _env_float("DASHBOARD_JOB_LEASE_SECONDS", 60.0)
+JOB_MAX_ATTEMPTS = _env_int("DASHBOARD_JOB_MAX_ATTEMPTS", 3)
+JOB_RETRY_DELAY = _env_float("DASHBOARD_JOB_RETRY_DELAY", 5.0)
+JOB_RESULT_TTL = _env_int("DASHBOARD_JOB_RESULT_TTL", 3600)
+
+# Response compression (see app/compression.py): encodings offered, in order of preference (br
+# needs the brotli package and zstd the zstandard package; those not installed are skipped),
+# bodies smaller than COMPRESSION_MIN_SIZE bytes are sent uncompressed, bodies of at least
+# COMPRESSION_THREAD_MIN_SIZE bytes are compressed in a worker thread, and the level per encoding
+COMPRESSION_ENABLED = _env_flag("DASHBOARD_COMPRESSION_ENABLED", True)
+COMPRESSION_ENCODINGS = [
+    name.strip().lower() for name in os.getenv("DASHBOARD_COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if name.strip()
+]
+COMPRESSION_MIN_SIZE = _env_int("DASHBOARD_COMPRESSION_MIN_SIZE", 1024)
+COMPRESSION_THREAD_MIN_SIZE = _env_int("DASHBOARD_COMPRESSION_THREAD_MIN_SIZE", 64 * 1024)
+COMPRESSION_GZIP_LEVEL = _env_int("DASHBOARD_COMPRESSION_GZIP_LEVEL", 6)
+COMPRESSION_BROTLI_QUALITY = _env_int("DASHBOARD_COMPRESSION_BROTLI_QUALITY", 4)
+COMPRESSION_ZSTD_LEVEL = _env_int("DASHBOARD_COMPRESSION_ZSTD_LEVEL", 3)
+
+# /analytics/summary keeps the same size however large the catalogue grows: ratings as a histogram
+# of SUMMARY_RATING_BINS equal bins, rating_stats as the SUMMARY_RATING_TOP_K most rated products,
+# and low_stock_products as the SUMMARY_LOW_STOCK_LIMIT products lowest in stock (inventory below
+# LOW_STOCK_THRESHOLD, read from the inventory index). Requests may ask for up to SUMMARY_MAX_ITEMS
+# of either list; every product's rating stats are paged through /analytics/summary/rating_stats.
+SUMMARY_RATING_BINS = _env_int("DASHBOARD_SUMMARY_RATING_BINS", 10)
+SUMMARY_RATING_TOP_K = _env_int("DASHBOARD_SUMMARY_RATING_TOP_K", 20)
+SUMMARY_LOW_STOCK_LIMIT = _env_int("DASHBOARD_SUMMARY_LOW_STOCK_LIMIT", 50)
+SUMMARY_MAX_ITEMS = _env_int("DASHBOARD_SUMMARY_MAX_ITEMS", 1000)
+LOW_STOCK_THRESHOLD = _env_int("DASHBOARD_LOW_STOCK_THRESHOLD", 10)
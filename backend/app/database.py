@@ -16,5 +16,20 @@ product_collection = database.get_collection("amazon-sales")
 user_collection = database.get_collection("users")
 review_collection = database.get_collection("reviews")
 
+# Precomputed analytics maintained on product writes
+price_bucket_collection = database.get_collection("price_bucket_stats")
+price_trend_collection = database.get_collection("price_trend_stats")
+sentiment_rollup_collection = database.get_collection("sentiment_rollup")
+analytics_meta_collection = database.get_collection("analytics_meta")
+
+# Coefficients of the published review sentiment model (see app/sentiment.py)
+sentiment_model_collection = database.get_collection("sentiment_models")
+
+# Background analytics jobs and their results (see app/jobs.py)
+analytics_job_collection = database.get_collection("analytics_jobs")
+
+# Ids of deleted products, so analytical snapshots can drop them when catching up
+product_tombstone_collection = database.get_collection("product_tombstones")
+
 def get_database():
     return database
@@ -0,0 +1,330 @@
+# app/duckdb_engine.py
+#
+# DuckDB engine for the heavy analytics endpoints, enabled with DASHBOARD_ANALYTICS_ENGINE=duckdb.
+# Queries run as vectorized, multi-threaded SQL over the snapshot's Arrow tables (see
+# app/snapshot.py), which DuckDB scans in place without copying. Each function returns the same
+# shape as the pandas implementation of its endpoint, and runs in a worker thread so the event
+# loop keeps serving while DuckDB works.
+
+import asyncio
+import copy
+import math
+import threading
+from typing import List, Optional, Union
+
+import duckdb
+
+from app.config import PRICE_BUCKET_BASE_WIDTH, SENTIMENT_NEUTRAL_ABOVE, SENTIMENT_POSITIVE_MIN
+from app.partial_aggregates import RATING_SCALE, rating_histogram
+from app.price_buckets import bucket_ranges
+
+# One in-process database; every query gets its own cursor with the tables registered on it
+_connection = None
+
+# Product table (with _row) registered for the snapshot and version it was derived from. The
+# snapshot itself is held, not its id(), which a later snapshot could be given once it is freed
+_products_cache = {'snapshot': None, 'version': None, 'table': None}
+# Worker threads check and fill the cache under this lock, so concurrent queries derive it once
+_products_lock = threading.Lock()
+
+TOP_PRODUCT_SORTS = ['popularity_score', 'total_sales', 'profit']
+
+# Sales and profit as estimated by the summary: the product's own cost price or 70% of the actual price
+SUMMARY_BASE = """
+    SELECT
+        _row, product_id, product_name, main_category, discount_percentage,
+        discounted_price * rating_count AS sales,
+        (discounted_price - coalesce(cost_price, actual_price * 0.7)) * rating_count AS profit
+    FROM products
+"""
+
+# Same grouping and thresholds as the materialized rollup in app/sentiment_rollup.py
+SENTIMENT_SQL = """
+    SELECT
+        trim(split_part(category, '|', 1)) AS main_category,
+        CASE WHEN strpos(category, '|') > 0 THEN trim(split_part(category, '|', 2)) ELSE 'Unknown' END AS subcategory,
+        count(*) FILTER (WHERE rating >= $positive_min) AS positive,
+        count(*) FILTER (WHERE rating < $positive_min AND rating > $neutral_above) AS neutral,
+        count(*) FILTER (WHERE rating < $positive_min AND rating <= $neutral_above) AS negative,
+        sum(rating) AS rating_sum,
+        count(*) AS rating_count
+    FROM products
+    WHERE category IS NOT NULL AND rating > 0
+    GROUP BY ALL
+    ORDER BY main_category, subcategory
+"""
+
+# Products with both a price and a discount, on the base bucket grid of app/price_buckets.py
+PRICED_PRODUCTS = """
+    SELECT
+        actual_price AS price,
+        discount_percentage AS discount,
+        greatest(ceil(actual_price / $base_width) - 1, 0) AS bucket
+    FROM products
+    WHERE actual_price IS NOT NULL AND discount_percentage IS NOT NULL
+"""
+
+# Sales and profit as estimated by /analytics/top_products; products without both stay at 0
+TOP_PRODUCTS_BASE = """
+    SELECT
+        _row, product_id, product_name, category, actual_price, discounted_price, discount_percentage,
+        rating, rating_count,
+        rating * rating_count AS popularity_score,
+        CASE WHEN discounted_price IS NOT NULL AND rating_count IS NOT NULL
+            THEN discounted_price * rating_count ELSE 0 END AS total_sales,
+        CASE WHEN discounted_price IS NOT NULL AND rating_count IS NOT NULL
+            THEN (discounted_price - coalesce(actual_price * 0.7, 0)) * rating_count ELSE 0 END AS profit
+    FROM products
+    WHERE product_name IS NOT NULL AND rating IS NOT NULL AND rating_count IS NOT NULL
+"""
+
+
+def _cursor():
+    global _connection
+    if _connection is None:
+        _connection = duckdb.connect()
+    return _connection.cursor()
+
+
+def _product_table(snapshot, products):
+    """
+    Returns the snapshot's live products plus a _row column holding the scan order, which the
+    queries use to order groups and break ties the way the pandas code does. Runs in a worker
+    thread: `products` is a copy of snapshot.products taken on the event loop, which the
+    catch-up's replaces do not change while it is read here.
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    with _products_lock:
+        if _products_cache['snapshot'] is not snapshot or _products_cache['version'] != products.version:
+            table = products.to_table(products.base.column_names)
+            table = table.append_column('_row', pa.array(np.arange(table.num_rows, dtype='int64')))
+            _products_cache.update(snapshot=snapshot, version=products.version, table=table)
+        return _products_cache['table']
+
+
+async def _run(snapshot, query, *args):
+    """
+    Runs `query` over the snapshot's product table in a worker thread, deriving the table there
+    too when a write made the cached one stale.
+    """
+    # The live table's arrays are replaced, never mutated, so a shallow copy is a consistent view
+    products = copy.copy(snapshot.products)
+    return await asyncio.to_thread(lambda: query(_product_table(snapshot, products), *args))
+
+
+def _query(table, sql: str, parameters: Optional[Union[list, dict]] = None) -> List[dict]:
+    cursor = _cursor()
+    try:
+        cursor.register('products', table)
+        cursor.execute(sql, parameters or [])
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _finite(value) -> Optional[float]:
+    # DuckDB reports undefined statistics (e.g. the correlation of a constant) as NaN
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return float(value)
+
+
+def _summary(table, rating_bins: int, rating_top_k: int) -> dict:
+    totals = _query(table, f"""
+        SELECT count(*) AS total_products, coalesce(sum(sales), 0) AS total_sales, coalesce(sum(profit), 0) AS total_profit
+        FROM ({SUMMARY_BASE})
+    """)[0]
+    # Categories in order of first appearance
+    categories = _query(table, f"""
+        SELECT
+            main_category,
+            count(*) AS total_products,
+            coalesce(sum(sales), 0) AS total_sales,
+            coalesce(sum(profit), 0) AS total_profit,
+            coalesce(avg(discount_percentage), 0) AS average_discount
+        FROM ({SUMMARY_BASE})
+        GROUP BY main_category
+        ORDER BY min(_row)
+    """)
+    top_selling = _query(table, f"""
+        SELECT product_id, product_name, sales FROM ({SUMMARY_BASE})
+        WHERE sales IS NOT NULL
+        ORDER BY sales DESC, _row
+        LIMIT 5
+    """)
+    # Same bins as rating_bin_counts in app/partial_aggregates.py
+    rating_bins_rows = _query(table, """
+        SELECT least(floor(rating * $bins / $scale), $bins - 1)::BIGINT AS bin, count(*) AS products
+        FROM products
+        WHERE rating >= 0 AND rating <= $scale
+        GROUP BY ALL
+    """, {'bins': rating_bins, 'scale': RATING_SCALE})
+    rating_counts = [0] * rating_bins
+    for row in rating_bins_rows:
+        rating_counts[row['bin']] = row['products']
+    rating_stats = _query(table, """
+        SELECT product_id, product_name, rating, rating_count FROM products
+        WHERE rating_count IS NOT NULL
+        ORDER BY rating_count DESC, _row
+        LIMIT $top_k
+    """, {'top_k': rating_top_k})
+
+    return {
+        'total_products': totals['total_products'],
+        'total_sales': float(totals['total_sales']),
+        'total_revenue': float(totals['total_sales']),
+        'total_profit': float(totals['total_profit']),
+        'category_stats': {
+            row['main_category']: {
+                'total_products': row['total_products'],
+                'total_sales': float(row['total_sales']),
+                'total_revenue': float(row['total_sales']),
+                'total_profit': float(row['total_profit']),
+                'average_discount': float(row['average_discount']),
+            }
+            for row in categories
+        },
+        'top_selling_products': top_selling,
+        'rating_histogram': rating_histogram(rating_counts, totals['total_products'] - sum(rating_counts)),
+        'rating_stats': rating_stats,
+    }
+
+
+def _sentiment_rows(table) -> List[dict]:
+    rows = _query(table, SENTIMENT_SQL, {
+        'positive_min': SENTIMENT_POSITIVE_MIN,
+        'neutral_above': SENTIMENT_NEUTRAL_ABOVE,
+    })
+    # Shaped like the rollup documents, so the endpoint formats both the same way
+    return [
+        {'_id': {'main_category': row.pop('main_category'), 'subcategory': row.pop('subcategory')}, **row}
+        for row in rows
+    ]
+
+
+def _price_discount_analysis(table, edges: List[float]) -> Optional[dict]:
+    parameters = {'base_width': PRICE_BUCKET_BASE_WIDTH}
+    overall = _query(table, f"""
+        SELECT
+            count(*) AS count,
+            avg(discount) AS mean,
+            median(discount) AS median,
+            min(discount) AS min,
+            max(discount) AS max,
+            stddev_samp(discount) AS std,
+            corr(price, discount) AS correlation,
+            max(floor(price)) AS max_price
+        FROM ({PRICED_PRODUCTS})
+    """, parameters)[0]
+    if overall['count'] == 0:
+        return None
+
+    # Raises ValueError for bad edges, like the precomputed buckets
+    ranges = bucket_ranges(edges, overall['max_price'], PRICE_BUCKET_BASE_WIDTH)
+    per_range = _query(table, f"""
+        SELECT
+            ranges.position,
+            count(*) AS count,
+            avg(discount) AS mean,
+            median(discount) AS median,
+            stddev_samp(discount) AS std
+        FROM ({PRICED_PRODUCTS}) AS priced
+        JOIN (SELECT unnest($starts) AS start, unnest($ends) AS stop, unnest($positions) AS position) AS ranges
+            ON priced.bucket >= ranges.start AND (ranges.stop IS NULL OR priced.bucket < ranges.stop)
+        GROUP BY ranges.position
+        ORDER BY ranges.position
+    """, {
+        **parameters,
+        'starts': [start for _, start, _ in ranges],
+        'ends': [end for _, _, end in ranges],
+        'positions': list(range(len(ranges))),
+    })
+
+    r = _finite(overall['correlation'])
+    return {
+        "per_price_range_stats": [
+            {
+                'price_range': ranges[row['position']][0],
+                'average_discount_percentage': row['mean'],
+                'median_discount_percentage': row['median'],
+                'std_discount_percentage': _finite(row['std']),
+                'product_count': row['count'],
+            }
+            for row in per_range
+        ],
+        "overall_stats": {
+            'average_discount_percentage': overall['mean'],
+            'median_discount_percentage': overall['median'],
+            'min_discount_percentage': overall['min'],
+            'max_discount_percentage': overall['max'],
+            'std_discount_percentage': _finite(overall['std']),
+            'total_products': overall['count'],
+        },
+        "price_discount_correlation": {
+            'actual_price': {'actual_price': 1.0, 'discount_percentage': r},
+            'discount_percentage': {'actual_price': r, 'discount_percentage': 1.0},
+        },
+    }
+
+
+def _top_products(
+    table,
+    category_pattern: Optional[str],
+    min_rating: Optional[float],
+    max_rating: Optional[float],
+    sort_by: str,
+    page: int,
+    page_size: int,
+) -> dict:
+    conditions = []
+    parameters = {}
+    if category_pattern:
+        # Same case-insensitive match as the MongoDB $regex filter
+        conditions.append("regexp_matches(category, $pattern, 'i')")
+        parameters['pattern'] = category_pattern
+    if min_rating is not None:
+        conditions.append("rating >= $min_rating")
+        parameters['min_rating'] = min_rating
+    if max_rating is not None:
+        conditions.append("rating <= $max_rating")
+        parameters['max_rating'] = max_rating
+    if sort_by not in TOP_PRODUCT_SORTS:
+        sort_by = 'popularity_score'
+
+    filtered = TOP_PRODUCTS_BASE + "".join(f" AND {condition}" for condition in conditions)
+    total_count = _query(table, f"SELECT count(*) AS total FROM ({filtered})", parameters)[0]['total']
+    products = _query(table, f"""
+        SELECT
+            product_id, product_name, category, actual_price, discounted_price, discount_percentage,
+            rating, rating_count, popularity_score, total_sales, profit
+        FROM ({filtered})
+        ORDER BY {sort_by} DESC, _row
+        LIMIT $limit OFFSET $offset
+    """, {**parameters, 'limit': page_size, 'offset': (page - 1) * page_size})
+    return {"total_count": total_count, "products": products}
+
+
+async def summary(snapshot, rating_bins: int, rating_top_k: int) -> dict:
+    """
+    Returns the summary without its low-stock products, which the endpoint reads from MongoDB.
+    """
+    return await _run(snapshot, _summary, rating_bins, rating_top_k)
+
+
+async def sentiment_rows(snapshot) -> List[dict]:
+    return await _run(snapshot, _sentiment_rows)
+
+
+async def price_discount_analysis(snapshot, edges: List[float]) -> Optional[dict]:
+    """
+    Returns the price_discount_analysis response, or None if no product has both a price and a
+    discount. Medians are exact rather than read from the discount sketch.
+    """
+    return await _run(snapshot, _price_discount_analysis, edges)
+
+
+async def top_products(snapshot, category_pattern, min_rating, max_rating, sort_by, page, page_size) -> dict:
+    return await _run(snapshot, _top_products, category_pattern, min_rating, max_rating, sort_by, page, page_size)
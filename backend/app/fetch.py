@@ -0,0 +1,132 @@
+# app/fetch.py
+
+import logging
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from app.config import ANALYTICS_FETCH_BATCH_SIZE, ANALYTICS_SCAN_BATCH_SIZE
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Documents are returned as raw BSON: the driver skips decoding until a field is read, and the
+# size of what the server sent is known for free from len(document.raw)
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+# Per-endpoint transfer counters for this process
+transfer_stats: Dict[str, Dict[str, float]] = defaultdict(lambda: {
+    'scans': 0,
+    'documents': 0,
+    'bytes': 0,
+    'seconds': 0.0,
+})
+
+# Set by whoever wants to follow the scans of the current task (like a background job): the
+# documents its scans have read so far
+scan_progress: ContextVar[Optional[Dict[str, int]]] = ContextVar('scan_progress', default=None)
+
+
+def projection_for(fields: Sequence[str]) -> dict:
+    projection = {field: 1 for field in fields}
+    if '_id' not in projection:
+        projection['_id'] = 0
+    return projection
+
+
+async def iter_batches(
+    collection,
+    fields: Sequence[str],
+    endpoint: str,
+    query: Optional[dict] = None,
+    batch_size: int = ANALYTICS_SCAN_BATCH_SIZE,
+) -> AsyncIterator[List[RawBSONDocument]]:
+    """
+    Streams the documents matching `query` in lists of up to `batch_size`, fetching only `fields`.
+
+    Parameters:
+        collection: Motor collection to scan.
+        fields (Sequence[str]): Fields the caller needs; everything else stays on the server.
+        endpoint (str): Name the transferred bytes are reported under.
+        query (dict, optional): Filter for the scan.
+        batch_size (int, optional): Number of documents per yielded list.
+
+    Yields:
+        list: Raw BSON documents, which behave like read-only dicts.
+    """
+    projection = projection_for(fields)
+    raw_collection = collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+    cursor = raw_collection.find(query or {}, projection, batch_size=ANALYTICS_FETCH_BATCH_SIZE)
+
+    stats = transfer_stats[endpoint]
+    stats['scans'] += 1
+    progress = scan_progress.get()
+    started = time.perf_counter()
+    batch = []
+    try:
+        async for document in cursor:
+            stats['documents'] += 1
+            stats['bytes'] += len(document.raw)
+            batch.append(document)
+            if len(batch) >= batch_size:
+                if progress is not None:
+                    progress['documents'] += len(batch)
+                yield batch
+                batch = []
+        if batch:
+            if progress is not None:
+                progress['documents'] += len(batch)
+            yield batch
+    finally:
+        stats['seconds'] += time.perf_counter() - started
+
+
+async def iter_column_batches(
+    collection,
+    fields: Sequence[str],
+    endpoint: str,
+    query: Optional[dict] = None,
+    batch_size: int = ANALYTICS_SCAN_BATCH_SIZE,
+) -> AsyncIterator[Dict[str, list]]:
+    """
+    Same as `iter_batches`, but decodes each batch straight into one list per field
+    (missing fields are None), ready for the column cleaners in app/cleaning.py.
+    """
+    async for batch in iter_batches(collection, fields, endpoint, query, batch_size):
+        yield {field: [document.get(field) for document in batch] for field in fields}
+
+
+async def fetch_columns(
+    collection,
+    fields: Sequence[str],
+    endpoint: str,
+    query: Optional[dict] = None,
+) -> Dict[str, list]:
+    """
+    Fetches whole columns for `fields` in one projected scan.
+    """
+    columns: Dict[str, list] = {field: [] for field in fields}
+    async for batch in iter_column_batches(collection, fields, endpoint, query):
+        for field in fields:
+            columns[field].extend(batch[field])
+    return columns
+
+
+async def fetch_documents(
+    collection,
+    fields: Sequence[str],
+    endpoint: str,
+    query: Optional[dict] = None,
+) -> List[RawBSONDocument]:
+    """
+    Fetches every matching document, projected to `fields`, in one scan.
+    """
+    documents = []
+    async for batch in iter_batches(collection, fields, endpoint, query):
+        documents.extend(batch)
+    return documents
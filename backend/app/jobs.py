@@ -0,0 +1,367 @@
+# app/jobs.py
+#
+# Background jobs for analytics that take longer than a client or proxy waits on one request:
+# model training, full word clouds, snapshots, rescoring stored sentiment. POST /analytics/jobs
+# stores a job in the analytics_jobs collection and returns its id at once; job workers claim
+# pending jobs, run them and store their status, progress and result, which
+# GET /analytics/jobs/{id} returns.
+#
+# A job's task is one of the analytics endpoints (JOB_TASKS) and its params are that endpoint's
+# query parameters, validated on submission with the endpoint's own defaults and bounds. The
+# worker calls the endpoint function, so the result is the endpoint's response, an identical
+# request in flight is shared (see app/singleflight.py) and the job takes its share of the
+# admission budget like a request would; a job refused for lack of capacity is retried later.
+#
+# - Claiming is one find_one_and_update, so a job runs in one worker across all processes. A
+#   running job is leased; its worker renews the lease, and stores the progress, while it runs.
+#   A job whose lease ran out (its worker died) is claimed again, up to JOB_MAX_ATTEMPTS times.
+# - Identical jobs (same task and validated params) are not queued twice: while pending or
+#   running a job holds its key in `active_key`, which has a unique index, and submitting an
+#   identical job returns the one holding it.
+# - Finished jobs are removed JOB_RESULT_TTL seconds after they finished (TTL index).
+#
+# Every API process runs JOB_WORKERS workers; `python -m app.jobs` runs a process of workers only.
+
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+from pymongo.errors import DocumentTooLarge, DuplicateKeyError
+
+from app.compression import EncodedJSONResponse
+from app.config import (
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_RESULT_TTL,
+    JOB_RETRY_DELAY,
+    JOB_WORKERS,
+)
+from app.database import analytics_job_collection, product_collection
+from app.fetch import scan_progress
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Task name -> the analytics endpoint function that runs it
+JOB_TASKS = {
+    'summary': 'get_summary',
+    'sentiment_analysis': 'sentiment_analysis',
+    'sentiment_wordcloud': 'sentiment_wordcloud',
+    'sentiment_distribution': 'sentiment_distribution',
+    'sentiment_rescore': 'rescore_sentiment',
+    'price_trend': 'get_price_trend',
+    'price_discount_analysis': 'price_discount_analysis',
+    'rating_discount_correlation': 'rating_discount_correlation',
+    'partial': 'get_partial',
+    'snapshot': 'create_snapshot',
+}
+
+# Responses of the admission control that mean "busy, try again later"
+RETRY_STATUS_CODES = (429, 503)
+
+# Set when a job is submitted in this process, so idle workers here claim it without waiting
+_wake = asyncio.Event()
+
+_workers: List[asyncio.Task] = []
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _endpoint(task: str):
+    # The router imports this module, so it is imported here on first use
+    from app.routers import analytics
+
+    return getattr(analytics, JOB_TASKS[task])
+
+
+@functools.lru_cache(maxsize=None)
+def _params_model(task: str):
+    """
+    A pydantic model of the task endpoint's query and path parameters, with their defaults
+    and bounds.
+    """
+    from pydantic import ConfigDict, create_model
+
+    parameters = inspect.signature(_endpoint(task)).parameters
+    return create_model(
+        f"{task}_params",
+        __config__=ConfigDict(extra='forbid'),
+        **{name: (parameter.annotation, parameter.default) for name, parameter in parameters.items()},
+    )
+
+
+def validate_params(task: str, params: Optional[dict]) -> dict:
+    """
+    The task's params with defaults filled in, in their JSON form.
+
+    Raises:
+        ValueError: If the task is unknown or the params are not valid for it.
+    """
+    from pydantic import ValidationError
+
+    if task not in JOB_TASKS:
+        raise ValueError(f"Unknown task '{task}'. Tasks: {', '.join(JOB_TASKS)}.")
+    try:
+        return _params_model(task)(**(params or {})).model_dump(mode='json')
+    except ValidationError as e:
+        raise ValueError(f"Invalid params for {task}: {e}")
+
+
+def job_key(task: str, params: dict) -> str:
+    return f"{task}:{json.dumps(params, sort_keys=True)}"
+
+
+async def create_indexes():
+    await analytics_job_collection.create_index([("status", 1), ("created_at", 1)])
+    await analytics_job_collection.create_index(
+        "active_key", unique=True, partialFilterExpression={"active_key": {"$exists": True}}
+    )
+    await analytics_job_collection.create_index("expires_at", expireAfterSeconds=0)
+
+
+async def submit_job(task: str, params: Optional[dict] = None) -> Tuple[dict, bool]:
+    """
+    Queues a job, unless an identical one is pending or running.
+
+    Returns:
+        tuple: (the job document, whether it was created rather than an identical one found)
+
+    Raises:
+        ValueError: If the task is unknown or the params are not valid for it.
+    """
+    params = validate_params(task, params)
+    key = job_key(task, params)
+    while True:
+        now = _now()
+        job = {
+            "_id": uuid.uuid4().hex,
+            "task": task,
+            "params": params,
+            "status": "pending",
+            "active_key": key,
+            "attempts": 0,
+            "progress": {"documents_scanned": 0, "catalogue_documents": None, "fraction": 0.0},
+            "created_at": now,
+            "not_before": now,
+        }
+        try:
+            await analytics_job_collection.insert_one(job)
+        except DuplicateKeyError:
+            existing = await analytics_job_collection.find_one({"active_key": key})
+            if existing is not None:
+                return existing, False
+            # The identical job finished in between; queue this one
+            continue
+        _wake.set()
+        return job, True
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    return await analytics_job_collection.find_one({"_id": job_id})
+
+
+def describe(job: dict) -> dict:
+    """
+    The API form of a job document.
+    """
+    description = {
+        "id": job["_id"],
+        "task": job["task"],
+        "params": job["params"],
+        "status": job["status"],
+        "progress": job.get("progress"),
+        "attempts": job.get("attempts", 0),
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "expires_at": job.get("expires_at"),
+    }
+    if job["status"] == "succeeded":
+        description["result"] = job.get("result")
+    if job["status"] == "failed":
+        description["error"] = job.get("error")
+    return description
+
+
+async def _claim(worker: str) -> Optional[dict]:
+    """
+    Takes the oldest job that is due, or running on a lease that ran out.
+    """
+    now = _now()
+    return await analytics_job_collection.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "not_before": {"$lte": now}},
+            {"status": "running", "lease_until": {"$lt": now}},
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "worker": worker,
+                "started_at": now,
+                "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _progress(progress: Dict[str, int], catalogue: int, done: bool = False) -> dict:
+    # The fraction is an estimate: documents read by the job's scans against the catalogue size,
+    # held below 1 until the job is done (some tasks read the catalogue more than once)
+    fraction = 1.0 if done else min(progress['documents'] / catalogue, 0.99) if catalogue else 0.0
+    return {"documents_scanned": progress['documents'], "catalogue_documents": catalogue, "fraction": fraction}
+
+
+async def _finish(job: dict, worker: str, changes: dict) -> bool:
+    """
+    Stores the outcome of a job, if this worker still holds it.
+    """
+    now = _now()
+    changes = {"finished_at": now, "expires_at": now + timedelta(seconds=JOB_RESULT_TTL), **changes}
+    result = await analytics_job_collection.update_one(
+        {"_id": job["_id"], "worker": worker, "status": "running"},
+        {"$set": changes, "$unset": {"active_key": "", "lease_until": ""}},
+    )
+    return result.matched_count > 0
+
+
+async def _execute(task: str, params: dict, progress: Dict[str, int]):
+    # Runs as its own asyncio task, so the progress counter is only seen by this job's scans
+    scan_progress.set(progress)
+    result = await _endpoint(task)(**params)
+    # A coalesced endpoint returns its result encoded for the response; the job stores the value
+    return result.entry.content if isinstance(result, EncodedJSONResponse) else result
+
+
+async def _run(job: dict, worker: str):
+    """
+    Runs a claimed job to completion, renewing its lease while it runs.
+    """
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        await _finish(job, worker, {"status": "failed", "error": f"Gave up after {JOB_MAX_ATTEMPTS} attempts."})
+        return
+
+    try:
+        catalogue = await product_collection.estimated_document_count()
+    except Exception:
+        catalogue = 0
+    progress = {'documents': 0}
+    running = asyncio.ensure_future(_execute(job["task"], job["params"], progress))
+    while True:
+        done, _ = await asyncio.wait([running], timeout=JOB_LEASE_SECONDS / 3)
+        if done:
+            break
+        try:
+            renewed = await analytics_job_collection.update_one(
+                {"_id": job["_id"], "worker": worker, "status": "running"},
+                {"$set": {
+                    "lease_until": _now() + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "progress": _progress(progress, catalogue),
+                }},
+            )
+        except Exception as e:
+            logger.error(f"Error renewing the lease of job {job['_id']}: {e}")
+            continue
+        if renewed.matched_count == 0:
+            # Another worker took the job over after the lease ran out
+            running.cancel()
+            logger.warning(f"Lost the lease of job {job['_id']} ({job['task']}); stopped running it.")
+            return
+
+    try:
+        result = running.result()
+    except HTTPException as e:
+        if e.status_code in RETRY_STATUS_CODES:
+            # No analytics capacity right now; does not count as an attempt
+            await analytics_job_collection.update_one(
+                {"_id": job["_id"], "worker": worker, "status": "running"},
+                {
+                    "$set": {"status": "pending", "not_before": _now() + timedelta(seconds=JOB_RETRY_DELAY)},
+                    "$unset": {"lease_until": "", "worker": ""},
+                    "$inc": {"attempts": -1},
+                },
+            )
+            return
+        await _finish(job, worker, {"status": "failed", "error": e.detail, "progress": _progress(progress, catalogue)})
+        return
+    except Exception as e:
+        logger.error(f"Job {job['_id']} ({job['task']}) failed: {e}")
+        await _finish(job, worker, {"status": "failed", "error": str(e), "progress": _progress(progress, catalogue)})
+        return
+
+    try:
+        await _finish(job, worker, {
+            "status": "succeeded",
+            "result": jsonable_encoder(result),
+            "progress": _progress(progress, catalogue, done=True),
+        })
+    except DocumentTooLarge:
+        await _finish(job, worker, {"status": "failed", "error": "The result is too large to store."})
+    logger.info(f"Job {job['_id']} ({job['task']}) finished after reading {progress['documents']} documents.")
+
+
+async def run_worker(worker: str):
+    """
+    Claims and runs jobs until cancelled, waiting JOB_POLL_INTERVAL between polls when idle.
+    """
+    while True:
+        try:
+            job = await _claim(worker)
+            if job is not None:
+                await _run(job, worker)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job worker {worker} error: {e}")
+        try:
+            await asyncio.wait_for(_wake.wait(), JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+
+async def start_workers(count: int = JOB_WORKERS):
+    """
+    Creates the job indexes and starts this process's job workers.
+    """
+    try:
+        await create_indexes()
+    except Exception as e:
+        logger.error(f"Error creating job indexes: {e}")
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    while len(_workers) < count:
+        _workers.append(asyncio.ensure_future(run_worker(f"{prefix}:{len(_workers)}")))
+
+
+async def _serve(count: int):
+    await start_workers(count)
+    await asyncio.gather(*_workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run analytics job workers without the HTTP API.")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1), help="Job workers in this process")
+    args = parser.parse_args()
+    asyncio.run(_serve(args.workers))
+
+
+if __name__ == "__main__":
+    main()
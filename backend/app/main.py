@@ -2,11 +2,12 @@
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.compression import CompressionMiddleware
+from app.config import ANALYTICS_ENABLED
 from app.routers.products import router as products_router
 from app.routers.users import router as users_router
 from app.routers.reviews import router as reviews_router
 from app.routers.data import router as data_router  # Import the data router directly
-from app.routers.analytics import router as analytics_router
 
 app = FastAPI()
 
@@ -17,11 +18,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Cursor of the next page of GET /users/, /reviews/ and /analytics/summary/rating_stats
 )
 
+# Compresses responses in the encoding the client accepts (see app/compression.py)
+app.add_middleware(CompressionMiddleware)
+
 # Include routers
 app.include_router(products_router)
 app.include_router(users_router)
 app.include_router(reviews_router)
 app.include_router(data_router)  # Include the data router
-app.include_router(analytics_router)
+
+# The analytics router is optional so CRUD-only workers can skip it entirely
+if ANALYTICS_ENABLED:
+    from app.routers.analytics import router as analytics_router
+    app.include_router(analytics_router)
+
+    @app.on_event("startup")
+    async def load_analytics_snapshot():
+        # Map the latest analytical snapshot (if configured) before the first request
+        from app.snapshot import load_on_startup
+        await load_on_startup()
+
+    @app.on_event("startup")
+    async def start_job_workers():
+        # Runs background analytics jobs (POST /analytics/jobs) in this process
+        from app.jobs import start_workers
+        await start_workers()
+
+    @app.on_event("startup")
+    async def start_sentiment_rescoring():
+        # Loads the published sentiment model and has reviews stored without a score of it
+        # rescored by a job; after start_job_workers, which creates the job indexes
+        from app.sentiment import start_rescoring
+        await start_rescoring()
@@ -108,6 +108,17 @@ class ProductBase(BaseModel):
 class ProductCreate(ProductBase):
     pass
 
+class ProductBulkCreate(ProductCreate):
+    # Catalogue key: items that carry one are upserted on it, the rest are inserted
+    product_id: Optional[str] = None
+
+class ProductBulkUpdate(ProductBase):
+    # Identifies the product to update: its ObjectId, or else its catalogue product_id
+    id: Optional[str] = None
+    product_id: Optional[str] = None
+    product_name: Optional[str] = None
+    category: Optional[str] = None
+
 class Product(ProductBase):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
 
@@ -200,6 +211,9 @@ class ReviewCreate(ReviewBase):
 
 class Review(ReviewBase):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
+    # Stored when the review is written (see app/sentiment.py)
+    sentiment_label: Optional[str] = None
+    sentiment_score: Optional[float] = None
 
     class Config:
         allow_population_by_field_name = True
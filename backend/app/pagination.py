@@ -0,0 +1,167 @@
+# app/pagination.py
+#
+# Keyset pagination for the plain collection listings (GET /users/, GET /reviews/). A page is
+# read with one indexed range query: documents are ordered by a list of sort keys ending in _id,
+# and the opaque cursor holds the sort key values of the last document of the previous page, so
+# every page costs the same however deep the client goes. The values are kept as canonical
+# extended JSON, so a date or an ObjectId compares as one when the next page is read, and a
+# missing or null value (which sorts before any other) is followed by the non-null ones.
+# Documents are projected to the requested fields and serialized straight from the driver,
+# without a Pydantic model per document.
+
+import base64
+import json
+import logging
+from typing import Callable, List, Optional, Sequence
+
+from bson import ObjectId, json_util
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from app.config import LIST_CACHE_SECONDS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+async def create_indexes(collection, indexes: List[list]):
+    """
+    Creates the compound indexes a listing's filters and sort order rely on. Failures are logged,
+    so an unreachable database does not stop the app from starting.
+    """
+    for keys in indexes:
+        try:
+            await collection.create_index(keys)
+        except Exception as e:
+            logger.error(f"Error creating index {keys} on {collection.name}: {e}")
+
+
+def encode_cursor(values: list) -> str:
+    encoded = json_util.dumps(values, json_options=json_util.CANONICAL_JSON_OPTIONS)
+    return base64.urlsafe_b64encode(encoded.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_keys: Sequence[str]) -> list:
+    """
+    Decodes a cursor made by encode_cursor for the same sort keys. Raises ValueError otherwise.
+    """
+    try:
+        values = json_util.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)),
+            json_options=json_util.CANONICAL_JSON_OPTIONS,
+        )
+    except (ValueError, TypeError):
+        raise ValueError("Malformed cursor.")
+    if not isinstance(values, list) or len(values) != len(sort_keys) or not isinstance(values[-1], ObjectId):
+        raise ValueError("Malformed cursor.")
+    return values
+
+
+def after_cursor(sort_keys: Sequence[str], values: list) -> dict:
+    """
+    Filter for the documents that sort after `values` in ascending (sort_keys) order.
+    """
+    branches = []
+    for position, key in enumerate(sort_keys):
+        # Equal to None matches missing values too, which sort together with nulls
+        branch = {earlier: values[index] for index, earlier in enumerate(sort_keys[:position])}
+        # Nothing is greater than null to $gt; every value that is not null sorts after it
+        branch[key] = {"$ne": None} if values[position] is None else {"$gt": values[position]}
+        branches.append(branch)
+    return branches[0] if len(branches) == 1 else {"$or": branches}
+
+
+def parse_fields(fields: Optional[str], model) -> List[str]:
+    """
+    Resolves a comma separated field selection against a model's fields (all of them by default).
+    """
+    available = [name for name, field in model.model_fields.items() if name != "id"]
+    if not fields:
+        return available
+    selected = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}.")
+    return selected
+
+
+def _formatter(model, fields: List[str]) -> Callable[[dict], dict]:
+    # Fields missing from a document get the model's default, as the model would have given them
+    defaults = {
+        name: (field.get_default(call_default_factory=True) if not field.is_required() else None)
+        for name, field in model.model_fields.items()
+    }
+
+    def format_document(document: dict) -> dict:
+        item = {"_id": str(document["_id"])}
+        for name in fields:
+            item[name] = document.get(name, defaults[name])
+        return item
+    return format_document
+
+
+async def list_page(
+    collection,
+    model,
+    query: dict,
+    sort_keys: Sequence[str],
+    cursor: Optional[str],
+    limit: int,
+    fields: Optional[str],
+    stream: bool = False,
+) -> Response:
+    """
+    Serves one page of a listing.
+
+    Parameters:
+        collection: The collection to read.
+        model: Pydantic model whose fields may be selected and whose defaults fill missing fields.
+        query (dict): Filters; an index on (filtered fields..., *sort_keys) keeps the read bounded.
+        sort_keys (list): Ascending sort order, ending with '_id'.
+        cursor (str): Cursor from the previous page, if any.
+        limit (int): Documents in this page.
+        fields (str): Comma separated fields to return (_id is always included).
+        stream (bool): Write the page as NDJSON while it is read instead of as one JSON array.
+
+    Returns:
+        Response: A JSON array with the next page's cursor in the X-Next-Cursor header, or, when
+        streaming, NDJSON documents followed by a {"next_cursor": ...} line if more remain.
+    """
+    try:
+        selected = parse_fields(fields, model)
+        if cursor:
+            after = after_cursor(sort_keys, decode_cursor(cursor, sort_keys))
+            query = {"$and": [query, after]} if query else after
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    format_document = _formatter(model, selected)
+    projection = dict.fromkeys([*selected, *sort_keys], 1)
+    # One extra document tells whether another page follows
+    documents = collection.find(query, projection).sort([(key, 1) for key in sort_keys]).limit(limit + 1)
+    documents = documents.batch_size(min(limit + 1, 1000))
+    headers = {"Cache-Control": f"private, max-age={LIST_CACHE_SECONDS}"}
+
+    def next_cursor(document: dict) -> str:
+        return encode_cursor([document.get(key) for key in sort_keys])
+
+    if stream:
+        async def lines():
+            count, last = 0, None
+            async for document in documents:
+                if count == limit:
+                    yield json.dumps({"next_cursor": next_cursor(last)}) + "\n"
+                    return
+                yield json.dumps(format_document(document), default=str) + "\n"
+                count, last = count + 1, document
+        return StreamingResponse(lines(), media_type="application/x-ndjson", headers=headers)
+
+    page = await documents.to_list(length=limit + 1)
+    if len(page) > limit:
+        page = page[:limit]
+        headers[NEXT_CURSOR_HEADER] = next_cursor(page[-1])
+    body = json.dumps([format_document(document) for document in page], default=str)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,602 @@
+# app/partial_aggregates.py
+#
+# The full-catalogue analytics as mergeable partial aggregates. An Aggregation reduces any batch
+# of product documents to a partial (map), merges two partials into one (combine) and turns the
+# partial of the whole catalogue into the endpoint's result (finalize). Combining is associative,
+# so the catalogue can be split any way -- cursor batches, _id partitions on the worker processes
+# of app/partitioned_scan.py, or the databases of separate hosts -- and finalizing the combined
+# partials gives the result of one pass over everything (up to the order floats are summed in).
+# Partials encode to JSON-safe dicts, so a host can ship its partial to the one combining them
+# (see /analytics/partials).
+#
+# run_aggregation scans MongoDB (in SCAN_PARTITIONS partitions); run_local maps shards of
+# documents already in memory on the same worker pool.
+
+import heapq
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.aggregates import CoMoments, main_category
+from app.cleaning import clean_number_column, safe_float_column
+from app.config import ANALYTICS_SCAN_BATCH_SIZE, PRICE_BUCKET_EDGES, SUMMARY_RATING_BINS, SUMMARY_RATING_TOP_K
+from app.database import product_collection
+from app.partitioned_scan import reduce_shards, scan_aggregate
+from app.price_buckets import PriceBucketHistogram, histogram_of
+from app.sentiment_rollup import rollup_contribution
+
+SENTIMENTS = ['positive', 'neutral', 'negative']
+
+# Number of best selling products the summary lists
+TOP_SELLING = 5
+
+# Ratings run from 0 to this; the summary's rating histogram divides the range into equal bins
+RATING_SCALE = 5.0
+
+
+class Aggregation:
+    """
+    One analytics computation split into map, combine and finalize. Instances are sent to the
+    worker processes, so subclasses live at module level and keep only picklable settings.
+    """
+
+    name: str = ""
+    # Product fields map reads; everything else stays on the server
+    fields: List[str] = []
+
+    def empty(self):
+        """
+        The partial of no documents.
+        """
+        raise NotImplementedError
+
+    def map(self, documents: list):
+        """
+        Reduces a batch of product documents to a partial.
+        """
+        raise NotImplementedError
+
+    def combine(self, partial, other):
+        """
+        Merges two partials; may update and return the first.
+        """
+        raise NotImplementedError
+
+    def finalize(self, partial):
+        """
+        The result for the documents a partial was built from.
+        """
+        raise NotImplementedError
+
+    def encode(self, partial) -> dict:
+        """
+        JSON-safe form of a partial, read back by decode.
+        """
+        return partial
+
+    def decode(self, data: dict):
+        return data
+
+
+def _sales_frame(documents: list):
+    """
+    Cleans a batch of products into the summary's per-product columns: main category,
+    discount, sales and profit (NaN where missing), plus the cleaned rating_count.
+    """
+    import numpy as np
+    import pandas as pd
+
+    actual_price = clean_number_column([p.get('actual_price') for p in documents], 'actual_price').values
+    discounted_price = clean_number_column([p.get('discounted_price') for p in documents], 'discounted_price').values
+    discount_percentage = clean_number_column([p.get('discount_percentage') for p in documents], 'discount_percentage').values
+    rating_count = clean_number_column([p.get('rating_count') for p in documents], 'rating_count')
+
+    # Assuming cost price is 70% of actual price unless the product carries its own
+    cost_price = pd.to_numeric(pd.Series([p.get('cost_price') for p in documents], dtype=object), errors='coerce').to_numpy(dtype='float64')
+    cost_price = np.where(np.isnan(cost_price), actual_price * 0.7, cost_price)
+
+    frame = pd.DataFrame({
+        'category': [main_category(product.get('category')) for product in documents],
+        'discount_percentage': discount_percentage,
+        'sales': discounted_price * rating_count.values,
+        'profit': (discounted_price - cost_price) * rating_count.values,
+    })
+    return frame, rating_count
+
+
+def _category_totals(frame) -> Dict[str, list]:
+    """
+    Per main category, in order of first appearance: [products, sales, profit, sum of
+    discounts, number of discounts].
+    """
+    grouped = frame.groupby('category', sort=False)
+    sizes = grouped.size()
+    totals = {}
+    for category, products, sales, profit, discount_sum, discount_count in zip(
+        sizes.index, sizes, grouped['sales'].sum(), grouped['profit'].sum(),
+        grouped['discount_percentage'].sum(), grouped['discount_percentage'].count(),
+    ):
+        totals[category] = [int(products), float(sales), float(profit), float(discount_sum), int(discount_count)]
+    return totals
+
+
+def _merge_category_totals(totals: Dict[str, list], other: Dict[str, list]) -> Dict[str, list]:
+    for category, values in other.items():
+        if category in totals:
+            totals[category] = [a + b for a, b in zip(totals[category], values)]
+        else:
+            totals[category] = list(values)
+    return totals
+
+
+def _category_stats(totals: Dict[str, list]) -> Dict[str, dict]:
+    return {
+        category: {
+            'total_products': products,
+            'total_sales': sales,
+            'total_revenue': sales,
+            'total_profit': profit,
+            'average_discount': discount_sum / discount_count if discount_count else 0.0,
+        }
+        for category, (products, sales, profit, discount_sum, discount_count) in totals.items()
+    }
+
+
+class CategoryStatsAggregation(Aggregation):
+    """
+    The summary's category_stats: products, sales, profit and average discount per main category.
+    """
+
+    name = 'category_stats'
+    fields = ['category', 'actual_price', 'discounted_price', 'discount_percentage', 'rating_count', 'cost_price']
+
+    def empty(self) -> Dict[str, list]:
+        return {}
+
+    def map(self, documents: list) -> Dict[str, list]:
+        frame, _ = _sales_frame(documents)
+        return _category_totals(frame)
+
+    def combine(self, partial: Dict[str, list], other: Dict[str, list]) -> Dict[str, list]:
+        return _merge_category_totals(partial, other)
+
+    def finalize(self, partial: Dict[str, list]) -> Dict[str, dict]:
+        return _category_stats(partial)
+
+
+def rating_bin_counts(ratings, bins: int) -> Tuple[List[int], int]:
+    """
+    Counts cleaned ratings (NaN where missing) into `bins` equal bins over 0 to RATING_SCALE;
+    a rating of exactly RATING_SCALE falls in the last bin.
+
+    Returns:
+        tuple: (count per bin, number of missing or out of range ratings)
+    """
+    import numpy as np
+
+    valid = ~np.isnan(ratings)
+    valid[valid] = (ratings[valid] >= 0) & (ratings[valid] <= RATING_SCALE)
+    indexes = np.minimum(np.floor(ratings[valid] * bins / RATING_SCALE).astype('int64'), bins - 1)
+    counts = np.bincount(indexes, minlength=bins)
+    return [int(count) for count in counts], int(len(ratings) - np.count_nonzero(valid))
+
+
+def rating_histogram(counts: List[int], unrated: int) -> dict:
+    """
+    The summary's rating_histogram: each bin's rating range and product count.
+    """
+    bins = len(counts)
+    return {
+        'bins': [
+            {'min': RATING_SCALE * index / bins, 'max': RATING_SCALE * (index + 1) / bins, 'count': count}
+            for index, count in enumerate(counts)
+        ],
+        'unrated': unrated,
+    }
+
+
+class SummaryAggregation(Aggregation):
+    """
+    The /analytics/summary response, of a size independent of the catalogue's. Totals, category
+    stats and the rating histogram are sums; the top sellers and the most rated products
+    (rating_stats) keep the largest of each side. Low-stock products are not part of it: the
+    endpoint reads them from the inventory index.
+    """
+
+    name = 'summary'
+    fields = [
+        'product_id', 'product_name', 'category', 'actual_price', 'discounted_price',
+        'discount_percentage', 'rating', 'rating_count', 'cost_price',
+    ]
+
+    def __init__(self, rating_bins: int = SUMMARY_RATING_BINS, rating_top_k: int = SUMMARY_RATING_TOP_K):
+        self.rating_bins = rating_bins
+        self.rating_top_k = rating_top_k
+
+    def empty(self) -> dict:
+        return {
+            'total_products': 0,
+            'total_sales': 0.0,
+            'total_profit': 0.0,
+            'categories': {},
+            'top_selling_products': [],
+            'rating_counts': [0] * self.rating_bins,
+            'unrated': 0,
+            'rating_stats': [],
+        }
+
+    def map(self, documents: list) -> dict:
+        import pandas as pd
+
+        frame, rating_count = _sales_frame(documents)
+        sales = frame['sales']
+        rating_counts, unrated = rating_bin_counts(
+            safe_float_column([p.get('rating') for p in documents], 'rating').values, self.rating_bins
+        )
+        return {
+            'total_products': len(documents),
+            'total_sales': float(sales.sum()),
+            'total_profit': float(frame['profit'].sum()),
+            'categories': _category_totals(frame),
+            'top_selling_products': [
+                {
+                    'product_id': documents[i].get('product_id'),
+                    'product_name': documents[i].get('product_name'),
+                    'sales': float(sales[i])
+                }
+                for i in sales.dropna().nlargest(TOP_SELLING).index
+            ],
+            'rating_counts': rating_counts,
+            'unrated': unrated,
+            'rating_stats': [
+                {
+                    'product_id': documents[i].get('product_id'),
+                    'product_name': documents[i].get('product_name'),
+                    'rating': documents[i].get('rating', 0),
+                    'rating_count': float(count)
+                }
+                for i, count in pd.Series(rating_count.values).dropna().nlargest(self.rating_top_k).items()
+            ],
+        }
+
+    def combine(self, partial: dict, other: dict) -> dict:
+        """
+        Raises:
+            ValueError: If the partials count ratings into different numbers of bins.
+        """
+        if len(partial['rating_counts']) != len(other['rating_counts']):
+            raise ValueError("Summary partials with different rating bins cannot be combined.")
+        partial['total_products'] += other['total_products']
+        partial['total_sales'] += other['total_sales']
+        partial['total_profit'] += other['total_profit']
+        _merge_category_totals(partial['categories'], other['categories'])
+        # nlargest keeps the earlier of equal sales, like pandas' nlargest(keep='first')
+        partial['top_selling_products'] = heapq.nlargest(
+            TOP_SELLING, partial['top_selling_products'] + other['top_selling_products'],
+            key=lambda product: product['sales'],
+        )
+        partial['rating_counts'] = [a + b for a, b in zip(partial['rating_counts'], other['rating_counts'])]
+        partial['unrated'] += other['unrated']
+        partial['rating_stats'] = heapq.nlargest(
+            self.rating_top_k, partial['rating_stats'] + other['rating_stats'],
+            key=lambda product: product['rating_count'],
+        )
+        return partial
+
+    def finalize(self, partial: dict) -> dict:
+        return {
+            'total_products': partial['total_products'],
+            'total_sales': partial['total_sales'],
+            'total_revenue': partial['total_sales'],
+            'total_profit': partial['total_profit'],
+            'category_stats': _category_stats(partial['categories']),
+            'top_selling_products': partial['top_selling_products'],
+            'rating_histogram': rating_histogram(partial['rating_counts'], partial['unrated']),
+            'rating_stats': partial['rating_stats']
+        }
+
+
+class SentimentCountsAggregation(Aggregation):
+    """
+    Sentiment counts and average rating per (main category, subcategory), in the
+    /analytics/sentiment_distribution shape. The same grouping as the sentiment rollup.
+    """
+
+    name = 'sentiment_counts'
+    fields = ['category', 'rating']
+
+    def empty(self) -> Dict[Tuple[str, str], list]:
+        return {}
+
+    def map(self, documents: list) -> Dict[Tuple[str, str], list]:
+        # (main, sub) -> [positive, neutral, negative, rating sum, ratings]
+        counts = {}
+        for product in documents:
+            contribution = rollup_contribution(product)
+            if contribution is None:
+                continue
+            key, sentiment, rating = contribution
+            row = counts.setdefault((key['main_category'], key['subcategory']), [0, 0, 0, 0.0, 0])
+            row[SENTIMENTS.index(sentiment)] += 1
+            row[3] += rating
+            row[4] += 1
+        return counts
+
+    def combine(self, partial: dict, other: dict) -> dict:
+        for key, values in other.items():
+            if key in partial:
+                partial[key] = [a + b for a, b in zip(partial[key], values)]
+            else:
+                partial[key] = list(values)
+        return partial
+
+    def finalize(self, partial: dict) -> List[dict]:
+        rows = [
+            {
+                '_id': {'main_category': main, 'subcategory': sub},
+                **dict(zip(SENTIMENTS, values[:3])),
+                'rating_sum': values[3],
+                'rating_count': values[4],
+            }
+            for (main, sub), values in sorted(partial.items())
+            if values[4] > 0
+        ]
+        return sentiment_distribution_of(rows)
+
+    def encode(self, partial: dict) -> dict:
+        return {'rows': [[main, sub, *values] for (main, sub), values in partial.items()]}
+
+    def decode(self, data: dict) -> dict:
+        return {(main, sub): list(values) for main, sub, *values in data['rows']}
+
+
+def sentiment_distribution_of(rows: List[dict]) -> List[dict]:
+    """
+    Formats rollup rows ({_id: {main_category, subcategory}, positive, neutral, negative,
+    rating_sum, rating_count}) as the /analytics/sentiment_distribution response.
+    """
+    result = []
+    for row in rows:
+        counts = {sentiment: row.get(sentiment, 0) for sentiment in SENTIMENTS}
+        total = sum(counts.values())
+        entry = {
+            'main_category': row['_id']['main_category'],
+            'subcategory': row['_id']['subcategory'],
+            **counts,
+            'total': total,
+        }
+        # Calculate percentages
+        for sentiment, count in counts.items():
+            entry[f'{sentiment}_percentage'] = count / total * 100 if total else 0.0
+        entry['average_rating'] = row['rating_sum'] / row['rating_count']
+        result.append(entry)
+    return result
+
+
+class PriceBucketAggregation(Aggregation):
+    """
+    Discount statistics per price range, in the /analytics/price_discount_analysis shape. The
+    stored price buckets (app/price_buckets.py) are this aggregation's partial of the catalogue,
+    kept up to date on writes.
+    """
+
+    name = 'price_buckets'
+    fields = ['actual_price', 'discount_percentage']
+
+    def __init__(self, edges: Optional[Sequence[float]] = None):
+        self.edges = list(edges or PRICE_BUCKET_EDGES)
+
+    def empty(self) -> PriceBucketHistogram:
+        return PriceBucketHistogram()
+
+    def map(self, documents: list) -> PriceBucketHistogram:
+        return histogram_of(documents)
+
+    def combine(self, partial: PriceBucketHistogram, other: PriceBucketHistogram) -> PriceBucketHistogram:
+        return partial.merge(other)
+
+    def finalize(self, partial: PriceBucketHistogram) -> Optional[dict]:
+        """
+        None when no product has a price and a discount.
+
+        Raises:
+            ValueError: If the edges are not increasing multiples of the base width.
+        """
+        overall = partial.overall()
+        if overall.count == 0:
+            return None
+
+        # Calculate statistics per price range
+        price_discount_stats = [
+            {
+                'price_range': label,
+                'average_discount_percentage': stats.mean_discount(),
+                'median_discount_percentage': stats.discounts.median(),
+                'std_discount_percentage': stats.std_discount(),
+                'product_count': stats.count
+            }
+            for label, stats in partial.rebucket(self.edges)
+        ]
+
+        # Calculate overall discount statistics
+        overall_stats = {
+            'average_discount_percentage': overall.mean_discount(),
+            'median_discount_percentage': overall.discounts.median(),
+            'min_discount_percentage': overall.discounts.min(),
+            'max_discount_percentage': overall.discounts.max(),
+            'std_discount_percentage': overall.std_discount(),
+            'total_products': overall.count
+        }
+
+        # Calculate correlation between actual price and discount percentage
+        r = overall.price_discount_correlation()
+        correlation = {
+            'actual_price': {'actual_price': 1.0, 'discount_percentage': r},
+            'discount_percentage': {'actual_price': r, 'discount_percentage': 1.0}
+        }
+
+        return {
+            "per_price_range_stats": price_discount_stats,
+            "overall_stats": overall_stats,
+            "price_discount_correlation": correlation
+        }
+
+    def encode(self, partial: PriceBucketHistogram) -> dict:
+        return partial.to_dict()
+
+    def decode(self, data: dict) -> PriceBucketHistogram:
+        return PriceBucketHistogram.from_dict(data)
+
+
+# Numeric fields of the correlation endpoints and how each is cleaned
+RATING_DISCOUNT_CLEANERS = {
+    'discount_percentage': clean_number_column,
+    'rating': safe_float_column,
+}
+PRICE_TREND_CLEANERS = {
+    'actual_price': clean_number_column,
+    'discounted_price': clean_number_column,
+    'discount_percentage': clean_number_column,
+    'rating': safe_float_column,
+    'rating_count': clean_number_column,
+}
+
+
+class CorrelationAggregation(Aggregation):
+    """
+    Pearson correlations of cleaned numeric fields over the rows where all of them are present,
+    overall and optionally per main category. The partial is (overall CoMoments, CoMoments per
+    main category), or None while no row is complete.
+    """
+
+    name = 'correlation'
+
+    def __init__(self, cleaners: Optional[dict] = None, by_category: bool = False):
+        # Maps field name to the column cleaner used for it
+        self.cleaners = dict(cleaners or RATING_DISCOUNT_CLEANERS)
+        self.by_category = by_category
+        self.columns = list(self.cleaners)
+        self.fields = self.columns + (['category'] if by_category else [])
+
+    def empty(self) -> tuple:
+        return CoMoments(self.columns), {}
+
+    def map_columns(self, columns: dict) -> Optional[tuple]:
+        """
+        Reduces one batch of cleaned numeric columns (NaN where missing, plus main_category when
+        by category). Rows with any missing value are dropped.
+        """
+        import numpy as np
+
+        matrix = np.column_stack([columns[field] for field in self.columns])
+        complete = ~np.isnan(matrix).any(axis=1)
+        rows = matrix[complete]
+        if rows.shape[0] == 0:
+            return None
+
+        overall = CoMoments(self.columns).add_batch(rows)
+        per_category = {}
+        if self.by_category:
+            categories = columns['main_category'][complete]
+            for category in np.unique(categories):
+                per_category[category] = CoMoments(self.columns).add_batch(rows[categories == category])
+        return overall, per_category
+
+    def map(self, documents: list) -> Optional[tuple]:
+        """
+        Cleans a batch of raw product documents column-wise and reduces it like map_columns.
+        """
+        import numpy as np
+
+        columns = {
+            field: cleaner([document.get(field) for document in documents], field).values
+            for field, cleaner in self.cleaners.items()
+        }
+        if self.by_category:
+            columns['main_category'] = np.array([main_category(document.get('category')) for document in documents], dtype=object)
+        return self.map_columns(columns)
+
+    def combine(self, partial: tuple, other: tuple) -> tuple:
+        overall, per_category = partial
+        other_overall, other_per_category = other
+        overall.merge(other_overall)
+        for category, moments in other_per_category.items():
+            if category in per_category:
+                per_category[category].merge(moments)
+            else:
+                per_category[category] = moments
+        return partial
+
+    def finalize(self, partial: tuple) -> dict:
+        """
+        The correlation matrix, or {"overall", "by_category"} matrices when by category.
+        """
+        overall, per_category = partial
+        if self.by_category:
+            return {
+                "overall": overall.correlation(),
+                "by_category": {category: moments.correlation() for category, moments in per_category.items()}
+            }
+        return overall.correlation()
+
+    def encode(self, partial: tuple) -> dict:
+        overall, per_category = partial
+        return {
+            'overall': overall.to_dict(),
+            'by_category': {category: moments.to_dict() for category, moments in per_category.items()},
+        }
+
+    def decode(self, data: dict) -> tuple:
+        return (
+            CoMoments.from_dict(data['overall']),
+            {category: CoMoments.from_dict(moments) for category, moments in data['by_category'].items()},
+        )
+
+
+def aggregations() -> Dict[str, Aggregation]:
+    """
+    The aggregations that can be run by name, with their default settings.
+    """
+    return {
+        aggregation.name: aggregation
+        for aggregation in (
+            SummaryAggregation(),
+            CategoryStatsAggregation(),
+            SentimentCountsAggregation(),
+            PriceBucketAggregation(),
+            CorrelationAggregation(),
+        )
+    }
+
+
+async def run_aggregation(
+    aggregation: Aggregation,
+    endpoint: Optional[str] = None,
+    query: Optional[dict] = None,
+    partitions: Optional[int] = None,
+):
+    """
+    The partial of the products matching `query`, scanned in SCAN_PARTITIONS partitions
+    (or `partitions`) and reported in the transfer stats under `endpoint`.
+    """
+    partial = await scan_aggregate(
+        product_collection, aggregation.fields, endpoint or aggregation.name,
+        aggregation.map, aggregation.combine, query=query, partitions=partitions,
+    )
+    return aggregation.empty() if partial is None else partial
+
+
+async def run_local(aggregation: Aggregation, shards: Sequence[list], batch_size: int = ANALYTICS_SCAN_BATCH_SIZE):
+    """
+    The partial of shards of documents already in memory, one worker process task per shard.
+    """
+    partial = await reduce_shards(shards, aggregation.map, aggregation.combine, batch_size)
+    return aggregation.empty() if partial is None else partial
+
+
+def combine_encoded(aggregation: Aggregation, encoded: Sequence[dict]):
+    """
+    Combines partials shipped from other processes or hosts, in the given order.
+    """
+    partial = aggregation.empty()
+    for data in encoded:
+        partial = aggregation.combine(partial, aggregation.decode(data))
+    return partial
@@ -0,0 +1,218 @@
+# app/partitioned_scan.py
+#
+# Partitioned scans for the full-catalogue analytics. Instead of one cursor, the collection is
+# split into _id ranges whose boundaries come from a $sample of the ids (a random read, not a
+# scan), and each range is read by its own cursor on its own connection, in a pool of worker
+# processes. A worker decodes, cleans and reduces its range to a partial aggregate with the
+# caller's map function, so BSON decoding and cleaning use every core; the partials are combined
+# here. With one partition the scan streams through a single cursor in this process, as before,
+# each batch mapped in a thread so the event loop keeps serving while it is reduced.
+# reduce_shards runs the same map and combine on the pool over documents already in memory.
+#
+# The map and combine functions are sent to the workers by reference, so they must be
+# module-level functions, functools.partial objects of them or methods of picklable objects,
+# and partials must pickle.
+
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from app.config import (
+    ANALYTICS_FETCH_BATCH_SIZE,
+    ANALYTICS_SCAN_BATCH_SIZE,
+    SCAN_PARTITION_SAMPLE,
+    SCAN_PARTITIONS,
+    SCAN_WORKERS,
+)
+from app.database import MONGO_DETAILS
+from app.fetch import RAW_CODEC_OPTIONS, iter_batches, projection_for, scan_progress, transfer_stats
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Partial = TypeVar("Partial")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Per worker process: connection string -> pymongo client
+_clients: Dict[str, object] = {}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: a fork of the event loop's process would inherit its driver threads
+        _pool = ProcessPoolExecutor(max_workers=SCAN_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _fold(partial, part, combine):
+    if part is None:
+        return partial
+    return part if partial is None else combine(partial, part)
+
+
+async def partition_filters(collection, partitions: int, query: Optional[dict] = None) -> List[dict]:
+    """
+    Splits the documents matching `query` into up to `partitions` _id ranges of about the same
+    size, returned as filters that together match each document once.
+    """
+    if partitions <= 1:
+        return [query or {}]
+    pipeline = [{"$match": query}] if query else []
+    pipeline += [{"$sample": {"size": partitions * SCAN_PARTITION_SAMPLE}}, {"$project": {"_id": 1}}]
+    sample = await collection.aggregate(pipeline).to_list(length=None)
+    try:
+        ids = sorted({document["_id"] for document in sample})
+    except TypeError:
+        # Ids of different types have no single order to split on
+        return [query or {}]
+
+    bounds = list(dict.fromkeys(ids[len(ids) * index // partitions] for index in range(1, partitions)))
+    filters = []
+    for low, high in zip([None] + bounds, bounds + [None]):
+        range_filter = {}
+        if low is not None:
+            range_filter["$gte"] = low
+        if high is not None:
+            range_filter["$lt"] = high
+        range_filter = {"_id": range_filter} if range_filter else {}
+        if query and range_filter:
+            filters.append({"$and": [query, range_filter]})
+        else:
+            filters.append(range_filter or query or {})
+    return filters
+
+
+def _reduce_batches(documents: Iterable, map_batch: Callable, combine: Callable, batch_size: int) -> Optional[Partial]:
+    partial, batch = None, []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            partial = _fold(partial, map_batch(batch), combine)
+            batch = []
+    if batch:
+        partial = _fold(partial, map_batch(batch), combine)
+    return partial
+
+
+def _scan_partition(
+    uri: str,
+    database: str,
+    collection: str,
+    fields: List[str],
+    query: dict,
+    map_batch: Callable,
+    combine: Callable,
+    batch_size: int,
+) -> Tuple[Optional[Partial], int, int]:
+    """
+    Runs in a worker process: reads one partition with this process's own client and reduces it.
+
+    Returns:
+        tuple: (the partition's partial or None if it is empty, documents read, bytes read)
+    """
+    import pymongo
+
+    client = _clients.get(uri)
+    if client is None:
+        client = _clients[uri] = pymongo.MongoClient(uri)
+    raw_collection = client[database].get_collection(collection, codec_options=RAW_CODEC_OPTIONS)
+
+    read = {'documents': 0, 'bytes': 0}
+
+    def documents():
+        for document in raw_collection.find(query, projection_for(fields), batch_size=ANALYTICS_FETCH_BATCH_SIZE):
+            read['documents'] += 1
+            read['bytes'] += len(document.raw)
+            yield document
+
+    partial = _reduce_batches(documents(), map_batch, combine, batch_size)
+    return partial, read['documents'], read['bytes']
+
+
+async def scan_aggregate(
+    collection,
+    fields: Sequence[str],
+    endpoint: str,
+    map_batch: Callable[[list], Partial],
+    combine: Callable[[Partial, Partial], Partial],
+    query: Optional[dict] = None,
+    partitions: Optional[int] = None,
+    uri: str = MONGO_DETAILS,
+) -> Optional[Partial]:
+    """
+    Reduces the documents matching `query` to one aggregate, scanning SCAN_PARTITIONS ranges
+    in parallel.
+
+    Parameters:
+        collection: Motor collection to scan.
+        fields (Sequence[str]): Fields the map function reads.
+        endpoint (str): Name the transferred bytes are reported under.
+        map_batch (callable): Reduces a list of raw documents to a partial aggregate (or None).
+        combine (callable): Merges two partials into one (it may update and return the first).
+        query (dict, optional): Filter for the scan.
+        partitions (int, optional): Ranges to scan; defaults to SCAN_PARTITIONS.
+        uri (str): Connection string the worker processes connect with.
+
+    Returns:
+        The combined aggregate, or None if no batch produced one.
+    """
+    partitions = SCAN_PARTITIONS if partitions is None else partitions
+    if partitions <= 1:
+        partial = None
+        async for batch in iter_batches(collection, fields, endpoint, query):
+            partial = _fold(partial, await asyncio.to_thread(map_batch, batch), combine)
+        return partial
+
+    filters = await partition_filters(collection, partitions, query)
+    loop = asyncio.get_running_loop()
+    stats = transfer_stats[endpoint]
+    stats['scans'] += 1
+    started = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                _get_pool(), _scan_partition, uri, collection.database.name, collection.name,
+                list(fields), partition, map_batch, combine, ANALYTICS_SCAN_BATCH_SIZE,
+            )
+            for partition in filters
+        ))
+    finally:
+        stats['seconds'] += time.perf_counter() - started
+
+    progress = scan_progress.get()
+    partial = None
+    for part, documents, size in results:
+        stats['documents'] += documents
+        stats['bytes'] += size
+        if progress is not None:
+            progress['documents'] += documents
+        partial = _fold(partial, part, combine)
+    return partial
+
+
+async def reduce_shards(
+    shards: Sequence[list],
+    map_batch: Callable[[list], Partial],
+    combine: Callable[[Partial, Partial], Partial],
+    batch_size: int = ANALYTICS_SCAN_BATCH_SIZE,
+) -> Optional[Partial]:
+    """
+    Reduces lists of documents already in memory (e.g. exported per host) on the worker pool,
+    one shard per task, in batches of `batch_size` like a scan, and combines the partials in
+    shard order.
+    """
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(_get_pool(), _reduce_batches, shard, map_batch, combine, batch_size)
+        for shard in shards
+    ))
+    partial = None
+    for part in results:
+        partial = _fold(partial, part, combine)
+    return partial
@@ -0,0 +1,418 @@
+# app/price_buckets.py
+
+import logging
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.cleaning import clean_number
+from app.config import DISCOUNT_SKETCH_RESOLUTION, PRICE_BUCKET_BASE_WIDTH
+from app.database import price_bucket_collection, product_collection
+from app.partitioned_scan import scan_aggregate
+from app.rebuilds import ScanLedger, rebuild_lock, reconcile_writes, replace_collection
+from app.snapshot import start_watermark
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Identifies the document that records which grid the stored buckets were built with
+META_ID = "meta"
+
+# Product fields a bucket contribution is computed from
+PRICE_FIELDS = ["actual_price", "discount_percentage"]
+
+
+class QuantileHistogram:
+    """
+    Mergeable quantile sketch: a sparse histogram of values rounded to a fixed resolution.
+    Quantiles are exact for values that lie on the grid (e.g. whole discount percentages)
+    and within resolution / 2 otherwise.
+    """
+
+    def __init__(self, resolution: float, counts: Optional[Dict[int, int]] = None):
+        self.resolution = resolution
+        self.counts: Dict[int, int] = {}
+        for key, count in (counts or {}).items():
+            if count:
+                self.counts[int(key)] = int(count)
+
+    def key(self, value: float) -> int:
+        return int(round(value / self.resolution))
+
+    def add(self, value: float, weight: int = 1):
+        key = self.key(value)
+        self.counts[key] = self.counts.get(key, 0) + weight
+        if self.counts[key] == 0:
+            del self.counts[key]
+
+    def merge(self, other: "QuantileHistogram") -> "QuantileHistogram":
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+            if self.counts[key] == 0:
+                del self.counts[key]
+        return self
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def value_at_rank(self, rank: int) -> float:
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if rank < seen:
+                return key * self.resolution
+        raise IndexError("rank out of range")
+
+    def median(self) -> Optional[float]:
+        # Same convention as pandas: average the two middle values for even counts
+        total = self.total
+        if total <= 0:
+            return None
+        lower = self.value_at_rank((total - 1) // 2)
+        upper = self.value_at_rank(total // 2)
+        return (lower + upper) / 2
+
+    def min(self) -> Optional[float]:
+        return min(self.counts) * self.resolution if self.counts else None
+
+    def max(self) -> Optional[float]:
+        return max(self.counts) * self.resolution if self.counts else None
+
+
+class BucketStats:
+    """
+    Running statistics for the products in one price bucket: count, sums and sums of squares
+    of price and discount, their cross product sum, and sketches for the median discount and
+    the maximum price.
+    """
+
+    def __init__(self, doc: Optional[dict] = None, resolution: float = DISCOUNT_SKETCH_RESOLUTION):
+        doc = doc or {}
+        self.count = int(doc.get("count", 0))
+        self.discount_sum = float(doc.get("discount_sum", 0.0))
+        self.discount_sum_sq = float(doc.get("discount_sum_sq", 0.0))
+        self.price_sum = float(doc.get("price_sum", 0.0))
+        self.price_sum_sq = float(doc.get("price_sum_sq", 0.0))
+        self.cross_sum = float(doc.get("cross_sum", 0.0))
+        self.discounts = QuantileHistogram(resolution, doc.get("discount_hist"))
+        # Whole-rupee price histogram, only used to find the highest price after removals
+        self.prices = QuantileHistogram(1.0, doc.get("price_hist"))
+
+    def add(self, price: float, discount: float, weight: int = 1):
+        self.count += weight
+        self.discount_sum += weight * discount
+        self.discount_sum_sq += weight * discount * discount
+        self.price_sum += weight * price
+        self.price_sum_sq += weight * price * price
+        self.cross_sum += weight * price * discount
+        self.discounts.add(discount, weight)
+        self.prices.add(math.floor(price), weight)
+
+    def merge(self, other: "BucketStats") -> "BucketStats":
+        self.count += other.count
+        self.discount_sum += other.discount_sum
+        self.discount_sum_sq += other.discount_sum_sq
+        self.price_sum += other.price_sum
+        self.price_sum_sq += other.price_sum_sq
+        self.cross_sum += other.cross_sum
+        self.discounts.merge(other.discounts)
+        self.prices.merge(other.prices)
+        return self
+
+    def to_document(self) -> dict:
+        """
+        Stored form, read back by the constructor.
+        """
+        return {
+            "count": self.count,
+            "discount_sum": self.discount_sum,
+            "discount_sum_sq": self.discount_sum_sq,
+            "price_sum": self.price_sum,
+            "price_sum_sq": self.price_sum_sq,
+            "cross_sum": self.cross_sum,
+            "discount_hist": {str(key): count for key, count in self.discounts.counts.items()},
+            "price_hist": {str(key): count for key, count in self.prices.counts.items()},
+        }
+
+    def mean_discount(self) -> Optional[float]:
+        return self.discount_sum / self.count if self.count > 0 else None
+
+    def std_discount(self) -> Optional[float]:
+        # Sample standard deviation (ddof=1), like pandas
+        if self.count < 2:
+            return None
+        variance = (self.discount_sum_sq - self.discount_sum ** 2 / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def price_discount_correlation(self) -> Optional[float]:
+        if self.count < 2:
+            return None
+        cov = self.cross_sum - self.price_sum * self.discount_sum / self.count
+        var_price = self.price_sum_sq - self.price_sum ** 2 / self.count
+        var_discount = self.discount_sum_sq - self.discount_sum ** 2 / self.count
+        if var_price <= 0 or var_discount <= 0:
+            return None
+        return cov / math.sqrt(var_price * var_discount)
+
+
+class PriceBucketHistogram:
+    """
+    Price buckets on a fixed base grid of `base_width`. Bucket i holds prices in
+    (i * base_width, (i + 1) * base_width], with 0 falling into bucket 0, which matches
+    pd.cut(..., include_lowest=True). Any edges that are multiples of the base width can be
+    answered by merging base buckets, without rescanning products.
+    """
+
+    def __init__(self, base_width: float = PRICE_BUCKET_BASE_WIDTH, resolution: float = DISCOUNT_SKETCH_RESOLUTION):
+        self.base_width = base_width
+        self.resolution = resolution
+        self.buckets: Dict[int, BucketStats] = {}
+
+    def bucket_index(self, price: float) -> int:
+        return max(math.ceil(price / self.base_width) - 1, 0)
+
+    def add(self, price: float, discount: float, weight: int = 1):
+        index = self.bucket_index(price)
+        if index not in self.buckets:
+            self.buckets[index] = BucketStats(resolution=self.resolution)
+        self.buckets[index].add(price, discount, weight)
+
+    def merge(self, other: "PriceBucketHistogram") -> "PriceBucketHistogram":
+        """
+        Merges another histogram on the same grid into this one.
+        """
+        for index, stats in other.buckets.items():
+            if index in self.buckets:
+                self.buckets[index].merge(stats)
+            else:
+                self.buckets[index] = stats
+        return self
+
+    def to_dict(self) -> dict:
+        """
+        Serializes the histogram so it can be shipped between workers or hosts.
+        """
+        return {
+            "base_width": self.base_width,
+            "resolution": self.resolution,
+            "buckets": {str(index): stats.to_document() for index, stats in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PriceBucketHistogram":
+        histogram = cls(float(data["base_width"]), float(data["resolution"]))
+        for index, doc in data["buckets"].items():
+            histogram.buckets[int(index)] = BucketStats(doc, resolution=histogram.resolution)
+        return histogram
+
+    def overall(self) -> BucketStats:
+        total = BucketStats(resolution=self.resolution)
+        for stats in self.buckets.values():
+            total.merge(stats)
+        return total
+
+    def max_price(self) -> Optional[float]:
+        populated = [index for index, stats in self.buckets.items() if stats.count > 0]
+        if not populated:
+            return None
+        return self.buckets[max(populated)].prices.max()
+
+    def rebucket(self, edges: Iterable[float]) -> List[Tuple[str, BucketStats]]:
+        """
+        Merges the base buckets into the ranges (edges[0], edges[1]], ..., (edges[-1], max_price].
+        Empty ranges are left out, like groupby(observed=True).
+
+        Raises:
+            ValueError: If the edges are not increasing multiples of the base width.
+        """
+        result = []
+        for label, start, end in bucket_ranges(edges, self.max_price(), self.base_width):
+            merged = BucketStats(resolution=self.resolution)
+            for index, stats in self.buckets.items():
+                if index >= start and (end is None or index < end):
+                    merged.merge(stats)
+            if merged.count > 0:
+                result.append((label, merged))
+        return result
+
+
+def bucket_ranges(edges: Iterable[float], max_price: Optional[float], base_width: float = PRICE_BUCKET_BASE_WIDTH) -> List[Tuple[str, int, Optional[int]]]:
+    """
+    Labels the ranges (edges[0], edges[1]], ..., (edges[-1], max_price] and gives each as a
+    half-open [start, end) span of base bucket indexes (end None for the open last range).
+
+    Raises:
+        ValueError: If the edges are not increasing multiples of the base width.
+    """
+    edges = list(edges)
+    if not edges or any(b <= a for a, b in zip(edges, edges[1:])):
+        raise ValueError("Bucket edges must be a non-empty increasing list.")
+    for edge in edges:
+        if edge < 0 or not math.isclose(edge / base_width, round(edge / base_width)):
+            raise ValueError(f"Bucket edge {edge} is not a non-negative multiple of {base_width}.")
+
+    ranges = [
+        (_format_price(lo) + "-" + _format_price(hi), round(lo / base_width), round(hi / base_width))
+        for lo, hi in zip(edges, edges[1:])
+    ]
+    if max_price is not None and max_price > edges[-1]:
+        ranges.append((f"{_format_price(edges[-1])}-{int(max_price)}k", round(edges[-1] / base_width), None))
+    return ranges
+
+
+def _format_price(value: float) -> str:
+    """
+    Formats a bucket edge the way the dashboard labels them (0, 5k, 10k, ...).
+    """
+    if value == 0:
+        return "0"
+    return f"{value / 1000:g}k"
+
+
+def _contribution(product: Optional[dict]) -> Optional[Tuple[float, float]]:
+    """
+    Returns the cleaned (actual_price, discount_percentage) a product contributes, if any.
+    """
+    if not product:
+        return None
+    price = clean_number(product.get("actual_price"))
+    discount = clean_number(product.get("discount_percentage"))
+    if price is None or discount is None:
+        return None
+    return price, discount
+
+
+def histogram_of(documents: list) -> PriceBucketHistogram:
+    """
+    Reduces a batch of products to their buckets.
+    """
+    histogram = PriceBucketHistogram()
+    for product in documents:
+        contribution = _contribution(product)
+        if contribution is not None:
+            histogram.add(*contribution)
+    return histogram
+
+
+def _rebuild_partial(documents: list) -> Tuple[PriceBucketHistogram, ScanLedger]:
+    """
+    Reduces a batch of products to their buckets and the ledger of what was counted for each;
+    the map function of the rebuild scan.
+    """
+    histogram, product_ids, rows = PriceBucketHistogram(), [], []
+    for product in documents:
+        contribution = _contribution(product)
+        if contribution is not None:
+            histogram.add(*contribution)
+            product_ids.append(product["_id"])
+            rows.append(contribution)
+    return histogram, ScanLedger.of(product_ids, rows, width=2)
+
+
+def _merge_rebuild_partials(partial: tuple, other: tuple) -> tuple:
+    return partial[0].merge(other[0]), partial[1].merge(other[1])
+
+
+def _increment(base_width: float, resolution: float, price: float, discount: float, weight: int) -> UpdateOne:
+    """
+    Builds the $inc update that adds (weight=1) or removes (weight=-1) one product from its bucket.
+    """
+    index = max(math.ceil(price / base_width) - 1, 0)
+    return UpdateOne(
+        {"_id": index},
+        {"$inc": {
+            "count": weight,
+            "discount_sum": weight * discount,
+            "discount_sum_sq": weight * discount * discount,
+            "price_sum": weight * price,
+            "price_sum_sq": weight * price * price,
+            "cross_sum": weight * price * discount,
+            f"discount_hist.{int(round(discount / resolution))}": weight,
+            f"price_hist.{math.floor(price)}": weight,
+        }},
+        upsert=True,
+    )
+
+
+def _grid_document() -> dict:
+    return {"_id": META_ID, "base_width": PRICE_BUCKET_BASE_WIDTH, "resolution": DISCOUNT_SKETCH_RESOLUTION}
+
+
+async def _read_buckets() -> Optional[PriceBucketHistogram]:
+    """
+    Reads the stored buckets and their grid document with one query. Returns None if they were
+    not built with the current grid.
+    """
+    meta, histogram = None, PriceBucketHistogram()
+    async for doc in price_bucket_collection.find():
+        if doc["_id"] == META_ID:
+            meta = doc
+        else:
+            histogram.buckets[int(doc["_id"])] = BucketStats(doc, resolution=DISCOUNT_SKETCH_RESOLUTION)
+    if not meta or any(meta.get(key) != value for key, value in _grid_document().items()):
+        return None
+    return histogram
+
+
+async def rebuild_price_buckets() -> PriceBucketHistogram:
+    """
+    Rebuilds the stored bucket statistics from a full scan of the products collection, into a
+    scratch collection renamed over the live one, then moves the products written during the scan
+    to their current buckets (see app/rebuilds.py). Only needed on first use or when the grid
+    settings change; afterwards product writes keep the buckets up to date. One process rebuilds
+    at a time; a process that waited for another's rebuild returns what that one built.
+    """
+    async with rebuild_lock("price_buckets"):
+        histogram = await _read_buckets()
+        if histogram is not None:
+            return histogram
+
+        started = start_watermark()
+        histogram, ledger = await scan_aggregate(
+            product_collection, PRICE_FIELDS + ["_id"], "price_buckets_rebuild", _rebuild_partial, _merge_rebuild_partials,
+        ) or (PriceBucketHistogram(), ScanLedger(2))
+
+        docs = [{"_id": index, **stats.to_document()} for index, stats in histogram.buckets.items()]
+        await replace_collection(price_bucket_collection, docs + [_grid_document()])
+        moved = await reconcile_writes(started, ledger, PRICE_FIELDS, "price_buckets_rebuild", _contribution, _move)
+        logger.info(f"Rebuilt price buckets: {len(docs)} base buckets; moved {moved} products written meanwhile.")
+        return await _read_buckets() if moved else histogram
+
+
+async def load_price_buckets() -> PriceBucketHistogram:
+    """
+    Loads the stored bucket statistics, rebuilding them first if they are missing or stale.
+    Reads one small document per base bucket, independent of the number of products.
+    """
+    histogram = await _read_buckets()
+    if histogram is None:
+        return await rebuild_price_buckets()
+    return histogram
+
+
+async def record_product_write(before: Optional[dict], after: Optional[dict]):
+    """
+    Moves a product's contribution from its old bucket to its new one after a create,
+    update or delete. Pass None for `before` on create and for `after` on delete.
+    Failures are logged and never fail the write itself.
+    """
+    await _move(_contribution(before), _contribution(after))
+
+
+async def _move(old: Optional[Tuple[float, float]], new: Optional[Tuple[float, float]]):
+    if old == new:
+        return
+
+    try:
+        # Applied whether or not the buckets are built: a build replaces whatever this creates
+        operations = []
+        if old is not None:
+            operations.append(_increment(PRICE_BUCKET_BASE_WIDTH, DISCOUNT_SKETCH_RESOLUTION, *old, weight=-1))
+        if new is not None:
+            operations.append(_increment(PRICE_BUCKET_BASE_WIDTH, DISCOUNT_SKETCH_RESOLUTION, *new, weight=1))
+        await price_bucket_collection.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.error(f"Error updating price buckets: {e}")
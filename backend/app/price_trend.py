@@ -0,0 +1,242 @@
+# app/price_trend.py
+
+import logging
+import math
+from typing import List, Optional, Sequence
+
+from pymongo import UpdateOne
+
+from app.aggregates import CoMoments, PowerSums
+from app.cleaning import clean_number, safe_float_conversion
+from app.config import PRICE_BUCKET_BASE_WIDTH
+from app.database import price_trend_collection, product_collection
+from app.partitioned_scan import scan_aggregate
+from app.rebuilds import ScanLedger, rebuild_lock, reconcile_writes, replace_collection
+from app.snapshot import start_watermark
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Columns of the running statistics, in storage order
+TREND_COLUMNS = ['actual_price', 'discounted_price', 'discount_percentage', 'rating', 'rating_count']
+
+# Document id of the shifted power sums, which also record the bin width; numeric ids are actual_price bins
+SUMS_ID = "sums"
+
+# The shift of the stored power sums as this process last read it. Writes filter their $inc on it,
+# so a write made against an older build's shift matches nothing and is retried with the new one.
+_shift: Optional[List[float]] = None
+
+
+class PriceTrendStats:
+    """
+    Sufficient statistics for /analytics/price_trend: co-moments of the five trend columns over
+    products where all five are valid, plus the range of actual_price.
+    """
+
+    def __init__(self, moments: CoMoments, actual_min: Optional[float], actual_max: Optional[float]):
+        self.moments = moments
+        self.actual_min = actual_min
+        self.actual_max = actual_max
+
+    def regression(self):
+        """
+        Closed-form least squares fit of discounted_price on actual_price.
+
+        Returns:
+            tuple: (slope, intercept)
+        """
+        x, y = TREND_COLUMNS.index('actual_price'), TREND_COLUMNS.index('discounted_price')
+        variance = self.moments.comoment[x][x]
+        slope = self.moments.comoment[x][y] / variance if variance > 0 else 0.0
+        intercept = self.moments.mean[y] - slope * self.moments.mean[x]
+        return slope, intercept
+
+    def prediction_grid(self, points: int, step: int = 1000) -> List[int]:
+        """
+        Actual prices to predict at: every `step` from min to max like before, or `points`
+        evenly spaced prices when that grid would be larger.
+        """
+        actual_min, actual_max = int(self.actual_min), int(self.actual_max)
+        grid = range(actual_min, actual_max + step, step)
+        if len(grid) <= points:
+            return list(grid)
+        if points < 2 or actual_max == actual_min:
+            return [actual_min]
+        spacing = (actual_max - actual_min) / (points - 1)
+        return [int(round(actual_min + i * spacing)) for i in range(points)]
+
+
+def _row(product: Optional[dict]) -> Optional[List[float]]:
+    """
+    Returns the cleaned trend columns of a product, or None if any of them is missing.
+    """
+    if not product:
+        return None
+    row = [
+        clean_number(product.get('actual_price')),
+        clean_number(product.get('discounted_price')),
+        clean_number(product.get('discount_percentage')),
+        safe_float_conversion(product.get('rating')),
+        clean_number(product.get('rating_count')),
+    ]
+    return None if any(value is None for value in row) else row
+
+
+def _bin(actual_price: float) -> int:
+    return max(math.ceil(actual_price / PRICE_BUCKET_BASE_WIDTH) - 1, 0)
+
+
+def _trend_partial(documents: list) -> tuple:
+    """
+    Reduces a batch of products to (CoMoments, actual_price histogram per bin, ScanLedger of
+    the rows counted); the partitioned rebuild's map function.
+    """
+    moments = CoMoments(TREND_COLUMNS)
+    bins, product_ids, rows = {}, [], []
+    for product in documents:
+        row = _row(product)
+        if row is None:
+            continue
+        moments.add(row)
+        price_hist = bins.setdefault(_bin(row[0]), {})
+        key = str(math.floor(row[0]))
+        price_hist[key] = price_hist.get(key, 0) + 1
+        product_ids.append(product['_id'])
+        rows.append(row)
+    return moments, bins, ScanLedger.of(product_ids, rows, width=len(TREND_COLUMNS))
+
+
+def _merge_trend_partials(partial: tuple, other: tuple) -> tuple:
+    moments, bins, ledger = partial
+    moments.merge(other[0])
+    for index, other_hist in other[1].items():
+        price_hist = bins.setdefault(index, {})
+        for key, count in other_hist.items():
+            price_hist[key] = price_hist.get(key, 0) + count
+    ledger.merge(other[2])
+    return partial
+
+
+async def rebuild_price_trend_stats():
+    """
+    Rebuilds the stored statistics from a full scan of the products collection, in parallel
+    partitions when configured, into a scratch collection renamed over the live one, then moves
+    the products written during the scan to their current rows (see app/rebuilds.py). The power
+    sums are shifted by the column means at build time. One process rebuilds at a time; one that
+    waited for another's rebuild finds it built and returns.
+    """
+    async with rebuild_lock("price_trend"):
+        if await _read_sums() is not None:
+            return
+
+        started = start_watermark()
+        moments, bins, ledger = await scan_aggregate(
+            product_collection, TREND_COLUMNS + ['_id'], "price_trend_rebuild", _trend_partial, _merge_trend_partials,
+        ) or (CoMoments(TREND_COLUMNS), {}, ScanLedger(len(TREND_COLUMNS)))
+
+        docs = [{"_id": SUMS_ID, "base_width": PRICE_BUCKET_BASE_WIDTH, **PowerSums.from_comoments(moments).to_document()}]
+        docs.extend(
+            {"_id": index, "count": sum(price_hist.values()), "price_hist": price_hist}
+            for index, price_hist in bins.items()
+        )
+        await replace_collection(price_trend_collection, docs)
+        moved = await reconcile_writes(started, ledger, TREND_COLUMNS, "price_trend_rebuild", _row, _move)
+        logger.info(f"Rebuilt price trend statistics over {moments.n} products; moved {moved} products written meanwhile.")
+
+
+async def _read_sums() -> Optional[dict]:
+    """
+    Reads the stored power sums, or None if they are missing or were built with a different grid.
+    """
+    global _shift
+    doc = await price_trend_collection.find_one({"_id": SUMS_ID})
+    if not doc or doc.get("base_width") != PRICE_BUCKET_BASE_WIDTH:
+        return None
+    _shift = doc.get("shift")
+    return doc
+
+
+async def _edge_price(direction: int) -> Optional[float]:
+    """
+    Reads the lowest (direction=1) or highest (direction=-1) populated actual_price bin.
+    """
+    doc = await price_trend_collection.find_one(
+        {"_id": {"$type": "number"}, "count": {"$gt": 0}},
+        sort=[("_id", direction)],
+    )
+    if not doc:
+        return None
+    prices = [int(key) for key, count in doc.get("price_hist", {}).items() if count > 0]
+    if not prices:
+        return None
+    return float(min(prices) if direction == 1 else max(prices))
+
+
+async def load_price_trend_stats() -> PriceTrendStats:
+    """
+    Loads the running statistics with three small reads, independent of catalogue size.
+    Rebuilds them first if they are missing or were built with a different grid.
+    """
+    doc = await _read_sums()
+    if doc is None:
+        await rebuild_price_trend_stats()
+        doc = await _read_sums() or {}
+    moments = PowerSums.from_document(TREND_COLUMNS, doc).to_comoments()
+    return PriceTrendStats(moments, await _edge_price(1), await _edge_price(-1))
+
+
+async def record_product_write(before: Optional[dict], after: Optional[dict]):
+    """
+    Removes a product's old row from the running statistics and adds its new one.
+    Pass None for `before` on create and for `after` on delete.
+    Failures are logged and never fail the write itself.
+    """
+    await _move(_row(before), _row(after))
+
+
+async def _move(old: Optional[Sequence[float]], new: Optional[Sequence[float]]):
+    if old == new:
+        return
+
+    try:
+        operations = []
+        for row, weight in ((old, -1), (new, 1)):
+            if row is not None:
+                operations.append(UpdateOne(
+                    {"_id": _bin(row[0])},
+                    {"$inc": {"count": weight, f"price_hist.{math.floor(row[0])}": weight}},
+                    upsert=True,
+                ))
+        # Applied whether or not the statistics are built: a build replaces whatever this creates
+        await price_trend_collection.bulk_write(operations, ordered=False)
+        await _increment_sums(old, new)
+    except Exception as e:
+        logger.error(f"Error updating price trend statistics: {e}")
+
+
+async def _increment_sums(old: Optional[Sequence[float]], new: Optional[Sequence[float]]):
+    """
+    Applies a product's change to the power sums in one update, filtered on the shift the
+    increments were computed around. If a rebuild changed the shift, reads it again and retries.
+    """
+    global _shift
+    for attempt in range(2):
+        if _shift is None or attempt:
+            stored = await price_trend_collection.find_one({"_id": SUMS_ID}, {"shift": 1})
+            if not stored:
+                # Not built yet; the build scan picks this write up
+                return
+            _shift = stored.get("shift")
+        sums = PowerSums(TREND_COLUMNS, _shift)
+        increments = {}
+        for row, weight in ((old, -1), (new, 1)):
+            if row is None:
+                continue
+            for key, delta in sums.increments(row, weight).items():
+                increments[key] = increments.get(key, 0) + delta
+        result = await price_trend_collection.update_one({"_id": SUMS_ID, "shift": _shift}, {"$inc": increments})
+        if result.matched_count:
+            return
+    logger.warning("Price trend statistics were rebuilt twice during one write; its power sums were not updated.")
@@ -0,0 +1,188 @@
+# app/rebuilds.py
+#
+# Rebuilds of the precomputed analytics collections (price buckets, price trend statistics,
+# sentiment rollup). A rebuild writes its documents, the settings document included, into a
+# scratch collection and renames it over the live one, so readers see the old collection or the
+# new one whole, never a half-written one, and never one without its settings document. A lock
+# document in analytics_meta lets one process rebuild a collection at a time; the others wait for
+# it and then find the collection built.
+#
+# Product writes keep applying their $inc deltas to the live collection while a rebuild runs, and
+# the rename throws away those made to products the scan had already read. The sentiment rollup
+# regroups the rows writes touched meanwhile (app/sentiment_rollup.py). The price bucket and price
+# trend scans keep a ScanLedger of what they counted for each product instead, and once the new
+# collection is in place reconcile_writes moves every product written or deleted since the scan
+# started (by its updated_at stamp or tombstone) from what the scan counted to what it is now.
+
+import asyncio
+import hashlib
+import logging
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence
+
+from pymongo.errors import DuplicateKeyError
+
+from app.config import REBUILD_LOCK_POLL, REBUILD_LOCK_SECONDS
+from app.database import analytics_meta_collection
+from app.snapshot import changes_since
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Waiters in this process queue here rather than each polling the lock document
+_local_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def _try_acquire(lock_id: str, owner: str) -> bool:
+    now = _now()
+    expires_at = now + timedelta(seconds=REBUILD_LOCK_SECONDS)
+    try:
+        await analytics_meta_collection.insert_one({"_id": lock_id, "owner": owner, "expires_at": expires_at})
+        return True
+    except DuplicateKeyError:
+        # Take the lock over if its holder died without releasing it
+        taken = await analytics_meta_collection.find_one_and_update(
+            {"_id": lock_id, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": expires_at}},
+        )
+        return taken is not None
+
+
+@asynccontextmanager
+async def rebuild_lock(name: str):
+    """
+    Holds the rebuild lock of a collection, across processes, for the duration of the block.
+    Callers check again inside the block whether the collection still needs rebuilding, since
+    the process they waited for may have just rebuilt it.
+    """
+    lock_id, owner = f"rebuild:{name}", uuid.uuid4().hex
+    async with _local_locks[name]:
+        while not await _try_acquire(lock_id, owner):
+            await asyncio.sleep(REBUILD_LOCK_POLL)
+        try:
+            yield
+        finally:
+            try:
+                await analytics_meta_collection.delete_one({"_id": lock_id, "owner": owner})
+            except Exception as e:
+                # The lock expires on its own
+                logger.error(f"Error releasing the {name} rebuild lock: {e}")
+
+
+def scratch_collection(collection):
+    """
+    A new, empty collection to build a replacement for `collection` in.
+    """
+    return collection.database.get_collection(f"{collection.name}.rebuild.{uuid.uuid4().hex}")
+
+
+async def swap_in(scratch, collection):
+    """
+    Replaces `collection` with `scratch` in one rename.
+    """
+    await scratch.rename(collection.name, dropTarget=True)
+
+
+async def replace_collection(collection, documents: List[dict]):
+    """
+    Replaces the contents of `collection` with `documents` (which must not be empty) at once.
+    """
+    scratch = scratch_collection(collection)
+    try:
+        await scratch.insert_many(documents)
+        await swap_in(scratch, collection)
+    except Exception:
+        await scratch.drop()
+        raise
+
+
+def _digest(product_id) -> int:
+    # Stable across the processes of a partitioned scan, unlike hash()
+    return int.from_bytes(hashlib.blake2b(str(product_id).encode(), digest_size=8).digest(), "little")
+
+
+class ScanLedger:
+    """
+    What a rebuild scan counted for each product it read: a 64-bit digest of the product id and
+    the product's contribution, a fixed-width row of floats, kept in arrays so a ledger of the
+    whole catalogue stays small. Ledgers of the scan's batches merge by concatenation.
+    """
+
+    def __init__(self, width: int):
+        self.width = width
+        self.keys: list = []
+        self.rows: list = []
+
+    @classmethod
+    def of(cls, product_ids: List, rows: List[Sequence[float]], width: int) -> "ScanLedger":
+        import numpy as np
+
+        ledger = cls(width)
+        if product_ids:
+            ledger.keys.append(np.array([_digest(product_id) for product_id in product_ids], dtype=np.uint64))
+            ledger.rows.append(np.array(rows, dtype=np.float64).reshape(len(rows), width))
+        return ledger
+
+    def merge(self, other: "ScanLedger") -> "ScanLedger":
+        self.keys.extend(other.keys)
+        self.rows.extend(other.rows)
+        return self
+
+    def counted(self, product_ids: Iterable[str]) -> Dict[str, tuple]:
+        """
+        Returns the contribution the scan counted for each of `product_ids` it counted one for.
+        """
+        import numpy as np
+
+        wanted = {_digest(product_id): product_id for product_id in product_ids}
+        if not wanted:
+            return {}
+        digests = np.array(list(wanted), dtype=np.uint64)
+        found = {}
+        for keys, rows in zip(self.keys, self.rows):
+            for position in np.flatnonzero(np.isin(keys, digests)):
+                found[wanted[int(keys[position])]] = tuple(rows[position].tolist())
+        return found
+
+
+async def reconcile_writes(
+    since: datetime,
+    ledger: ScanLedger,
+    fields: Sequence[str],
+    endpoint: str,
+    contribution: Callable[[dict], Optional[Sequence[float]]],
+    move: Callable[[Optional[tuple], Optional[tuple]], Awaitable[None]],
+) -> int:
+    """
+    Brings a collection just swapped in from a scan that started at the watermark `since` up to
+    date with the product writes made meanwhile: `move(counted, current)` takes each product
+    written or deleted since out of the contribution the scan counted for it (None if none) and
+    adds its current one (None if deleted or not counted). Writes made after this reads the
+    products apply their own deltas to the new collection.
+
+    Returns:
+        int: the number of products moved
+    """
+    _, changed, deleted = await changes_since(since, list(fields) + ["_id"], endpoint)
+    current = {}
+    for product in changed:
+        row = contribution(product)
+        current[str(product["_id"])] = tuple(row) if row is not None else None
+    for product_id in deleted:
+        current.setdefault(product_id, None)
+
+    counted = ledger.counted(current)
+    moved = 0
+    for product_id, row in current.items():
+        if counted.get(product_id) != row:
+            await move(counted.get(product_id), row)
+            moved += 1
+    return moved
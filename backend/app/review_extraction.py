@@ -0,0 +1,133 @@
+# app/review_extraction.py
+#
+# Reviews are embedded in product documents as comma separated fields (user_id, review_id,
+# review_content, ...), one entry per review, while rating, review_date, product_id and
+# product_name are per product. iter_reviews unzips a product into ReviewRecord tuples as it
+# goes: the per-product values are converted once and repeated, and no list of reviews is built.
+# Callers that need many reviews at once read them as columns (iter_review_columns), appended
+# straight into one list per field instead of one dict per review.
+
+import functools
+from itertools import islice, repeat
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from app.cleaning import safe_float_conversion
+
+# Product fields a review is extracted from
+REVIEW_FIELDS = [
+    'product_id', 'product_name', 'user_id', 'user_name', 'review_id', 'review_title',
+    'review_content', 'rating', 'review_date', 'helpful_count',
+]
+
+
+class ReviewRecord(NamedTuple):
+    review_id: str
+    product_id: str
+    product_name: str
+    user_id: str
+    user_name: str
+    review_title: str
+    review_content: str
+    rating: Optional[float]
+    review_date: object
+    helpful_count: int
+
+
+REVIEW_RECORD_FIELDS = ReviewRecord._fields
+
+# Product fields holding one comma separated entry per review
+SPLIT_FIELDS = ['review_id', 'user_id', 'user_name', 'review_title', 'review_content']
+
+
+def _string(product: dict, field: str, default: str = "") -> str:
+    value = product.get(field, default)
+    return default if value is None else str(value)
+
+
+def _helpful_count(value: str) -> int:
+    return int(value) if value.isdigit() else 0
+
+
+def _review_values(product: dict) -> Tuple[int, list]:
+    """
+    The number of reviews of a product and, in ReviewRecord field order, a lazy iterable of each
+    field's values. The comma separated fields are split once; the per-product values repeat.
+    """
+    split = [_string(product, field).split(",") for field in SPLIT_FIELDS]
+    if product.get("helpful_count"):
+        helpful_counts = _string(product, "helpful_count").split(",")
+        split.append(helpful_counts)
+        helpful_counts = map(_helpful_count, helpful_counts)
+    else:
+        helpful_counts = repeat(0)
+    review_ids, user_ids, user_names, review_titles, review_contents = (map(str.strip, values) for values in split[:5])
+
+    # Every review has the product's rating and review date
+    return min(map(len, split)), [
+        review_ids,
+        repeat(_string(product, "product_id").strip()),
+        repeat(_string(product, "product_name", "Unknown").strip()),
+        user_ids,
+        user_names,
+        review_titles,
+        review_contents,
+        repeat(safe_float_conversion(product.get("rating"))),
+        repeat(product.get("review_date", "")),
+        helpful_counts,
+    ]
+
+
+# Builds a record from a tuple of its fields without going through the Python-level __new__
+_record = functools.partial(tuple.__new__, ReviewRecord)
+
+
+def iter_reviews(product: dict) -> Iterator[ReviewRecord]:
+    """
+    Yields the reviews embedded in a product document, stopping at the shortest of the comma
+    separated review fields.
+    """
+    count, values = _review_values(product)
+    return map(_record, islice(zip(*values), count))
+
+
+def extract_reviews_from_product(product: dict) -> List[dict]:
+    """
+    Extracts individual reviews from a product document, as dicts.
+    """
+    return [review._asdict() for review in iter_reviews(product)]
+
+
+def iter_review_columns(
+    products: Iterable[dict],
+    fields: Sequence[str] = REVIEW_RECORD_FIELDS,
+    batch_size: Optional[int] = None,
+) -> Iterator[Dict[str, list]]:
+    """
+    Yields the reviews of `products` as {field: [values]} batches of up to `batch_size` rows
+    (one batch with all of them by default). Only `fields` are kept.
+    """
+    positions = [REVIEW_RECORD_FIELDS.index(field) for field in fields]
+    columns = {field: [] for field in fields}
+    rows = 0
+    for product in products:
+        count, values = _review_values(product)
+        while count:
+            # Each column is extended straight from the product's values, without a record per review
+            taken = count if batch_size is None else min(count, batch_size - rows)
+            for field, position in zip(fields, positions):
+                columns[field].extend(islice(values[position], taken))
+            count -= taken
+            rows += taken
+            if rows == batch_size:
+                yield columns
+                columns = {field: [] for field in fields}
+                rows = 0
+    if rows or batch_size is None:
+        yield columns
+
+
+def review_columns(products: Iterable[dict], fields: Sequence[str] = REVIEW_RECORD_FIELDS) -> Dict[str, list]:
+    """
+    Every review of `products` as one {field: [values]} batch.
+    """
+    return next(iter_review_columns(products, fields))
@@ -0,0 +1,285 @@
+# app/review_search.py
+#
+# In-process inverted index over the reviews embedded in product documents, ranked with BM25.
+# Review title and content are tokenized with clean_text, the same normalization the sentiment
+# endpoints use. Postings, document lengths, ratings and categories live in flat typed arrays,
+# so scoring a query is a handful of numpy operations over the postings of its terms.
+#
+# Each worker builds its index on the first search and, before every search, catches up on the
+# products written or deleted since (see changes_since in app/snapshot.py), so writes handled by
+# any worker show up everywhere. Replaced reviews are only marked dead; the index is rebuilt once
+# dead reviews outnumber live ones.
+
+import asyncio
+import logging
+import math
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+from app.aggregates import main_category
+from app.cleaning import clean_text
+from app.database import product_collection
+from app.fetch import fetch_documents, iter_batches
+from app.review_extraction import REVIEW_FIELDS, iter_reviews
+from app.snapshot import changes_since, start_watermark
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Product fields the index reads
+INDEX_FIELDS = ['_id', 'category'] + REVIEW_FIELDS
+
+# The index of this process, built on first use
+_index: Optional["ReviewIndex"] = None
+_lock = asyncio.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    return clean_text(text or '').split()
+
+
+class ReviewIndex:
+    """
+    BM25 index of reviews. A document is one review, identified by the position of its product
+    in `product_oids` and its position among that product's reviews.
+    """
+
+    def __init__(self):
+        # term -> (document ids, term frequencies), both in increasing document order
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_length = array('I')
+        self.doc_rating = array('f')  # NaN when the product has no valid rating
+        self.doc_category = array('i')
+        self.doc_product = array('I')
+        self.doc_position = array('I')
+        self.alive = bytearray()
+
+        self.categories: List[str] = []
+        self._category_codes: Dict[str, int] = {}
+        self.product_oids: List[str] = []
+        self._product_slots: Dict[str, int] = {}
+        self._product_docs: Dict[int, List[int]] = {}
+
+        self.live_docs = 0
+        self.live_length = 0
+        self.dead_docs = 0
+        self.watermark = None
+
+    def _category_code(self, category: str) -> int:
+        key = category.lower()
+        if key not in self._category_codes:
+            self._category_codes[key] = len(self.categories)
+            self.categories.append(category)
+        return self._category_codes[key]
+
+    def add_product(self, product: dict):
+        """
+        Indexes the reviews of a product, replacing any it had in the index.
+        """
+        oid = str(product['_id'])
+        self.remove_product(oid)
+        if not product.get('review_id'):
+            return
+
+        slot = self._product_slots.get(oid)
+        if slot is None:
+            slot = self._product_slots[oid] = len(self.product_oids)
+            self.product_oids.append(oid)
+        category = self._category_code(main_category(product.get('category')))
+
+        docs = []
+        for position, review in enumerate(iter_reviews(product)):
+            terms = Counter(tokenize(f"{review.review_title} {review.review_content}"))
+            if not terms:
+                continue
+            doc = len(self.doc_length)
+            for term, frequency in terms.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = (array('I'), array('H'))
+                postings[0].append(doc)
+                postings[1].append(min(frequency, 65535))
+            length = sum(terms.values())
+            rating = review.rating
+            self.doc_length.append(length)
+            self.doc_rating.append(math.nan if rating is None else rating)
+            self.doc_category.append(category)
+            self.doc_product.append(slot)
+            self.doc_position.append(position)
+            self.alive.append(1)
+            self.live_docs += 1
+            self.live_length += length
+            docs.append(doc)
+        if docs:
+            self._product_docs[slot] = docs
+
+    def remove_product(self, oid: str):
+        slot = self._product_slots.get(oid)
+        if slot is None:
+            return
+        for doc in self._product_docs.pop(slot, []):
+            self.alive[doc] = 0
+            self.live_docs -= 1
+            self.live_length -= self.doc_length[doc]
+            self.dead_docs += 1
+
+    @property
+    def needs_rebuild(self) -> bool:
+        return self.dead_docs > max(self.live_docs, 1000)
+
+    def search(
+        self,
+        query: str,
+        min_rating: Optional[float] = None,
+        max_rating: Optional[float] = None,
+        categories: Optional[List[str]] = None,
+        offset: int = 0,
+        limit: int = 10,
+    ) -> Tuple[int, List[Tuple[int, float]]]:
+        """
+        Ranks the live reviews matching any query term by BM25 and applies the filters.
+
+        Returns:
+            tuple: (number of matching reviews, [(document id, score)] for the requested page)
+        """
+        import numpy as np
+
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term in self.postings]
+        if not terms or self.live_docs == 0:
+            return 0, []
+
+        alive = np.frombuffer(self.alive, dtype=np.uint8).astype(bool)
+        lengths = np.frombuffer(self.doc_length, dtype=np.uint32)
+        average_length = self.live_length / self.live_docs
+
+        matched_ids, matched_scores = [], []
+        for term in terms:
+            ids = np.frombuffer(self.postings[term][0], dtype=np.uint32)
+            frequencies = np.frombuffer(self.postings[term][1], dtype=np.uint16)
+            live = alive[ids]
+            ids, frequencies = ids[live], frequencies[live].astype('float64')
+            if ids.size == 0:
+                continue
+            idf = math.log(1 + (self.live_docs - ids.size + 0.5) / (ids.size + 0.5))
+            saturation = frequencies * (BM25_K1 + 1) / (
+                frequencies + BM25_K1 * (1 - BM25_B + BM25_B * lengths[ids] / average_length)
+            )
+            matched_ids.append(ids)
+            matched_scores.append(idf * saturation)
+        if not matched_ids:
+            return 0, []
+
+        ids, weights = np.concatenate(matched_ids), np.concatenate(matched_scores)
+        if ids.size * 16 > len(self.doc_length):
+            # Common terms: summing into a dense array is cheaper than sorting the postings
+            dense = np.bincount(ids, weights=weights, minlength=len(self.doc_length))
+            docs = np.flatnonzero(dense)
+            scores = dense[docs]
+        else:
+            docs, inverse = np.unique(ids, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+
+        keep = np.ones(docs.size, dtype=bool)
+        if min_rating is not None or max_rating is not None:
+            ratings = np.frombuffer(self.doc_rating, dtype=np.float32)[docs]
+            if min_rating is not None:
+                keep &= ratings >= min_rating
+            if max_rating is not None:
+                keep &= ratings <= max_rating
+        if categories:
+            codes = [self._category_codes[c.lower()] for c in categories if c.lower() in self._category_codes]
+            keep &= np.isin(np.frombuffer(self.doc_category, dtype=np.int32)[docs], codes)
+        docs, scores = docs[keep], scores[keep]
+
+        total = int(docs.size)
+        end = min(offset + limit, total)
+        if offset >= end:
+            return total, []
+        # Partial selection of the best `end` matches, then an exact sort of just those
+        # (ties keep index order)
+        if end < total:
+            best = np.argpartition(-scores, end - 1)[:end]
+            docs, scores = docs[best], scores[best]
+        order = np.lexsort((docs, -scores))[offset:end]
+        return total, [(int(docs[i]), float(scores[i])) for i in order]
+
+
+async def build_review_index() -> ReviewIndex:
+    """
+    Builds an index from one projected scan over the products that have reviews.
+    """
+    index = ReviewIndex()
+    index.watermark = start_watermark()
+    async for batch in iter_batches(
+        product_collection, INDEX_FIELDS, 'review_index', query={"review_id": {"$exists": True, "$ne": ""}}
+    ):
+        for product in batch:
+            index.add_product(product)
+    logger.info(f"Built review search index: {index.live_docs} reviews, {len(index.postings)} terms.")
+    return index
+
+
+async def get_review_index() -> ReviewIndex:
+    """
+    Returns this process's index, caught up with every product write since it was last used.
+    """
+    global _index
+    async with _lock:
+        if _index is None or _index.needs_rebuild:
+            _index = await build_review_index()
+            return _index
+        watermark, changed, deleted = await changes_since(_index.watermark, INDEX_FIELDS, 'review_index_catch_up')
+        for product in changed:
+            _index.add_product(product)
+        for oid in deleted:
+            _index.remove_product(oid)
+        _index.watermark = watermark
+        return _index
+
+
+async def search_reviews(
+    query: str,
+    min_rating: Optional[float] = None,
+    max_rating: Optional[float] = None,
+    categories: Optional[List[str]] = None,
+    page: int = 1,
+    page_size: int = 10,
+) -> dict:
+    """
+    Searches the reviews and loads the requested page from the products they belong to.
+
+    Returns:
+        dict: total, page, page_size and the reviews of the page, best match first, each with
+        its main_category and BM25 score.
+    """
+    index = await get_review_index()
+    total, hits = index.search(query, min_rating, max_rating, categories, (page - 1) * page_size, page_size)
+
+    oids = list(dict.fromkeys(index.product_oids[index.doc_product[doc]] for doc, _ in hits))
+    products = await fetch_documents(
+        product_collection, INDEX_FIELDS, 'review_search', query={"_id": {"$in": [ObjectId(oid) for oid in oids]}}
+    )
+    reviews_by_product = {str(product['_id']): (product, list(iter_reviews(product))) for product in products}
+
+    results = []
+    for doc, score in hits:
+        product, reviews = reviews_by_product.get(index.product_oids[index.doc_product[doc]], (None, []))
+        position = index.doc_position[doc]
+        # The product changed after this search caught up; it is re-indexed on the next one
+        if position >= len(reviews):
+            continue
+        results.append({
+            **reviews[position]._asdict(),
+            'main_category': main_category(product.get('category')),
+            'score': score,
+        })
+
+    return {"total": total, "page": page, "page_size": page_size, "reviews": results}
@@ -1,19 +1,58 @@
 # app/routers/analytics.py
 
-from fastapi import APIRouter, HTTPException, Query, Body, Path
+from fastapi import APIRouter, HTTPException, Query, Body, Path, Response
 from app.database import product_collection  # No separate review_collection
-import pandas as pd
-from sklearn.linear_model import LogisticRegression, LinearRegression
-from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics import accuracy_score, classification_report
 import re
-from typing import Optional, Union, List
-from collections import Counter, defaultdict
+from typing import Literal, Optional, List
+from collections import Counter
 import logging
 import math
-import random  # Don't forget to import random
+import random
+from datetime import datetime, timezone
 from app.models import Review  # Ensure you import the Review model
+from app.cleaning import clean_text, clean_number_column, safe_float_column
+from app.config import (
+    ANALYTICS_ENGINE,
+    LIST_CACHE_SECONDS,
+    LIST_MAX_PAGE_SIZE,
+    LIST_PAGE_SIZE,
+    LOW_STOCK_THRESHOLD,
+    PRICE_BUCKET_BASE_WIDTH,
+    PRICE_BUCKET_EDGES,
+    PRICE_TREND_MAX_POINTS,
+    PRICE_TREND_POINTS,
+    SENTIMENT_TRAINING,
+    SUMMARY_LOW_STOCK_LIMIT,
+    SUMMARY_MAX_ITEMS,
+    SUMMARY_RATING_BINS,
+    SUMMARY_RATING_TOP_K,
+    WORDCLOUD_COUNTING,
+    WORDCLOUD_SKETCH_ERROR,
+)
+from app.aggregates import SpaceSaving
+from app.price_buckets import load_price_buckets
+from app.price_trend import load_price_trend_stats
+from app.sentiment_rollup import load_sentiment_rollup, rebuild_sentiment_rollup
+from app.fetch import fetch_columns, iter_batches, transfer_stats
+from app.jobs import describe, get_job, submit_job
+from app.partial_aggregates import (
+    PRICE_TREND_CLEANERS,
+    RATING_DISCOUNT_CLEANERS,
+    CorrelationAggregation,
+    PriceBucketAggregation,
+    SummaryAggregation,
+    aggregations,
+    combine_encoded,
+    run_aggregation,
+    sentiment_distribution_of,
+)
+from app.pagination import NEXT_CURSOR_HEADER, after_cursor, create_indexes, decode_cursor, encode_cursor
+from app.review_extraction import REVIEW_FIELDS, iter_reviews, review_columns
+from app.admission import admission, admission_stats, get_limiter
+from app.sentiment import label_for_rating, labelled_query, rescore_stale, review_sentiments
+from app.sentiment_model import get_sentiment_model
+from app.singleflight import coalescing_stats, singleflight
+from app.snapshot import SnapshotInProgress, current_snapshot, write_snapshot
 
 router = APIRouter(
     prefix="/analytics",
@@ -24,242 +63,130 @@ router = APIRouter(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# pandas and scikit-learn are imported inside the endpoints that use them so that
+# importing this router (and booting a worker) stays cheap. Python caches the
+# modules after the first request, so the lazy import only costs once per process.
 
-def clean_number(number_input: Optional[Union[str, int, float]]) -> Optional[float]:
-    """
-    Cleans a string representing a number by removing currency symbols, commas, and percentage signs.
-    Converts the cleaned string to a float. Returns None if conversion fails or input is invalid.
-
-    Parameters:
-        number_input (Optional[Union[str, int, float]]): The input to clean and convert.
-
-    Returns:
-        Optional[float]: The cleaned float value or None.
-    """
-    if not number_input:
-        return None
 
-    # If the input is not a string, attempt to convert it to a string
-    if not isinstance(number_input, str):
-        try:
-            number_str = str(number_input)
-        except Exception as e:
-            logger.error(f"Error converting input to string: {e}")
-            return None
-    else:
-        number_str = number_input
-
-    # Remove currency symbols, commas, percentage signs, and whitespace
-    cleaned_str = re.sub(r'[₹%,]', '', number_str).strip()
-
-    # Remove any remaining non-numeric characters except the decimal point
-    cleaned_str = re.sub(r'[^\d\.]', '', cleaned_str)
-
-    # If the cleaned string is empty, return None
-    if not cleaned_str:
-        logger.warning(f"clean_number: Cleaned string is empty after cleaning '{number_str}'. Setting to None.")
-        return None
-
-    try:
-        return float(cleaned_str)
-    except ValueError:
-        logger.error(f"ValueError: Cannot convert '{cleaned_str}' to float.")
-        return None
+# Product fields read by each analytics scan; everything else stays on the server
+SENTIMENT_REVIEW_FIELDS = REVIEW_FIELDS + ['review_sentiments', 'sentiment_version']
+TOP_PRODUCT_FIELDS = [
+    'product_id', 'product_name', 'category', 'actual_price', 'discounted_price',
+    'discount_percentage', 'rating', 'rating_count',
+]
 
 
-def safe_float_conversion(value: Optional[Union[str, int, float]]) -> Optional[float]:
+async def _engine_snapshot():
     """
-    Safely converts a value to float. Returns None if conversion fails.
-
-    Parameters:
-        value (Optional[Union[str, int, float]]): The value to convert.
-
-    Returns:
-        Optional[float]: The converted float value or None.
+    Returns the snapshot to query with the DuckDB engine, or None when the pandas engine is
+    configured or no snapshot is loaded.
     """
-    if not value:
-        return None
-    try:
-        float_value = float(value)
-        if not math.isfinite(float_value):
-            logger.warning(f"safe_float_conversion: Non-finite float '{float_value}'. Setting to None.")
-            return None
-        return float_value
-    except (ValueError, TypeError):
-        logger.error(f"safe_float_conversion: Cannot convert '{value}' to float.")
+    if ANALYTICS_ENGINE != 'duckdb':
         return None
+    return await current_snapshot()
 
 
-def clean_text(text: str) -> str:
-    """
-    Cleans review text by removing special characters and digits, keeping only alphabets and spaces.
-    Converts text to lowercase.
+@router.on_event("startup")
+async def create_product_indexes():
+    # Low-stock products are a range of this index, already in stock order
+    await create_indexes(product_collection, [[("inventory", 1), ("_id", 1)]])
 
-    Parameters:
-        text (str): The review text to clean.
 
-    Returns:
-        str: The cleaned text.
+async def _low_stock_products(limit: int) -> dict:
+    """
+    The products with inventory below LOW_STOCK_THRESHOLD, lowest first, read from the
+    inventory index (products without an inventory count as stocked). Also counts them all.
     """
-    return re.sub(r'[^a-zA-Z\s]', '', text.lower())
+    query = {"inventory": {"$lt": LOW_STOCK_THRESHOLD}}
+    products = []
+    if limit > 0:
+        documents = product_collection.find(query, {"_id": 0, "product_id": 1, "product_name": 1, "inventory": 1})
+        products = await documents.sort([("inventory", 1), ("_id", 1)]).limit(limit).to_list(length=limit)
+    return {
+        'low_stock_products': [
+            {'product_id': product.get('product_id'), 'product_name': product.get('product_name'), 'inventory': product['inventory']}
+            for product in products
+        ],
+        'low_stock_count': await product_collection.count_documents(query),
+    }
+
 
 @router.get("/summary")
-async def get_summary():
+@singleflight()
+@admission(cost=2)
+async def get_summary(
+    rating_bins: int = Query(SUMMARY_RATING_BINS, ge=1, le=100, description="Bins of the rating histogram over the 0-5 scale"),
+    rating_top_k: int = Query(SUMMARY_RATING_TOP_K, ge=0, le=SUMMARY_MAX_ITEMS, description="Most rated products listed in rating_stats"),
+    low_stock_limit: int = Query(SUMMARY_LOW_STOCK_LIMIT, ge=0, le=SUMMARY_MAX_ITEMS, description="Products listed in low_stock_products"),
+):
     """
     Returns comprehensive analytics data for the dashboard.
+    Runs as SQL over the snapshot when the DuckDB engine is configured.
+
+    The response has a fixed size: ratings come as a histogram, rating_stats lists the most
+    rated products only (GET /analytics/summary/rating_stats pages through every product) and
+    low_stock_products the products lowest in stock, with low_stock_count counting all of them.
+
+    Without a snapshot, each computation scans the catalogue (only the summary's fields, in
+    batches, so memory stays bounded). Unlike the price buckets, the summary is not maintained
+    on writes: its totals would be, but the top sellers and the most rated products are not
+    $inc deltas, and a delete or a decrease in the list would need the scan anyway. Concurrent
+    requests share one scan (singleflight); large catalogues should configure snapshots, or
+    request it as a job.
     """
     try:
-        # Fetch all products from the database
-        products = await product_collection.find().to_list(length=None)
-
-        total_products = len(products)
-        total_sales = 0
-        total_revenue = 0
-        total_profit = 0
-        category_stats = defaultdict(lambda: {
-            'total_products': 0,
-            'total_discount': 0,
-            'product_count': 0,
-            'total_sales': 0,
-            'total_revenue': 0,
-            'total_profit': 0
-        })
-        top_selling_products = []
-        low_stock_products = []
-        rating_stats = []
-        
-        for product in products:
-            # Clean and extract necessary fields
-            category = product.get('category', 'Unknown').split('|')[0].strip()
-            actual_price = clean_number(product.get('actual_price'))
-            discounted_price = clean_number(product.get('discounted_price'))
-            discount_percentage = clean_number(product.get('discount_percentage'))
-            rating = product.get('rating', 0)
-            rating_count = clean_number(product.get('rating_count'))
-            inventory = product.get('inventory', 100)  # Assuming default inventory
-            cost_price = product.get('cost_price', actual_price * 0.7)  # Assuming cost price is 70% of actual price
-
-            # Update category stats
-            category_stats[category]['total_products'] += 1
-            if discount_percentage is not None:
-                category_stats[category]['total_discount'] += discount_percentage
-                category_stats[category]['product_count'] += 1
-
-            # Calculate total sales and revenue
-            if discounted_price is not None and rating_count is not None:
-                sales = discounted_price * rating_count
-                revenue = sales
-                profit = (discounted_price - cost_price) * rating_count
-                total_sales += sales
-                total_revenue += revenue
-                total_profit += profit
-                category_stats[category]['total_sales'] += sales
-                category_stats[category]['total_revenue'] += revenue
-                category_stats[category]['total_profit'] += profit
-
-                # Add to top selling products list
-                top_selling_products.append({
-                    'product_id': product.get('product_id'),
-                    'product_name': product.get('product_name'),
-                    'sales': sales
-                })
-
-            # Add to rating stats
-            rating_stats.append({
-                'product_id': product.get('product_id'),
-                'product_name': product.get('product_name'),
-                'rating': rating,
-                'rating_count': rating_count
-            })
-
-            # Check for low stock
-            if inventory < 10:
-                low_stock_products.append({
-                    'product_id': product.get('product_id'),
-                    'product_name': product.get('product_name'),
-                    'inventory': inventory
-                })
-
-        # Calculate average discount per category
-        for category, stats in category_stats.items():
-            if stats['product_count'] > 0:
-                stats['average_discount'] = stats['total_discount'] / stats['product_count']
-            else:
-                stats['average_discount'] = 0
-            # Remove unnecessary fields
-            del stats['total_discount']
-            del stats['product_count']
-
-        # Get top 5 selling products
-        top_selling_products = sorted(top_selling_products, key=lambda x: x['sales'], reverse=True)[:5]
-
-        summary = {
-            'total_products': total_products,
-            'total_sales': total_sales,
-            'total_revenue': total_revenue,
-            'total_profit': total_profit,
-            'category_stats': dict(category_stats),
-            'top_selling_products': top_selling_products,
-            'low_stock_products': low_stock_products,
-            'rating_stats': rating_stats
-        }
-
-        return summary
+        snapshot = await _engine_snapshot()
+        if snapshot is not None:
+            from app import duckdb_engine
+            summary = await duckdb_engine.summary(snapshot, rating_bins, rating_top_k)
+        else:
+            # One scan of only the fields the summary uses, reduced batch by batch (see app/partial_aggregates.py)
+            aggregation = SummaryAggregation(rating_bins, rating_top_k)
+            summary = aggregation.finalize(await run_aggregation(aggregation))
+        return {**summary, **await _low_stock_products(low_stock_limit)}
 
     except Exception as e:
         logger.error(f"Error fetching summary analytics: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
-def extract_reviews_from_product(product: dict) -> List[dict]:
+
+@router.get("/summary/rating_stats")
+async def summary_rating_stats(
+    response: Response,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_MAX_PAGE_SIZE, description="Number of products in the page"),
+):
     """
-    Extracts individual reviews from a product document.
+    Pages through the rating stats of every product, in _id order, with the cursor of the next
+    page in the X-Next-Cursor header. Each page is one indexed range read.
     """
-    user_ids = product.get("user_id", "").split(",")
-    user_names = product.get("user_name", "").split(",")
-    review_ids = product.get("review_id", "").split(",")
-    review_titles = product.get("review_title", "").split(",")
-    review_contents = product.get("review_content", "").split(",")
-    ratings = [product.get("rating")] * len(review_ids)  # Use product rating for all reviews
-    review_dates = [product.get("review_date", "")] * len(review_ids)  # If available
-    product_name = product.get("product_name", "Unknown")
-    product_id = product.get("product_id", "")
-
-    # Handle 'helpful_count'
-    if "helpful_count" in product and product["helpful_count"]:
-        helpful_counts = product.get("helpful_count", "").split(",")
-    else:
-        helpful_counts = ["0"] * len(review_ids)  # Default to 0 if not present
-
-    # Ensure all lists are of the same length
-    num_reviews = min(
-        len(user_ids),
-        len(user_names),
-        len(review_ids),
-        len(review_titles),
-        len(review_contents),
-        len(ratings),
-        len(helpful_counts),
-    )
-
-    reviews = []
-    for i in range(num_reviews):
-        rating = safe_float_conversion(ratings[i])
-        helpful_count = int(helpful_counts[i]) if helpful_counts[i].isdigit() else 0
-        review = {
-            "review_id": review_ids[i].strip(),
-            "product_id": product_id.strip(),
-            "product_name": product_name.strip(),
-            "user_id": user_ids[i].strip(),
-            "user_name": user_names[i].strip(),
-            "review_title": review_titles[i].strip(),
-            "review_content": review_contents[i].strip(),
-            "rating": rating,
-            "review_date": review_dates[i],  # Adjust if you have actual review dates
-            "helpful_count": helpful_count,
+    query = {}
+    if cursor:
+        try:
+            query = after_cursor(["_id"], decode_cursor(cursor, ["_id"]))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    documents = product_collection.find(query, {"product_id": 1, "product_name": 1, "rating": 1, "rating_count": 1})
+    # One extra document tells whether another page follows
+    page = await documents.sort("_id", 1).limit(limit + 1).to_list(length=limit + 1)
+    response.headers["Cache-Control"] = f"private, max-age={LIST_CACHE_SECONDS}"
+    if len(page) > limit:
+        page = page[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([page[-1]["_id"]])
+
+    # Cleaned as the summary cleans them
+    rating_counts = clean_number_column([product.get('rating_count') for product in page], 'rating_count').to_list()
+    return [
+        {
+            'product_id': product.get('product_id'),
+            'product_name': product.get('product_name'),
+            'rating': product.get('rating', 0),
+            'rating_count': count
         }
-        reviews.append(review)
+        for product, count in zip(page, rating_counts)
+    ]
 
-    return reviews
 
 @router.post("/reviews/{review_id}/helpful")
 async def update_helpful_count(review_id: str = Path(...), change: int = Body(...)):
@@ -298,7 +225,7 @@ async def update_helpful_count(review_id: str = Path(...), change: int = Body(..
         updated_helpful_counts_str = ",".join(helpful_counts)
         result = await product_collection.update_one(
             {"_id": product["_id"]},
-            {"$set": {"helpful_count": updated_helpful_counts_str}}
+            {"$set": {"helpful_count": updated_helpful_counts_str, "updated_at": datetime.now(timezone.utc)}}
         )
 
         if result.modified_count == 1:
@@ -310,7 +237,37 @@ async def update_helpful_count(review_id: str = Path(...), change: int = Body(..
         logger.error(f"Error updating helpful count: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@router.get("/reviews/search")
+@singleflight()
+@admission(cost=1)
+async def search_reviews(
+    q: str = Query(..., min_length=1, description="Words to search for in review titles and contents"),
+    min_rating: Optional[float] = Query(None, ge=0.0, le=5.0, description="Minimum rating"),
+    max_rating: Optional[float] = Query(None, ge=0.0, le=5.0, description="Maximum rating"),
+    categories: Optional[List[str]] = Query(None, description="Filter by main categories"),
+    page: int = Query(1, ge=1, description="Page number"),
+    page_size: int = Query(10, ge=1, le=100, description="Number of reviews per page")
+):
+    """
+    Full-text search over reviews, best match first (BM25 over an in-process inverted index,
+    see app/review_search.py). Reviews match if they contain any of the words in `q`.
+
+    Returns:
+        dict: total, page, page_size and the matching reviews, each with its main_category and score.
+    """
+    from app.review_search import search_reviews as run_search
+
+    if not clean_text(q).split():
+        raise HTTPException(status_code=400, detail="The query has no searchable words.")
+    try:
+        return await run_search(q, min_rating, max_rating, categories, page, page_size)
+    except Exception as e:
+        logger.error(f"Error searching reviews: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search reviews.")
+
+
 @router.get("/reviews", response_model=List[Review])
+@admission(cost=2)
 async def get_reviews(
     min_rating: Optional[float] = Query(None, ge=0.0, le=5.0, description="Minimum rating"),
     max_rating: Optional[float] = Query(None, ge=0.0, le=5.0, description="Maximum rating"),
@@ -318,83 +275,102 @@ async def get_reviews(
 ):
     """
     Returns reviews, optionally filtered by rating.
+
+    The reviews are a uniform random sample of the matching ones, drawn while the products are
+    streamed (reservoir sampling), so only `limit` reviews are held at a time.
     """
+    sample = []
+    matched = 0
     try:
-        # Fetch products that have reviews
-        products_with_reviews = await product_collection.find({
-            "review_id": {"$exists": True, "$ne": ""}
-        }).to_list(length=None)
-
-        all_reviews = []
-
-        # Extract reviews from each product
-        for product in products_with_reviews:
-            product_reviews = extract_reviews_from_product(product)
-            all_reviews.extend(product_reviews)
-
-        # If no reviews found, return an empty list
-        if not all_reviews:
-            return []
-
-        # Convert to DataFrame
-        df = pd.DataFrame(all_reviews)
-
-        # Clean and convert 'rating' to float
-        df['rating'] = df['rating'].apply(safe_float_conversion)
-
-        # Drop rows with missing 'rating'
-        df = df.dropna(subset=['rating'])
-
-        # Apply rating filters
-        if min_rating is not None:
-            df = df[df['rating'] >= min_rating]
-        if max_rating is not None:
-            df = df[df['rating'] <= max_rating]
-
-        # Shuffle the DataFrame
-        df = df.sample(frac=1).reset_index(drop=True)
-
-        # Limit the number of reviews returned
-        df = df.head(limit)
-
-        # Convert DataFrame back to list of dictionaries
-        reviews = df.to_dict(orient='records')
+        async for batch in iter_batches(
+            product_collection, REVIEW_FIELDS, 'reviews', query={"review_id": {"$exists": True, "$ne": ""}}
+        ):
+            for product in batch:
+                for review in iter_reviews(product):
+                    # Skip reviews without a rating or outside the filters
+                    if review.rating is None:
+                        continue
+                    if min_rating is not None and review.rating < min_rating:
+                        continue
+                    if max_rating is not None and review.rating > max_rating:
+                        continue
+                    matched += 1
+                    if limit is None or len(sample) < limit:
+                        sample.append(review)
+                    else:
+                        slot = random.randrange(matched)
+                        if slot < limit:
+                            sample[slot] = review
+
+        # Shuffle the sample, so the order is random too
+        random.shuffle(sample)
 
         # Convert to list of Review models
-        reviews = [Review(**review) for review in reviews]
-
-        return reviews
+        return [Review(**review._asdict()) for review in sample]
 
     except Exception as e:
         logger.error(f"Error fetching reviews: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
         
 @router.get("/sentiment_analysis")
-async def sentiment_analysis():
+@singleflight()
+@admission(cost=4)
+async def sentiment_analysis(
+    retrain: bool = Query(False, description="Retrain a model in this worker from scratch instead of using the shared or updated one, and publish it for scoring reviews")
+):
     """
     Performs sentiment analysis on product reviews.
     - Cleans the review text.
     - Assigns sentiment labels based on ratings.
-    - Trains a Logistic Regression model to classify sentiment.
+    - Trains a classifier to predict the sentiment from the text.
     - Returns model accuracy, classification report, an example prediction, and sentiment distribution.
 
+    In the default streaming mode the model is trained out of core and then kept up to date
+    with new reviews (see app/sentiment_model.py); DASHBOARD_SENTIMENT_TRAINING=batch fits it on
+    every review in memory on each request.
+
     Returns:
         dict: Contains accuracy, classification report, example prediction, and sentiment distribution.
     """
-    all_reviews = []
+    if SENTIMENT_TRAINING == 'batch':
+        return await _batch_sentiment_analysis()
+
+    try:
+        model = await get_sentiment_model(retrain=retrain)
+    except Exception as e:
+        logger.error(f"Error training sentiment model: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch product data for sentiment analysis.")
+    # Counts of withdrawn reviews stay in the distribution as zeros
+    if not +model.distribution:
+        raise HTTPException(status_code=500, detail="No reviews available for sentiment analysis.")
+    return model.summary()
+
+
+async def _batch_sentiment_analysis() -> dict:
+    """
+    Trains TF-IDF features and a Logistic Regression on every review, held in memory.
+    """
+    import pandas as pd
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import train_test_split
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics import accuracy_score, classification_report
+
+    # Only the two columns the model needs are collected, one list each
+    columns = {'review_content': [], 'rating': []}
     try:
-        async for product in product_collection.find():
-            reviews = extract_reviews_from_product(product)
-            all_reviews.extend(reviews)
+        async for batch in iter_batches(product_collection, REVIEW_FIELDS, 'sentiment_analysis'):
+            for name, values in review_columns(batch, list(columns)).items():
+                columns[name].extend(values)
     except Exception as e:
         logger.error(f"Error fetching products for sentiment analysis: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch product data for sentiment analysis.")
 
-    if not all_reviews:
+    if not columns['rating']:
         raise HTTPException(status_code=500, detail="No reviews available for sentiment analysis.")
 
     # Convert to DataFrame
-    df = pd.DataFrame(all_reviews)
+    df = pd.DataFrame(columns)
 
     # Drop rows with missing review content or rating
     df = df.dropna(subset=['review_content', 'rating'])
@@ -405,10 +381,8 @@ async def sentiment_analysis():
     # Clean the review content
     df['cleaned_review'] = df['review_content'].apply(clean_text)
 
-    # Assign sentiment labels based on rating
-    df['sentiment'] = df['rating'].apply(
-        lambda x: 'positive' if x >= 4.0 else ('neutral' if x == 3.0 else 'negative')
-    )
+    # Assign sentiment labels based on rating, with the thresholds every sentiment endpoint uses
+    df['sentiment'] = df['rating'].apply(label_for_rating)
 
     # Prepare features and labels
     X = df['cleaned_review']
@@ -451,313 +425,274 @@ async def sentiment_analysis():
     }
 
 
-@router.get("/price_trend")
-async def get_price_trend():
+async def _stream_comoments(cleaners: dict, endpoint: str, by_category: bool = False):
     """
-    Analyzes pricing trends and correlations with ratings, review counts, and discounts.
-    - Cleans price-related fields.
-    - Trains a Linear Regression model to predict discounted_price based on actual_price.
-    - Predicts discounted prices for a range of actual prices.
-    - Calculates correlation matrix.
+    Computes co-moments of the given numeric fields in one streaming pass over the products.
+    Each batch is cleaned column-wise, rows with any missing value are dropped, and the batch
+    is folded into the running accumulators, so memory does not grow with the catalogue.
+    Reads the memory-mapped snapshot when one is loaded (its columns are already cleaned), and
+    otherwise scans MongoDB, in parallel partitions when configured (see app/partitioned_scan.py).
+
+    Parameters:
+        cleaners (dict): Maps field name to the column cleaner used for it.
+        by_category (bool): Also accumulate per main category.
 
     Returns:
-        dict: Contains future_trends and correlation_matrix.
+        tuple: (overall CoMoments, dict of CoMoments per main category)
     """
-    products = []
-    try:
-        async for product in product_collection.find():
-            # Clean price fields
-            product['actual_price'] = clean_number(product.get('actual_price'))
-            product['discounted_price'] = clean_number(product.get('discounted_price'))
-            product['discount_percentage'] = clean_number(product.get('discount_percentage'))
-            product['rating_count'] = clean_number(product.get('rating_count'))
-            # Ensure 'rating' is a float safely
-            product['rating'] = safe_float_conversion(product.get('rating'))
-            products.append(product)
-    except Exception as e:
-        logger.error(f"Error fetching products for price trend analysis: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch product data for price trend analysis.")
+    aggregation = CorrelationAggregation(cleaners, by_category)
 
-    df = pd.DataFrame(products)
+    snapshot = await current_snapshot()
+    if snapshot is None:
+        return await run_aggregation(aggregation, endpoint)
 
-    # Check required columns
-    required_columns = ['actual_price', 'discounted_price', 'discount_percentage', 'rating', 'rating_count']
-    for col in required_columns:
-        if col not in df.columns:
-            raise HTTPException(status_code=500, detail=f"{col} data not found.")
+    partial = aggregation.empty()
+    columns = aggregation.columns + (['main_category'] if by_category else [])
+    for batch in snapshot.products.batches(columns):
+        cleaned = {name: batch.column(name).to_numpy(zero_copy_only=False) for name in columns}
+        part = aggregation.map_columns(cleaned)
+        if part is not None:
+            partial = aggregation.combine(partial, part)
+    return partial
 
-    # Drop rows with missing data
-    df = df.dropna(subset=required_columns)
 
-    if df.empty:
-        raise HTTPException(status_code=500, detail="No valid pricing data available.")
+@router.get("/price_trend")
+@singleflight()
+@admission(cost=1)
+async def get_price_trend(
+    points: int = Query(PRICE_TREND_POINTS, ge=2, le=PRICE_TREND_MAX_POINTS, description="Maximum number of predicted points"),
+    by_category: bool = Query(False, description="Also return a correlation matrix per main category")
+):
+    """
+    Analyzes pricing trends and correlations with ratings, review counts, and discounts.
+    - Fits a linear regression predicting discounted_price from actual_price.
+    - Predicts discounted prices for a range of actual prices.
+    - Calculates correlation matrix.
 
-    # Predict discounted_price based on actual_price using Linear Regression
-    X = df[['actual_price']]
-    y = df['discounted_price']
+    The regression and correlations come from running sufficient statistics maintained on
+    product writes (see app/price_trend.py), so the cost does not depend on the catalogue
+    size. Predictions are made every 1000 between the lowest and highest actual price, or at
+    `points` evenly spaced prices when that grid would be larger.
 
+    Returns:
+        dict: Contains future_trends and correlation_matrix (and correlation_by_category if requested).
+    """
     try:
-        # Initialize and train the model
-        model = LinearRegression()
-        model.fit(X, y)
+        stats = await load_price_trend_stats()
     except Exception as e:
-        logger.error(f"Error training Linear Regression model: {e}")
-        raise HTTPException(status_code=500, detail="Failed to train Linear Regression model.")
-
-    try:
-        # Predict discounted prices for a range of actual prices
-        actual_min = int(df['actual_price'].min())
-        actual_max = int(df['actual_price'].max())
-        step = 1000  # Adjust the step as needed
-
-        future_actual_prices = pd.DataFrame({
-            'actual_price': range(actual_min, actual_max + step, step)
-        })
-        predicted_discounted_prices = model.predict(future_actual_prices)
+        logger.error(f"Error loading price trend statistics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch product data for price trend analysis.")
 
-        future_trends = future_actual_prices.copy()
-        future_trends['predicted_discounted_price'] = predicted_discounted_prices
-    except Exception as e:
-        logger.error(f"Error predicting future discounted prices: {e}")
-        raise HTTPException(status_code=500, detail="Failed to predict future discounted prices.")
+    if stats.moments.n == 0 or stats.actual_min is None:
+        raise HTTPException(status_code=500, detail="No valid pricing data available.")
 
-    # Correlation Matrix
-    try:
-        correlation_matrix = df[['actual_price', 'discounted_price', 'discount_percentage', 'rating', 'rating_count']].corr().to_dict()
-    except Exception as e:
-        logger.error(f"Error calculating correlation matrix: {e}")
-        raise HTTPException(status_code=500, detail="Failed to calculate correlation matrix.")
+    slope, intercept = stats.regression()
+    future_trends = [
+        {
+            'actual_price': actual_price,
+            'predicted_discounted_price': intercept + slope * actual_price
+        }
+        for actual_price in stats.prediction_grid(points)
+    ]
 
-    return {
-        "future_trends": future_trends.to_dict(orient='records'),
-        "correlation_matrix": correlation_matrix
+    result = {
+        "future_trends": future_trends,
+        "correlation_matrix": stats.moments.correlation()
     }
 
+    if by_category:
+        # The per-category breakdown is not maintained incrementally; stream it on demand
+        try:
+            _, per_category = await _stream_comoments(PRICE_TREND_CLEANERS, 'price_trend', by_category=True)
+        except Exception as e:
+            logger.error(f"Error fetching products for price trend analysis: {e}")
+            raise HTTPException(status_code=500, detail="Failed to fetch product data for price trend analysis.")
+        result["correlation_by_category"] = {
+            category: accumulator.correlation() for category, accumulator in per_category.items()
+        }
+    return result
+
 
 @router.get("/rating_discount_correlation")
-async def rating_discount_correlation():
+@singleflight()
+@admission(cost=1)
+async def rating_discount_correlation(
+    by_category: bool = Query(False, description="Also return the correlation per main category")
+):
     """
-    Calculates the correlation between discount_percentage and rating.
+    Calculates the correlation between discount_percentage and rating
+    in one streaming pass over the products.
 
     Returns:
-        dict: Correlation matrix between discount_percentage and rating.
+        dict: Correlation matrix between discount_percentage and rating. With by_category,
+        a dict with the 'overall' matrix and a 'by_category' mapping of matrices.
     """
-    products = []
     try:
-        async for product in product_collection.find():
-            # Clean numeric fields
-            product['discount_percentage'] = clean_number(product.get('discount_percentage'))
-            product['rating'] = safe_float_conversion(product.get('rating'))
-            products.append(product)
+        partial = await _stream_comoments(RATING_DISCOUNT_CLEANERS, 'rating_discount_correlation', by_category)
     except Exception as e:
         logger.error(f"Error fetching products for correlation analysis: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch product data for correlation analysis.")
 
-    df = pd.DataFrame(products)
-
-    required_columns = ['discount_percentage', 'rating']
-    for col in required_columns:
-        if col not in df.columns:
-            raise HTTPException(status_code=500, detail=f"'{col}' data not found.")
-
-    df = df.dropna(subset=required_columns)
-
-    if df.empty:
+    moments, _ = partial
+    if moments.n == 0:
         raise HTTPException(status_code=500, detail="No valid data available.")
 
-    try:
-        correlation = df[['discount_percentage', 'rating']].corr().to_dict()
-    except Exception as e:
-        logger.error(f"Error calculating correlation matrix: {e}")
-        raise HTTPException(status_code=500, detail="Failed to calculate correlation matrix.")
-
-    return correlation
+    return CorrelationAggregation(RATING_DISCOUNT_CLEANERS, by_category).finalize(partial)
 
 @router.get("/sentiment_distribution")
+@singleflight()
+@admission(cost=1)
 async def sentiment_distribution():
     """
     Retrieves the distribution of sentiments across main categories and subcategories.
     Includes average rating per category.
 
+    Reads the materialized rollup (see app/sentiment_rollup.py), which is maintained on
+    product writes and rebuilt by an aggregation job when the thresholds change. With the
+    DuckDB engine the same grouping runs as SQL over the snapshot instead.
+
     Returns:
         list of dict: Each dict contains main_category, subcategory, sentiment counts, percentages, and average_rating.
     """
-    products = []
     try:
-        async for product in product_collection.find():
-            products.append(product)
+        snapshot = await _engine_snapshot()
+        if snapshot is not None:
+            from app import duckdb_engine
+            rows = await duckdb_engine.sentiment_rows(snapshot)
+        else:
+            rows = await load_sentiment_rollup()
     except Exception as e:
-        logger.error(f"Error fetching products for sentiment distribution: {e}")
+        logger.error(f"Error fetching sentiment rollup: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch product data for sentiment distribution.")
 
-    df = pd.DataFrame(products)
-
-    required_columns = ['category', 'rating']
-    for col in required_columns:
-        if col not in df.columns:
-            raise HTTPException(status_code=500, detail=f"'{col}' data not found.")
-
-    # Drop rows with missing 'category' or 'rating'
-    df = df.dropna(subset=required_columns)
-
-    if df.empty:
-        raise HTTPException(status_code=500, detail="No valid data available after dropping missing values.")
-
-    # Convert 'rating' to numeric, coercing errors to NaN
-    df['rating_numeric'] = pd.to_numeric(df['rating'], errors='coerce')
-
-    # Drop rows where 'rating_numeric' conversion failed
-    invalid_ratings = df['rating_numeric'].isna().sum()
-    if invalid_ratings > 0:
-        logger.warning(f"Warning: {invalid_ratings} records have invalid 'rating' values and will be excluded.")
-        df = df.dropna(subset=['rating_numeric'])
-
-    if df.empty:
+    if not rows:
         raise HTTPException(status_code=500, detail="No valid numeric 'rating' data available.")
 
-    # Assign sentiment based on updated thresholds
-    df['sentiment'] = df['rating_numeric'].apply(
-        lambda x: 'positive' if x >= 4.0 else ('neutral' if x > 3.3 else 'negative')
-    )
-
-    # Extract main category and subcategory
-    df['categories'] = df['category'].apply(
-        lambda x: x.split('|') if isinstance(x, str) else ['Unknown']
-    )
-    df['main_category'] = df['categories'].apply(lambda x: x[0].strip() if len(x) > 0 else 'Unknown')
-    df['subcategory'] = df['categories'].apply(lambda x: x[1].strip() if len(x) > 1 else 'Unknown')
-
-    # Group by main_category, subcategory, and sentiment
-    sentiment_counts = df.groupby(['main_category', 'subcategory', 'sentiment']).size().reset_index(name='count')
-
-    # Pivot the data to have sentiments as columns
-    sentiment_pivot = sentiment_counts.pivot_table(
-        index=['main_category', 'subcategory'],
-        columns='sentiment',
-        values='count',
-        fill_value=0
-    )
-
-    # Ensure all sentiment columns are present
-    for sentiment in ['positive', 'neutral', 'negative']:
-        if sentiment not in sentiment_pivot.columns:
-            sentiment_pivot[sentiment] = 0
+    return sentiment_distribution_of(rows)
 
-    # Calculate total counts per category
-    sentiment_pivot['total'] = sentiment_pivot[['positive', 'neutral', 'negative']].sum(axis=1)
 
-    # Calculate percentages
-    for sentiment in ['positive', 'neutral', 'negative']:
-        sentiment_pivot[f'{sentiment}_percentage'] = (
-            sentiment_pivot[sentiment] / sentiment_pivot['total'] * 100
-        )
-
-    # Calculate average rating per category
-    avg_rating = df.groupby(['main_category', 'subcategory'])['rating_numeric'].mean()
+@router.post("/sentiment_distribution/rebuild")
+@admission(cost=2)
+async def rebuild_sentiment_distribution():
+    """
+    Rebuilds the sentiment rollup from scratch, e.g. after a bulk import outside the API.
+    """
+    try:
+        await rebuild_sentiment_rollup(force=True)
+    except Exception as e:
+        logger.error(f"Error rebuilding sentiment rollup: {e}")
+        raise HTTPException(status_code=500, detail="Failed to rebuild sentiment rollup.")
+    return {"message": "Sentiment rollup rebuilt successfully"}
 
-    # Combine data
-    sentiment_pivot = sentiment_pivot.merge(avg_rating, left_index=True, right_index=True)
 
-    # Rename 'rating_numeric' to 'average_rating'
-    sentiment_pivot = sentiment_pivot.rename(columns={'rating_numeric': 'average_rating'})
+@router.post("/sentiment/rescore")
+@admission(cost=2)
+async def rescore_sentiment(
+    version: Optional[str] = Query(None, description="Model version the pass is for; the latest published model is used either way")
+):
+    """
+    Rescores the stored review sentiment that the current scoring model did not produce (see
+    app/sentiment.py). Workers submit it as a job whenever they load a new model version.
 
-    # Reset index to get 'main_category' and 'subcategory' as columns
-    sentiment_pivot = sentiment_pivot.reset_index()
+    Returns:
+        dict: The model version, and the number of products and reviews rescored.
+    """
+    try:
+        return await rescore_stale()
+    except Exception as e:
+        logger.error(f"Error rescoring review sentiment: {e}")
+        raise HTTPException(status_code=500, detail="Failed to rescore review sentiment.")
 
-    # Convert to dict
-    result = sentiment_pivot.to_dict(orient='records')
 
-    return result
 
+def _count_tokens(tokens: List[str], words: Counter, bigrams: Counter):
+    words.update(tokens)
+    bigrams.update(map(' '.join, zip(tokens, tokens[1:])))
 
 
 @router.get("/sentiment_wordcloud")
-async def sentiment_wordcloud():
+@singleflight()
+@admission(cost=3)
+async def sentiment_wordcloud(
+    counting: Optional[Literal['exact', 'approximate']] = Query(
+        None, description="Word counting: exact, or approximate in fixed memory (defaults to DASHBOARD_WORDCLOUD_COUNTING)"
+    )
+):
     """
     Generates word frequency data for positive and negative reviews to create word clouds.
     Also calculates bigrams and includes sentiment scores.
 
+    Reviews are labelled by their stored sentiment (see app/sentiment.py), and only products
+    with a positive or negative review are read, through the label index. Words are counted
+    per batch of products and the batch counts added to the totals: exact counters, or in
+    approximate mode Space-Saving sketches of fixed size, whose error bounds are returned.
+
     Returns:
         dict: Contains lists of words and their frequencies for positive and negative sentiments.
     """
-    all_reviews = []
+    counting = counting or WORDCLOUD_COUNTING
+    if counting == 'approximate':
+        capacity = math.ceil(1 / WORDCLOUD_SKETCH_ERROR)
+        totals = {label: {'words': SpaceSaving(capacity), 'bigrams': SpaceSaving(capacity)} for label in ('positive', 'negative')}
+    else:
+        totals = {label: {'words': Counter(), 'bigrams': Counter()} for label in ('positive', 'negative')}
+
+    seen_reviews = False
     try:
-        async for product in product_collection.find():
-            reviews = extract_reviews_from_product(product)
-            all_reviews.extend(reviews)
+        async for batch in iter_batches(
+            product_collection, SENTIMENT_REVIEW_FIELDS, 'sentiment_wordcloud',
+            query=labelled_query(list(totals)),
+        ):
+            counts = {label: {'words': Counter(), 'bigrams': Counter()} for label in totals}
+            for product in batch:
+                for review, sentiment in zip(iter_reviews(product), review_sentiments(product)):
+                    seen_reviews = True
+                    label_counts = counts.get(sentiment['label'])
+                    if label_counts is not None:
+                        _count_tokens(clean_text(review.review_content).split(), label_counts['words'], label_counts['bigrams'])
+            for label, label_counts in counts.items():
+                for kind, batch_counts in label_counts.items():
+                    totals[label][kind].update(batch_counts)
     except Exception as e:
         logger.error(f"Error fetching products for wordcloud: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch product data for wordcloud.")
 
-    if not all_reviews:
+    if not seen_reviews:
         raise HTTPException(status_code=500, detail="No reviews available for wordcloud generation.")
 
-    df = pd.DataFrame(all_reviews)
-
-    required_columns = ['review_content', 'rating']
-    for col in required_columns:
-        if col not in df.columns:
-            raise HTTPException(status_code=500, detail=f"{col} data not found.")
-
-    df = df.dropna(subset=['review_content', 'rating'])
-
-    if df.empty:
-        raise HTTPException(status_code=500, detail="No valid review data available after cleaning.")
-
-    # Assign sentiment
-    df['sentiment'] = df['rating'].apply(
-        lambda x: 'positive' if float(x) >= 4.0 else ('negative' if float(x) <= 2.0 else 'neutral')
-    )
-
-    # Clean and tokenize the reviews
-    df['cleaned_review'] = df['review_content'].apply(clean_text)
-    df['tokens'] = df['cleaned_review'].str.split()
-
-    # Function to generate word frequencies
-    def get_word_freqs(tokens_list):
-        all_words = [word for tokens in tokens_list for word in tokens]
-        word_counts = Counter(all_words)
-        return word_counts.most_common(100)  # Top 100 words
-
-    # Function to generate bigrams frequencies
-    def get_bigram_freqs(tokens_list):
-        all_bigrams = [tuple(tokens[i:i+2]) for tokens in tokens_list for i in range(len(tokens)-1)]
-        bigram_counts = Counter(all_bigrams)
-        return bigram_counts.most_common(50)  # Top 50 bigrams
-
-    # Separate tokens by sentiment
-    positive_tokens = df[df['sentiment'] == 'positive']['tokens'].tolist()
-    negative_tokens = df[df['sentiment'] == 'negative']['tokens'].tolist()
-
-    # Get word frequencies
-    positive_word_freqs = get_word_freqs(positive_tokens)
-    negative_word_freqs = get_word_freqs(negative_tokens)
-
-    # Get bigram frequencies
-    positive_bigram_freqs = get_bigram_freqs(positive_tokens)
-    negative_bigram_freqs = get_bigram_freqs(negative_tokens)
-
-    # Format data for frontend
-    positive_words_wc = [{'text': word, 'value': count} for word, count in positive_word_freqs]
-    negative_words_wc = [{'text': word, 'value': count} for word, count in negative_word_freqs]
-
-    positive_bigrams_wc = [{'text': ' '.join(bigram), 'value': count} for bigram, count in positive_bigram_freqs]
-    negative_bigrams_wc = [{'text': ' '.join(bigram), 'value': count} for bigram, count in negative_bigram_freqs]
-
-    return {
-        "positive": {
-            "words": positive_words_wc,
-            "bigrams": positive_bigrams_wc
-        },
-        "negative": {
-            "words": negative_words_wc,
-            "bigrams": negative_bigrams_wc
+    # Top 100 words and top 50 bigrams, formatted for the frontend
+    sizes = {'words': 100, 'bigrams': 50}
+    result = {}
+    for label, label_totals in totals.items():
+        result[label] = {}
+        for kind, total in label_totals.items():
+            top = total.top(sizes[kind]) if counting == 'approximate' else total.most_common(sizes[kind])
+            result[label][kind] = [{'text': text, 'value': count} for text, count in top]
+
+    if counting == 'approximate':
+        # Every count is at most max_error above the true count; guaranteed means the list
+        # holds exactly the most frequent words (or bigrams)
+        result["approximation"] = {
+            label: {
+                kind: {
+                    'counted': total.total,
+                    'max_error': total.max_error,
+                    'error_bound': math.floor(total.total * WORDCLOUD_SKETCH_ERROR),
+                    'guaranteed': total.guaranteed(sizes[kind]),
+                }
+                for kind, total in label_totals.items()
+            }
+            for label, label_totals in totals.items()
         }
-    }
+    return result
 
 
 @router.get("/price_discount_analysis")
-async def price_discount_analysis():
+@singleflight()
+@admission(cost=1)
+async def price_discount_analysis(
+    edges: Optional[List[float]] = Query(None, description=f"Price bucket edges, multiples of {PRICE_BUCKET_BASE_WIDTH:g} (defaults to {PRICE_BUCKET_EDGES})")
+):
     """
     Analyzes how discounts are applied to products in different price ranges.
     - Calculates average and median discount percentage per price range.
@@ -765,74 +700,45 @@ async def price_discount_analysis():
     - Calculates the correlation between actual price and discount percentage.
     - Provides overall discount statistics.
 
+    Statistics come from the precomputed price buckets (see app/price_buckets.py), which are
+    maintained on product writes, so the cost depends on the number of buckets, not products.
+    With the DuckDB engine they are computed from the snapshot, with exact medians.
+
     Returns:
         dict: Contains per_price_range_stats and overall_stats.
     """
-    products = []
+    snapshot = await _engine_snapshot()
+    if snapshot is not None:
+        from app import duckdb_engine
+        try:
+            result = await duckdb_engine.price_discount_analysis(snapshot, edges or PRICE_BUCKET_EDGES)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error running price discount analysis on DuckDB: {e}")
+            raise HTTPException(status_code=500, detail="Failed to fetch product data for price discount analysis.")
+        if result is None:
+            raise HTTPException(status_code=500, detail="No valid data available.")
+        return result
+
     try:
-        async for product in product_collection.find():
-            # Clean numeric fields
-            actual_price = clean_number(product.get('actual_price'))
-            discount_percentage = clean_number(product.get('discount_percentage'))
-            if actual_price is not None and discount_percentage is not None:
-                products.append({
-                    'actual_price': actual_price,
-                    'discount_percentage': discount_percentage
-                })
+        histogram = await load_price_buckets()
     except Exception as e:
-        logger.error(f"Error fetching products for price discount analysis: {e}")
+        logger.error(f"Error loading price buckets for price discount analysis: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch product data for price discount analysis.")
 
-    df = pd.DataFrame(products)
-
-    required_columns = ['actual_price', 'discount_percentage']
-    for col in required_columns:
-        if col not in df.columns:
-            raise HTTPException(status_code=500, detail=f"{col} data not found.")
-
-    # Drop rows with missing data
-    df = df.dropna(subset=required_columns)
-
-    if df.empty:
-        raise HTTPException(status_code=500, detail="No valid data available.")
-
-    # Define price ranges
-    bins = [0, 5000, 10000, 15000, 20000, 25000, 30000, df['actual_price'].max()]
-    labels = ['0-5k', '5k-10k', '10k-15k', '15k-20k', '20k-25k', '25k-30k', f'30k-{int(df["actual_price"].max())}k']
-    df['price_range'] = pd.cut(df['actual_price'], bins=bins, labels=labels, include_lowest=True)
-
-    # Calculate statistics per price range
+    # The stored buckets are the catalogue's partial of the price bucket aggregation
     try:
-        price_discount_stats = df.groupby('price_range', observed=True).agg({
-            'discount_percentage': ['mean', 'median', 'std'],
-            'actual_price': 'count'
-        }).reset_index()
-        price_discount_stats.columns = ['price_range', 'average_discount_percentage', 'median_discount_percentage', 'std_discount_percentage', 'product_count']
-    except Exception as e:
-        logger.error(f"Error during groupby operation in price_discount_analysis: {e}")
-        raise HTTPException(status_code=500, detail="Failed to perform groupby operation.")
-
-    # Calculate overall discount statistics
-    overall_stats = {
-        'average_discount_percentage': df['discount_percentage'].mean(),
-        'median_discount_percentage': df['discount_percentage'].median(),
-        'min_discount_percentage': df['discount_percentage'].min(),
-        'max_discount_percentage': df['discount_percentage'].max(),
-        'std_discount_percentage': df['discount_percentage'].std(),
-        'total_products': len(df)
-    }
-
-    # Calculate correlation between actual price and discount percentage
-    correlation = df[['actual_price', 'discount_percentage']].corr().to_dict()
-
-    return {
-        "per_price_range_stats": price_discount_stats.to_dict(orient='records'),
-        "overall_stats": overall_stats,
-        "price_discount_correlation": correlation
-    }
+        result = PriceBucketAggregation(edges).finalize(histogram)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=500, detail="No valid data available.")
+    return result
 
 
 @router.get("/categories")
+@singleflight()
 async def get_categories():
     """
     Retrieves all distinct product categories.
@@ -866,6 +772,8 @@ async def top_products_detailed(
     pass
 
 @router.get("/top_products")
+@singleflight()
+@admission(cost=2)
 async def top_products(
     categories: Optional[List[str]] = Query(None, description="Filter by product categories"),
     min_rating: Optional[float] = Query(None, ge=0.0, le=5.0, description="Minimum rating"),
@@ -889,6 +797,9 @@ async def top_products(
     Returns:
         dict: Contains total_count and list of products with detailed metrics.
     """
+    import pandas as pd
+    import numpy as np
+
     query = {}
 
     # Apply category filter if provided using regex
@@ -902,42 +813,61 @@ async def top_products(
 
     logger.info(f"Query: {query}")
 
-    # Fetch filtered products from MongoDB
-    products = []
+    engine_snapshot = await _engine_snapshot()
+    if engine_snapshot is not None:
+        from app import duckdb_engine
+        try:
+            return await duckdb_engine.top_products(
+                engine_snapshot, regex_pattern if categories else None, min_rating, max_rating, sort_by, page, page_size
+            )
+        except Exception as e:
+            logger.error(f"Error running top products on DuckDB: {e}")
+            raise HTTPException(status_code=500, detail="Failed to fetch products from the database.")
+
+    # Read the snapshot's already cleaned columns, or fetch filtered products from MongoDB
     try:
-        async for product in product_collection.find(query):
-            # Clean numeric fields
-            product['rating'] = safe_float_conversion(product.get('rating'))
-            product['rating_count'] = clean_number(product.get('rating_count'))
-            product['discount_percentage'] = clean_number(product.get('discount_percentage'))
-            product['actual_price'] = clean_number(product.get('actual_price'))
-            product['discounted_price'] = clean_number(product.get('discounted_price'))
-            # Estimate sales and profit
-            if product['discounted_price'] is not None and product['rating_count'] is not None:
-                product['total_sales'] = product['discounted_price'] * product['rating_count']
-                # Assume cost price is 70% of actual price
-                cost_price = product['actual_price'] * 0.7 if product['actual_price'] else 0
-                product['profit'] = (product['discounted_price'] - cost_price) * product['rating_count']
-            else:
-                product['total_sales'] = 0
-                product['profit'] = 0
-            products.append(product)
-        logger.info(f"Fetched {len(products)} products from MongoDB.")
+        snapshot = await current_snapshot()
+        if snapshot is not None:
+            import pyarrow.compute as pc
+
+            table = snapshot.products.to_table(TOP_PRODUCT_FIELDS)
+            if categories:
+                table = table.filter(pc.match_substring_regex(table['category'], regex_pattern, ignore_case=True))
+            df = table.to_pandas()
+        else:
+            columns = await fetch_columns(product_collection, TOP_PRODUCT_FIELDS, 'top_products', query=query)
+            df = pd.DataFrame(columns)
     except Exception as e:
         logger.error(f"Error fetching products from MongoDB: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch products from the database.")
 
+    logger.info(f"DataFrame created with {len(df)} records.")
+
+    if df.empty:
+        logger.info("No valid data available after applying filters.")
+        return {"total_count": 0, "products": []}
+
+    # Clean numeric fields column-wise
+    if snapshot is None:
+        df['rating'] = safe_float_column(df['rating'], 'rating').values
+        df['rating_count'] = clean_number_column(df['rating_count'], 'rating_count').values
+        df['discount_percentage'] = clean_number_column(df['discount_percentage'], 'discount_percentage').values
+        df['actual_price'] = clean_number_column(df['actual_price'], 'actual_price').values
+        df['discounted_price'] = clean_number_column(df['discounted_price'], 'discounted_price').values
+
+    # Estimate sales and profit, assuming cost price is 70% of actual price
+    has_sales = df['discounted_price'].notna() & df['rating_count'].notna()
+    cost_price = (df['actual_price'] * 0.7).fillna(0)
+    df['total_sales'] = np.where(has_sales, df['discounted_price'] * df['rating_count'], 0)
+    df['profit'] = np.where(has_sales, (df['discounted_price'] - cost_price) * df['rating_count'], 0)
+
     # Filter products by rating range after converting 'rating' to float
     if min_rating is not None:
-        products = [p for p in products if p['rating'] is not None and p['rating'] >= min_rating]
+        df = df[df['rating'] >= min_rating]
     if max_rating is not None:
-        products = [p for p in products if p['rating'] is not None and p['rating'] <= max_rating]
-
-    logger.info(f"Products after rating filter: {len(products)}")
+        df = df[df['rating'] <= max_rating]
 
-    # Convert to DataFrame
-    df = pd.DataFrame(products)
-    logger.info(f"DataFrame created with {len(df)} records.")
+    logger.info(f"Products after rating filter: {len(df)}")
 
     # Check required columns
     required_columns = ['product_name', 'rating', 'rating_count', 'total_sales', 'profit']
@@ -959,7 +889,8 @@ async def top_products(
     # Sort products based on sort_by parameter
     if sort_by not in ['popularity_score', 'total_sales', 'profit']:
         sort_by = 'popularity_score'
-    df = df.sort_values(by=sort_by, ascending=False)
+    # Stable, so ties keep the scan order like the DuckDB engine's
+    df = df.sort_values(by=sort_by, ascending=False, kind='stable')
 
     # Pagination
     total_count = len(df)
@@ -982,5 +913,154 @@ async def top_products(
         'profit'
     ]]
 
+    # Missing prices as null rather than NaN, which is not valid JSON
+    top_products = top_products.astype(object).where(top_products.notna(), None)
+
     logger.info("Returning top products with additional metrics.")
     return {"total_count": total_count, "products": top_products.to_dict(orient='records')}
+
+
+@router.post("/snapshot")
+@admission(cost=4)
+async def create_snapshot():
+    """
+    Writes a new analytical snapshot of the cleaned products and reviews, with its artifacts
+    (see app/snapshot.py), and switches this worker to it. Other workers pick it up on their
+    next analytics read.
+
+    Returns:
+        dict: The manifest of the new snapshot.
+    """
+    try:
+        manifest = await write_snapshot()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SnapshotInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error writing analytics snapshot: {e}")
+        raise HTTPException(status_code=500, detail="Failed to write the analytics snapshot.")
+    return manifest
+
+
+@router.get("/partials/{name}")
+@admission(cost=2)
+async def get_partial(name: str = Path(..., description="Aggregation to run")):
+    """
+    Runs one of the mergeable aggregations (see app/partial_aggregates.py) over this host's
+    products and returns its encoded partial, for a coordinator to combine with the partials of
+    other hosts.
+
+    Returns:
+        dict: The aggregation name and its encoded partial.
+    """
+    aggregation = aggregations().get(name)
+    if aggregation is None:
+        raise HTTPException(status_code=404, detail=f"Unknown aggregation '{name}'.")
+    try:
+        partial = await run_aggregation(aggregation, f"partial_{name}")
+    except Exception as e:
+        logger.error(f"Error computing the {name} partial: {e}")
+        raise HTTPException(status_code=500, detail="Failed to compute the partial aggregate.")
+    return {"aggregation": name, "partial": aggregation.encode(partial)}
+
+
+@router.post("/partials/{name}/combine")
+@admission(cost=1)
+async def combine_partials(name: str = Path(..., description="Aggregation to combine"), partials: List[dict] = Body(...)):
+    """
+    Combines encoded partials of one aggregation, e.g. collected from several hosts with
+    GET /analytics/partials/{name}, and returns the aggregation's result over all of them.
+    """
+    aggregation = aggregations().get(name)
+    if aggregation is None:
+        raise HTTPException(status_code=404, detail=f"Unknown aggregation '{name}'.")
+    try:
+        partial = combine_encoded(aggregation, partials)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} partial: {e}")
+    return aggregation.finalize(partial)
+
+
+@router.post("/jobs", status_code=202)
+async def create_job(
+    task: str = Body(..., description="Analytics task to run: summary, sentiment_analysis, sentiment_wordcloud, ..."),
+    params: dict = Body({}, description="The task endpoint's query parameters"),
+):
+    """
+    Queues an analytics task to run in the background (see app/jobs.py) and returns the job
+    at once; poll GET /analytics/jobs/{id} for its status, progress and result. If an identical
+    job is already pending or running, that job is returned instead.
+
+    Returns:
+        dict: The job, with `deduplicated` set when it is an existing one.
+    """
+    try:
+        job, created = await submit_job(task, params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error submitting {task} job: {e}")
+        raise HTTPException(status_code=500, detail="Failed to submit the job.")
+    return {**describe(job), "deduplicated": not created}
+
+
+@router.get("/jobs/{job_id}")
+async def read_job(job_id: str = Path(...)):
+    """
+    Returns a job's status (pending, running, succeeded or failed), its progress, and its result
+    or error once finished. Finished jobs are kept for DASHBOARD_JOB_RESULT_TTL seconds.
+    """
+    try:
+        job = await get_job(job_id)
+    except Exception as e:
+        logger.error(f"Error reading job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to read the job.")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return describe(job)
+
+
+@router.get("/fetch_stats")
+async def fetch_stats():
+    """
+    Reports, per analytics scan, how many documents and bytes were fetched from MongoDB
+    by this worker process since it started.
+
+    Returns:
+        dict: Maps each scan name to its scan count, documents, bytes and seconds spent fetching.
+    """
+    return {
+        endpoint: {**stats, 'bytes_per_document': stats['bytes'] / stats['documents'] if stats['documents'] else 0}
+        for endpoint, stats in transfer_stats.items()
+    }
+
+
+@router.get("/coalescing_stats")
+async def get_coalescing_stats():
+    """
+    Reports, per coalesced analytics endpoint, how many computations this worker started and how
+    many requests shared one that was already in flight (or just finished).
+
+    Returns:
+        dict: Maps each endpoint to its computations and coalesced request counts.
+    """
+    return dict(coalescing_stats)
+
+
+@router.get("/admission_stats")
+async def get_admission_stats():
+    """
+    Reports this worker's analytics admission control: the shared budget in use, the queue depth,
+    and per endpoint the requests admitted, waiting, running and rejected.
+
+    Returns:
+        dict: capacity, in_use, queue_depth and per-endpoint counters.
+    """
+    limiter = get_limiter()
+    return {
+        "capacity": limiter.capacity,
+        "in_use": limiter.in_use,
+        "queue_depth": limiter.queue_depth,
+        "endpoints": dict(admission_stats),
+    }
@@ -1,13 +1,22 @@
 # app/routers/products.py
 
-from fastapi import APIRouter, Body, HTTPException, Query
-from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, Body, HTTPException, Query, Request
+from typing import List, Optional, Tuple
+import json
 import logging
 import re
 import math  # Ensure math is imported
+from datetime import datetime, timezone
 
-from app.models import Product, ProductCreate, ProductsResponse
+from pydantic import ValidationError
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.config import PRODUCT_BULK_BATCH_SIZE, PRODUCT_BULK_MAX_ITEMS
+from app.models import Product, ProductBulkCreate, ProductBulkUpdate, ProductCreate, ProductsResponse
 from app.database import product_collection
+from app.sentiment import sentiment_changes, sentiment_fields
+from app.write_hooks import record_product_write, record_product_writes
 from bson import ObjectId
 from bson.errors import InvalidId
 
@@ -23,33 +32,274 @@ router = APIRouter(
     tags=["products"],
 )
 
-def convert_objectid_to_str(product: dict) -> dict:
+def to_product(document: dict) -> Product:
     """
-    Converts MongoDB's ObjectId to string and assigns it to 'id' field.
-    Removes the original '_id' field.
+    Builds the API model of a stored product. NaN and infinite numbers (left behind by the
+    CSV import) become None, since they are not valid JSON.
     """
-    if "_id" in product:
-        product["id"] = str(product["_id"])
-        del product["_id"]
-    return product
+    product = dict(document)
+    for field, value in product.items():
+        if isinstance(value, float) and not math.isfinite(value):
+            logger.warning(f"Product ID {product.get('_id')} has '{field}' as {value}. Setting to None.")
+            product[field] = None
+    # Validated through the _id alias, so the response carries the stored id
+    return Product(**product)
 
 # Create Product
 @router.post("/", response_description="Add new product", response_model=Product)
-async def create_product(product: ProductCreate = Body(...)):
+async def create_product(background_tasks: BackgroundTasks, product: ProductCreate = Body(...)):
     product_data = product.dict(exclude_unset=True)
+    # Lets analytical snapshots catch up on products written after them
+    product_data["updated_at"] = datetime.now(timezone.utc)
+    product_data.update(sentiment_fields(product_data))
     try:
         new_product = await product_collection.insert_one(product_data)
-        created_product = await product_collection.find_one({"_id": new_product.inserted_id})
-        if created_product:
-            created_product = convert_objectid_to_str(created_product)
-            logger.info(f"New product created with ID: {new_product.inserted_id}")
-            return Product(**created_product)
-        else:
-            logger.error("Failed to retrieve the created product.")
-            raise HTTPException(status_code=500, detail="Failed to create product.")
     except Exception as e:
         logger.error(f"Error creating product: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while creating the product.")
+    # The stored document is exactly what was sent, so there is nothing to read back
+    product_data["_id"] = new_product.inserted_id
+    # Analytics bookkeeping runs once the response is sent
+    background_tasks.add_task(record_product_write, None, product_data)
+    logger.info(f"New product created with ID: {new_product.inserted_id}")
+    return to_product(product_data)
+
+def _parse_bulk_body(body: bytes, content_type: str) -> list:
+    """
+    Parses a bulk request body: a JSON array, or NDJSON (one product per line).
+    Lines that are not valid JSON become ValueError entries, so they fail on their own.
+    """
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Request body must be UTF-8.")
+
+    if "ndjson" not in content_type and text.lstrip().startswith("["):
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    else:
+        items = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(ValueError(f"Invalid JSON: {e}"))
+
+    if len(items) > PRODUCT_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {PRODUCT_BULK_MAX_ITEMS} products per request.")
+    return items
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'item'}: {detail['msg']}" for detail in error.errors()
+    )
+
+
+def _bulk_key(key: Optional[Tuple[str, object]]) -> Optional[dict]:
+    return {key[0]: key[1]} if key else None
+
+
+async def _bulk_write_products(entries: list, upsert: bool) -> Tuple[list, list]:
+    """
+    Writes validated bulk entries in batches of PRODUCT_BULK_BATCH_SIZE, one unordered
+    bulk_write per batch. The current version of every product in a batch is read with one
+    query beforehand; the new version is derived locally, so analytics hooks get both
+    without reading anything back.
+
+    Parameters:
+        entries (list): (position, key, fields) per valid item. key is ('_id', ObjectId),
+            ('product_id', str) or None for a plain insert.
+        upsert (bool): Insert keyed items that do not exist yet instead of reporting not_found.
+
+    Returns:
+        tuple: (position, result) per entry, and (before, after) per successful write for
+        the analytics hooks.
+    """
+    results, writes = [], []
+    for start in range(0, len(entries), PRODUCT_BULK_BATCH_SIZE):
+        collided = await _write_batch(entries[start:start + PRODUCT_BULK_BATCH_SIZE], upsert, results, writes)
+        if collided:
+            # Created by a concurrent writer since the batch was read: update them like any existing product
+            await _write_batch(collided, False, results, writes)
+    return results, writes
+
+
+async def _write_batch(batch: list, upsert: bool, results: list, writes: list) -> list:
+    """
+    Writes one batch of _bulk_write_products, appending to its results and writes.
+
+    Returns:
+        list: the keyed entries whose insert found the product already created by another
+        writer, and so were not written.
+    """
+    ids = [key[1] for _, key, _ in batch if key and key[0] == "_id"]
+    product_ids = [key[1] for _, key, _ in batch if key and key[0] == "product_id"]
+    existing = {}
+    if ids or product_ids:
+        cursor = product_collection.find({"$or": [
+            {"_id": {"$in": ids}}, {"product_id": {"$in": product_ids}},
+        ]})
+        async for document in cursor:
+            existing.setdefault(("_id", document["_id"]), document)
+            if document.get("product_id") is not None:
+                existing.setdefault(("product_id", document["product_id"]), document)
+
+    now = datetime.now(timezone.utc)
+    operations, written = [], []  # written: (entry, before, after, status) per operation
+    for entry in batch:
+        position, key, fields = entry
+        before = existing.get(key) if key else None
+        if before is not None:
+            changes = {field: value for field, value in fields.items() if before.get(field) != value}
+            if not changes:
+                results.append((position, {"status": "unchanged", "id": str(before["_id"])}))
+                continue
+            changes["updated_at"] = now
+            # Scored here, since the new version is known without reading it back
+            changes.update(sentiment_changes({**before, **changes}))
+            operations.append(UpdateOne({"_id": before["_id"]}, {"$set": changes}))
+            written.append((entry, before, {**before, **changes}, "updated"))
+        elif key is None:
+            document = {**fields, "_id": ObjectId(), "updated_at": now}
+            document.update(sentiment_fields(document))
+            operations.append(InsertOne(document))
+            written.append((entry, None, dict(document), "created"))
+        elif upsert:
+            object_id = key[1] if key[0] == "_id" else ObjectId()
+            document = {**fields, **_bulk_key(key), "_id": object_id, "updated_at": now}
+            document.update(sentiment_fields(document))
+            # Inserts only if no product has the key yet, so a concurrent writer creating the same
+            # product does not duplicate it; the bulk result tells which ones were inserted
+            operations.append(UpdateOne(
+                _bulk_key(key),
+                {"$setOnInsert": {field: value for field, value in document.items() if field != key[0]}},
+                upsert=True,
+            ))
+            written.append((entry, None, document, "created"))
+        else:
+            results.append((position, {"status": "not_found", "error": f"No product with {key[0]} {key[1]}."}))
+
+    if not operations:
+        return []
+
+    failed, upserted = {}, {}
+    try:
+        result = await product_collection.bulk_write(operations, ordered=False)
+        upserted = result.upserted_ids or {}
+    except BulkWriteError as e:
+        failed = {error["index"]: error.get("errmsg", "Write failed.") for error in e.details.get("writeErrors", [])}
+        upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+    except Exception as e:
+        logger.error(f"Error in bulk product write: {e}")
+        failed = {index: "Write failed." for index in range(len(operations))}
+
+    collided = []
+    for index, (entry, before, after, status) in enumerate(written):
+        if index in failed:
+            results.append((entry[0], {"status": "error", "error": failed[index]}))
+            continue
+        if isinstance(operations[index], UpdateOne) and status == "created" and index not in upserted:
+            collided.append(entry)
+            continue
+        results.append((entry[0], {"status": status, "id": str(after["_id"])}))
+        writes.append((before, after))
+    return collided
+
+
+async def _run_bulk(request: Request, background_tasks: BackgroundTasks, model, upsert: bool) -> dict:
+    """
+    Parses, validates and writes a bulk request, and reports one result per item in request order.
+    The analytics hooks of the written products run once the response is sent.
+    """
+    items = _parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    results: list = [None] * len(items)
+    entries = []
+    seen_keys = set()
+
+    for position, item in enumerate(items):
+        if isinstance(item, Exception):
+            results[position] = {"status": "error", "error": str(item)}
+            continue
+        if not isinstance(item, dict):
+            results[position] = {"status": "error", "error": "Each item must be a JSON object."}
+            continue
+        try:
+            product = model(**item)
+        except ValidationError as e:
+            results[position] = {"status": "error", "error": _validation_message(e)}
+            continue
+
+        fields = product.dict(exclude_unset=True)
+        object_id = fields.pop("id", None)
+        if object_id is not None:
+            if not ObjectId.is_valid(object_id):
+                results[position] = {"status": "error", "error": "Invalid product ID format."}
+                continue
+            key = ("_id", ObjectId(object_id))
+        elif fields.get("product_id"):
+            key = ("product_id", fields["product_id"])
+        elif upsert:
+            key = None
+        else:
+            results[position] = {"status": "error", "error": "Each update needs an id or a product_id."}
+            continue
+        if not upsert and not {field for field in fields if field != "product_id"}:
+            results[position] = {"status": "error", "error": "No data provided for update."}
+            continue
+        if key is not None:
+            if key in seen_keys:
+                results[position] = {"status": "error", "error": f"Duplicate {key[0]} {key[1]} in this request."}
+                continue
+            seen_keys.add(key)
+        entries.append((position, key, fields))
+
+    written, writes = await _bulk_write_products(entries, upsert)
+    for position, result in written:
+        results[position] = result
+    if writes:
+        background_tasks.add_task(record_product_writes, writes)
+
+    succeeded = sum(1 for result in results if result["status"] in ("created", "updated", "unchanged"))
+    logger.info(f"Bulk product write: {succeeded} of {len(results)} items succeeded.")
+    return {
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": [{"index": position, **result} for position, result in enumerate(results)],
+    }
+
+
+# Bulk Create / Upsert Products
+@router.post("/bulk", response_description="Create or upsert many products")
+async def bulk_create_products(request: Request, background_tasks: BackgroundTasks):
+    """
+    Creates many products in one request. The body is a JSON array of products, or NDJSON
+    (Content-Type: application/x-ndjson) with one product per line. Items with a product_id
+    are upserted on it; the rest are inserted. Items are validated and written independently,
+    so one bad item does not fail the others.
+
+    Returns:
+        dict: total, succeeded, failed and a result per item (index, status, id or error).
+    """
+    return await _run_bulk(request, background_tasks, ProductBulkCreate, upsert=True)
+
+# Bulk Update Products
+@router.patch("/bulk", response_description="Update many products")
+async def bulk_update_products(request: Request, background_tasks: BackgroundTasks):
+    """
+    Partially updates many products in one request, each identified by its id or product_id.
+    Accepts the same JSON array or NDJSON bodies as POST /products/bulk. Only the given fields
+    are changed; unknown products are reported as not_found.
+
+    Returns:
+        dict: total, succeeded, failed and a result per item (index, status, id or error).
+    """
+    return await _run_bulk(request, background_tasks, ProductBulkUpdate, upsert=False)
 
 # Get All Products with Optional Filters and Pagination
 @router.get("/", response_description="List all products", response_model=ProductsResponse)
@@ -105,15 +355,7 @@ async def list_products(
         cursor = product_collection.find(query).skip(skip).limit(limit)
         products = []
         async for product in cursor:
-            product = convert_objectid_to_str(product)
-            
-            # Safeguard against 'NaN' in 'rating_count'
-            if 'rating_count' in product:
-                if isinstance(product['rating_count'], float) and math.isnan(product['rating_count']):
-                    product['rating_count'] = None
-                    logger.warning(f"Product ID {product.get('id')} has 'rating_count' as NaN. Setting to None.")
-            
-            products.append(Product(**product))
+            products.append(to_product(product))
         logger.info(f"Fetched {len(products)} products from MongoDB for page {page}.")
 
         # Get total count of matching documents
@@ -150,26 +392,17 @@ async def show_product(id: str):
     
     try:
         product = await product_collection.find_one({"_id": obj_id})
-        if product:
-            product = convert_objectid_to_str(product)
-            
-            # Safeguard against 'NaN' in 'rating_count'
-            if 'rating_count' in product:
-                if isinstance(product['rating_count'], float) and math.isnan(product['rating_count']):
-                    product['rating_count'] = None
-                    logger.warning(f"Product ID {product.get('id')} has 'rating_count' as NaN. Setting to None.")
-            
-            return Product(**product)
-        else:
-            logger.warning(f"Product not found with ID: {id}")
-            raise HTTPException(status_code=404, detail=f"Product {id} not found.")
     except Exception as e:
         logger.error(f"Error retrieving product {id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve the product.")
+    if not product:
+        logger.warning(f"Product not found with ID: {id}")
+        raise HTTPException(status_code=404, detail=f"Product {id} not found.")
+    return to_product(product)
 
 # Update Product
 @router.put("/{id}", response_description="Update a product", response_model=Product)
-async def update_product(id: str, product: ProductCreate = Body(...)):
+async def update_product(id: str, background_tasks: BackgroundTasks, product: ProductCreate = Body(...)):
     """
     Updates an existing product by its ID.
     
@@ -191,45 +424,28 @@ async def update_product(id: str, product: ProductCreate = Body(...)):
         logger.warning("No data provided for update.")
         raise HTTPException(status_code=400, detail="No data provided for update.")
     
+    changes = {**product_data, "updated_at": datetime.now(timezone.utc)}
     try:
-        update_result = await product_collection.update_one(
-            {"_id": obj_id}, {"$set": product_data}
+        # One atomic round trip that also returns the previous version, which precomputed
+        # analytics need; the new version follows from it and the $set
+        previous_product = await product_collection.find_one_and_update(
+            {"_id": obj_id}, {"$set": changes}, return_document=ReturnDocument.BEFORE
         )
-        if update_result.modified_count == 1:
-            updated_product = await product_collection.find_one({"_id": obj_id})
-            if updated_product:
-                updated_product = convert_objectid_to_str(updated_product)
-                
-                # Safeguard against 'NaN' in 'rating_count'
-                if 'rating_count' in updated_product:
-                    if isinstance(updated_product['rating_count'], float) and math.isnan(updated_product['rating_count']):
-                        updated_product['rating_count'] = None
-                        logger.warning(f"Product ID {updated_product.get('id')} has 'rating_count' as NaN. Setting to None.")
-                
-                logger.info(f"Product {id} updated with data: {product_data}")
-                return Product(**updated_product)
-        # If no documents were modified, check if the product exists
-        existing_product = await product_collection.find_one({"_id": obj_id})
-        if existing_product:
-            existing_product = convert_objectid_to_str(existing_product)
-            
-            # Safeguard against 'NaN' in 'rating_count'
-            if 'rating_count' in existing_product:
-                if isinstance(existing_product['rating_count'], float) and math.isnan(existing_product['rating_count']):
-                    existing_product['rating_count'] = None
-                    logger.warning(f"Product ID {existing_product.get('id')} has 'rating_count' as NaN. Setting to None.")
-            
-            return Product(**existing_product)
-        else:
-            logger.warning(f"Product not found with ID: {id}")
-            raise HTTPException(status_code=404, detail=f"Product {id} not found.")
     except Exception as e:
         logger.error(f"Error updating product {id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to update the product.")
+    if previous_product is None:
+        logger.warning(f"Product not found with ID: {id}")
+        raise HTTPException(status_code=404, detail=f"Product {id} not found.")
+
+    updated_product = {**previous_product, **changes}
+    background_tasks.add_task(record_product_write, previous_product, updated_product)
+    logger.info(f"Product {id} updated with data: {product_data}")
+    return to_product(updated_product)
 
 # Delete Product
 @router.delete("/{id}", response_description="Delete a product")
-async def delete_product(id: str):
+async def delete_product(id: str, background_tasks: BackgroundTasks):
     """
     Deletes a product by its ID.
     
@@ -246,13 +462,16 @@ async def delete_product(id: str):
         raise HTTPException(status_code=400, detail="Invalid product ID format.")
     
     try:
-        delete_result = await product_collection.delete_one({"_id": obj_id})
-        if delete_result.deleted_count == 1:
+        deleted_product = await product_collection.find_one_and_delete({"_id": obj_id})
+        if deleted_product:
+            background_tasks.add_task(record_product_write, deleted_product, None)
             logger.info(f"Product {id} deleted.")
             return {"detail": f"Product {id} deleted."}
         else:
             logger.warning(f"Product not found with ID: {id}")
             raise HTTPException(status_code=404, detail=f"Product {id} not found.")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error deleting product {id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to delete the product.")
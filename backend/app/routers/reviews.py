@@ -1,11 +1,14 @@
 # app/routers/reviews.py
 
-from fastapi import APIRouter, Body, HTTPException
+from fastapi import APIRouter, Body, HTTPException, Query
 from fastapi.encoders import jsonable_encoder
-from typing import List
+from typing import List, Literal, Optional
 
+from app.config import LIST_MAX_PAGE_SIZE, LIST_PAGE_SIZE, LIST_STREAM_MAX_ITEMS
 from app.models import Review, ReviewCreate
 from app.database import review_collection
+from app.pagination import create_indexes, list_page
+from app.sentiment import review_document_fields
 from bson import ObjectId
 
 router = APIRouter(
@@ -13,20 +16,50 @@ router = APIRouter(
     tags=["reviews"],
 )
 
+REVIEW_SORT = ["_id"]
+
+@router.on_event("startup")
+async def create_review_indexes():
+    # Equality filters followed by the sort key, so filtered pages are index range scans
+    await create_indexes(review_collection, [
+        [("product_id", 1), ("_id", 1)], [("user_id", 1), ("_id", 1)], [("sentiment_label", 1), ("_id", 1)],
+    ])
+
 # Create Review
 @router.post("/", response_description="Add new review", response_model=Review)
 async def create_review(review: ReviewCreate = Body(...)):
     review = jsonable_encoder(review)
+    review.update(review_document_fields(review))
     new_review = await review_collection.insert_one(review)
-    created_review = await review_collection.find_one({"_id": new_review.inserted_id})
-    return Review(**created_review)
+    # The stored document is exactly what was sent, so there is nothing to read back
+    review["_id"] = new_review.inserted_id
+    return Review(**review)
 
 # Get All Reviews
-@router.get("/", response_description="List all reviews", response_model=List[Review])
-async def list_reviews():
-    reviews = []
-    async for review in review_collection.find():
-        reviews.append(Review(**review))
-    return reviews
+@router.get("/", response_description="List reviews", response_model=List[Review])
+async def list_reviews(
+    product_id: Optional[str] = Query(None, description="Only reviews of this product"),
+    user_id: Optional[str] = Query(None, description="Only reviews by this user"),
+    sentiment: Optional[Literal["positive", "neutral", "negative"]] = Query(None, description="Only reviews with this stored sentiment"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, description="Number of reviews in the page"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return (default: all)"),
+    stream: bool = Query(False, description="Stream the page as NDJSON"),
+):
+    """
+    Lists reviews in insertion order, one page at a time. The cursor of the next page is returned
+    in the X-Next-Cursor header (or, when streaming, as a final {"next_cursor": ...} line).
+    """
+    max_limit = LIST_STREAM_MAX_ITEMS if stream else LIST_MAX_PAGE_SIZE
+    if limit > max_limit:
+        raise HTTPException(status_code=400, detail=f"limit must be at most {max_limit}.")
+    query = {}
+    if product_id:
+        query["product_id"] = product_id
+    if user_id:
+        query["user_id"] = user_id
+    if sentiment:
+        query["sentiment_label"] = sentiment
+    return await list_page(review_collection, Review, query, REVIEW_SORT, cursor, limit, fields, stream)
 
 # ... Implement other CRUD operations similarly
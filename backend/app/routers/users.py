@@ -1,11 +1,14 @@
 # app/routers/users.py
 
-from fastapi import APIRouter, Body, HTTPException
+from fastapi import APIRouter, Body, HTTPException, Query
 from fastapi.encoders import jsonable_encoder
-from typing import List
+from typing import List, Optional
+import re
 
+from app.config import LIST_MAX_PAGE_SIZE, LIST_PAGE_SIZE, LIST_STREAM_MAX_ITEMS
 from app.models import User, UserCreate
 from app.database import user_collection
+from app.pagination import create_indexes, list_page
 from bson import ObjectId
 
 router = APIRouter(
@@ -13,20 +16,42 @@ router = APIRouter(
     tags=["users"],
 )
 
+# Users are listed in name order, so a name prefix filter is a range of the same index
+USER_SORT = ["user_name", "_id"]
+
+@router.on_event("startup")
+async def create_user_indexes():
+    await create_indexes(user_collection, [[("user_name", 1), ("_id", 1)]])
+
 # Create User
 @router.post("/", response_description="Add new user", response_model=User)
 async def create_user(user: UserCreate = Body(...)):
     user = jsonable_encoder(user)
     new_user = await user_collection.insert_one(user)
-    created_user = await user_collection.find_one({"_id": new_user.inserted_id})
-    return User(**created_user)
+    # The stored document is exactly what was sent, so there is nothing to read back
+    user["_id"] = new_user.inserted_id
+    return User(**user)
 
 # Get All Users
-@router.get("/", response_description="List all users", response_model=List[User])
-async def list_users():
-    users = []
-    async for user in user_collection.find():
-        users.append(User(**user))
-    return users
+@router.get("/", response_description="List users", response_model=List[User])
+async def list_users(
+    name_prefix: Optional[str] = Query(None, min_length=1, description="Only users whose name starts with this (case-sensitive)"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, description="Number of users in the page"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return (default: all)"),
+    stream: bool = Query(False, description="Stream the page as NDJSON"),
+):
+    """
+    Lists users in name order, one page at a time. The cursor of the next page is returned in the
+    X-Next-Cursor header (or, when streaming, as a final {"next_cursor": ...} line).
+    """
+    max_limit = LIST_STREAM_MAX_ITEMS if stream else LIST_MAX_PAGE_SIZE
+    if limit > max_limit:
+        raise HTTPException(status_code=400, detail=f"limit must be at most {max_limit}.")
+    query = {}
+    if name_prefix:
+        # An anchored, case-sensitive prefix is answered from the user_name index
+        query["user_name"] = {"$regex": f"^{re.escape(name_prefix)}"}
+    return await list_page(user_collection, User, query, USER_SORT, cursor, limit, fields, stream)
 
 # ... Implement other CRUD operations similarly
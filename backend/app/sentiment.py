@@ -0,0 +1,438 @@
+# app/sentiment.py
+#
+# The one place review sentiment is decided. Every review gets a score in [0, 1] and a label
+# (positive / neutral / negative), stored with the version of the scoring model that produced them:
+#   - product documents carry `review_sentiments`, one {review_id, label, score} per embedded
+#     review in extraction order, and `sentiment_version`;
+#   - documents of the reviews collection carry `sentiment_label`, `sentiment_score` and
+#     `sentiment_version`.
+# Writes store them as part of the write when the new document is known locally, and through
+# the write hook otherwise. Documents scored by another model version (or never scored, like
+# bulk-imported ones) are rescored by a background pass; readers use the stored values when
+# they are current and score on the fly otherwise, so results are right while it runs.
+#
+# The scoring model is the text classifier of app/sentiment_model.py, published to MongoDB
+# when a worker first trains one and again whenever one is retrained: the hashed features of the
+# review's cleaned text, the classifier's coefficients (stored sparse, as float32) and its
+# probabilities, the label being the likeliest class and the score P(positive) + P(neutral) / 2.
+# Its version names the published coefficients, so publishing a model rescores everything.
+# Every worker loads the published model at startup and looks for a newer one every
+# SENTIMENT_MODEL_POLL seconds. Until a model is published, reviews are scored from their
+# rating with the SENTIMENT_POSITIVE_MIN / SENTIMENT_NEUTRAL_ABOVE thresholds (the labels the
+# classifier learns), under a version naming the thresholds.
+#
+# The rescoring pass is a background job (task 'sentiment_rescore', see app/jobs.py), submitted
+# by every worker when it loads a new model version: identical jobs are shared, so one pass runs
+# per version however many workers there are, and a worker that switches late submits another,
+# which rescores what it wrote with the old version meanwhile.
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from bson import Binary
+from pymongo import UpdateOne
+
+from app.cleaning import clean_text, safe_float_conversion
+from app.config import (
+    SENTIMENT_MODEL_POLL,
+    SENTIMENT_NEUTRAL_ABOVE,
+    SENTIMENT_POSITIVE_MIN,
+    SENTIMENT_RESCORE_BATCH_SIZE,
+    SENTIMENT_RESCORE_PAUSE,
+)
+from app.database import analytics_meta_collection, product_collection, review_collection, sentiment_model_collection
+from app.rebuilds import rebuild_lock
+from app.review_extraction import REVIEW_FIELDS, iter_reviews
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SENTIMENT_LABELS = ['negative', 'neutral', 'positive']
+
+RATING_MODEL_VERSION = f"rating-v1/{SENTIMENT_POSITIVE_MIN:g}/{SENTIMENT_NEUTRAL_ABOVE:g}"
+
+# analytics_meta document naming the published model
+MODEL_ID = "sentiment_model"
+# Coefficient columns per document of sentiment_models, well under the document size limit
+MODEL_PART_COLUMNS = 100_000
+
+# Product fields scoring reads
+SCORING_FIELDS = ['_id'] + REVIEW_FIELDS
+
+_model: Optional["TextSentimentModel"] = None
+_watching: Optional[asyncio.Task] = None
+
+
+def hashing_vectorizer(hash_bits: int):
+    """
+    The review text features, shared by training and scoring.
+    """
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    return HashingVectorizer(n_features=2 ** hash_bits, alternate_sign=False, norm='l2')
+
+
+class TextSentimentModel:
+    """
+    A published classifier: scores cleaned review texts with its class probabilities.
+    """
+
+    def __init__(self, version: str, hash_bits: int, classes: List[str], columns, weights, intercept: List[float]):
+        import numpy as np
+
+        self.version = version
+        self.classes = list(classes)
+        self.vectorizer = hashing_vectorizer(hash_bits)
+        self.coef = np.zeros((len(classes), 2 ** hash_bits), np.float32)
+        self.coef[:, columns] = weights
+        self.intercept = np.asarray(intercept, np.float32)
+
+    def probabilities(self, texts: List[str]):
+        """
+        The probability of each class per text, as SGDClassifier.predict_proba computes them
+        for a one-vs-rest logistic regression.
+        """
+        import numpy as np
+
+        decision = np.asarray(self.vectorizer.transform(texts) @ self.coef.T) + self.intercept
+        probabilities = 1 / (1 + np.exp(-decision))
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def score(self, texts: List[str]) -> List[Optional[dict]]:
+        """
+        Scores cleaned review texts: {'label', 'score'} each, or None for an empty text.
+        """
+        scored: List[Optional[dict]] = [None] * len(texts)
+        present = [i for i, text in enumerate(texts) if text.strip()]
+        if not present:
+            return scored
+        positive, neutral = self.classes.index('positive'), self.classes.index('neutral')
+        for i, row in zip(present, self.probabilities([texts[i] for i in present])):
+            scored[i] = {
+                'label': self.classes[int(row.argmax())],
+                'score': float(row[positive] + row[neutral] / 2),
+            }
+        return scored
+
+
+def model_version() -> str:
+    """
+    The version of the model scores are stored with.
+    """
+    return _model.version if _model is not None else RATING_MODEL_VERSION
+
+
+def label_for_rating(rating: float) -> str:
+    """
+    Maps a rating to a sentiment with the configured thresholds.
+    """
+    if rating >= SENTIMENT_POSITIVE_MIN:
+        return 'positive'
+    if rating > SENTIMENT_NEUTRAL_ABOVE:
+        return 'neutral'
+    return 'negative'
+
+
+def score_rating(rating) -> Optional[dict]:
+    """
+    Scores one review from its rating: {'label', 'score'}, or None without a usable rating.
+    """
+    rating = safe_float_conversion(rating)
+    if rating is None:
+        return None
+    return {'label': label_for_rating(rating), 'score': min(max((rating - 1) / 4, 0.0), 1.0)}
+
+
+def score_reviews(contents: List[Optional[str]], ratings: list) -> List[Optional[dict]]:
+    """
+    Scores reviews with the current model: from their text once a model is published, else
+    from their rating.
+    """
+    if _model is not None:
+        return _model.score([clean_text(content or '') for content in contents])
+    return [score_rating(rating) for rating in ratings]
+
+
+def sentiment_fields(product: dict) -> dict:
+    """
+    The fields to store on a product document for its embedded reviews.
+    """
+    reviews = list(iter_reviews(product))
+    scores = score_reviews([review.review_content for review in reviews], [review.rating for review in reviews])
+    sentiments = [
+        {'review_id': review.review_id, **(scored or {'label': None, 'score': None})}
+        for review, scored in zip(reviews, scores)
+    ]
+    return {'review_sentiments': sentiments, 'sentiment_version': model_version()}
+
+
+def sentiment_changes(product: dict) -> dict:
+    """
+    The sentiment fields a product's stored version lacks or has out of date ({} if none).
+    """
+    fields = sentiment_fields(product)
+    if is_current(product) and product.get('review_sentiments') == fields['review_sentiments']:
+        return {}
+    return fields
+
+
+def review_document_fields(review: dict) -> dict:
+    """
+    The fields to store on a document of the reviews collection.
+    """
+    scored = score_reviews([review.get('review_content')], [review.get('rating')])[0] or {'label': None, 'score': None}
+    return {
+        'sentiment_label': scored['label'],
+        'sentiment_score': scored['score'],
+        'sentiment_version': model_version(),
+    }
+
+
+def is_current(product: dict) -> bool:
+    return product.get('sentiment_version') == model_version()
+
+
+def review_sentiments(product: dict) -> List[dict]:
+    """
+    The {review_id, label, score} of each review of a product, in extraction order: the stored
+    ones when they are current, else scored now.
+    """
+    if is_current(product):
+        return list(product.get('review_sentiments') or [])
+    return sentiment_fields(product)['review_sentiments']
+
+
+def labelled_query(labels: List[str]) -> dict:
+    """
+    Products with a review labelled with one of `labels`, plus those not scored by the current
+    model yet (which may have some). Both branches are index lookups.
+    """
+    version = model_version()
+    return {"$or": [
+        {"review_sentiments.label": {"$in": labels}, "sentiment_version": version},
+        {"sentiment_version": {"$ne": version}},
+    ]}
+
+
+async def create_indexes():
+    await product_collection.create_index("sentiment_version")
+    await product_collection.create_index("review_sentiments.label")
+    # The reviews router creates the (sentiment_label, _id) index its listing filters on
+    await review_collection.create_index("sentiment_version")
+    await sentiment_model_collection.create_index([("version", 1), ("part", 1)])
+
+
+def _model_version(hash_bits: int, classes: List[str], columns, weights, intercept) -> str:
+    digest = hashlib.blake2b(digest_size=6)
+    digest.update(f"{hash_bits}/{','.join(classes)}".encode())
+    for array in (columns, weights, intercept):
+        digest.update(array.tobytes())
+    return f"text-v1/{digest.hexdigest()}"
+
+
+async def publish_scoring_model(coef, intercept, classes: List[str], hash_bits: int, replace: bool = True) -> Optional[str]:
+    """
+    Publishes a trained classifier as the scoring model, and switches this worker to it.
+
+    Parameters:
+        coef, intercept: The classifier's coef_ and intercept_.
+        classes (list): Its classes_, in the order of the coefficient rows.
+        hash_bits (int): The hashing_vectorizer its features came from.
+        replace (bool): Replace the published model; if False, only publish when none is.
+
+    Returns:
+        str: The version published, or None if a model was published already and `replace`
+        is False.
+    """
+    import numpy as np
+
+    coef = np.asarray(coef)
+    # Hashed features no review had keep a zero coefficient; only the others are stored
+    columns = np.flatnonzero(np.any(coef != 0, axis=0)).astype(np.int32)
+    weights = np.ascontiguousarray(coef[:, columns], dtype=np.float32)
+    intercept = np.asarray(intercept, np.float32)
+    classes = [str(label) for label in classes]
+    version = _model_version(hash_bits, classes, columns, weights, intercept)
+
+    async with rebuild_lock(MODEL_ID):
+        published = await analytics_meta_collection.find_one({"_id": MODEL_ID}, {"version": 1})
+        if published is not None and not replace:
+            return None
+        if published is None or published["version"] != version:
+            starts = range(0, max(len(columns), 1), MODEL_PART_COLUMNS)
+            await sentiment_model_collection.delete_many({"version": version})
+            await sentiment_model_collection.insert_many([
+                {
+                    "_id": f"{version}:{part}",
+                    "version": version,
+                    "part": part,
+                    "columns": Binary(columns[start:start + MODEL_PART_COLUMNS].tobytes()),
+                    "weights": Binary(np.ascontiguousarray(weights[:, start:start + MODEL_PART_COLUMNS]).tobytes()),
+                }
+                for part, start in enumerate(starts)
+            ])
+            await analytics_meta_collection.replace_one({"_id": MODEL_ID}, {
+                "version": version,
+                "hash_bits": hash_bits,
+                "classes": classes,
+                "intercept": intercept.tolist(),
+                "parts": len(starts),
+                "published_at": datetime.now(timezone.utc),
+            }, upsert=True)
+            # Workers still on an older version read its parts until they switch; the lock keeps
+            # the current version's parts from being removed by a publisher racing this one
+            await sentiment_model_collection.delete_many({"version": {"$ne": version}})
+        logger.info(f"Published sentiment model {version} ({len(columns)} features).")
+    if await refresh_model():
+        await request_rescoring()
+    return version
+
+
+def _load_model(meta: dict, parts: List[dict]) -> TextSentimentModel:
+    import numpy as np
+
+    classes = meta["classes"]
+    columns = np.concatenate([np.frombuffer(part["columns"], np.int32) for part in parts])
+    weights = np.concatenate(
+        [np.frombuffer(part["weights"], np.float32).reshape(len(classes), -1) for part in parts], axis=1
+    )
+    return TextSentimentModel(meta["version"], meta["hash_bits"], classes, columns, weights, meta["intercept"])
+
+
+async def refresh_model() -> bool:
+    """
+    Switches this worker to the published model if it is not using it yet.
+
+    Returns:
+        bool: Whether the version changed.
+    """
+    global _model
+    meta = await analytics_meta_collection.find_one({"_id": MODEL_ID})
+    if meta is None:
+        changed = _model is not None
+        _model = None
+        return changed
+    if _model is not None and _model.version == meta["version"]:
+        return False
+    parts = await sentiment_model_collection.find({"version": meta["version"]}).sort("part", 1).to_list(length=None)
+    if len(parts) != meta["parts"]:
+        # Replaced while being read; the next poll loads the new one
+        logger.warning(f"Sentiment model {meta['version']} is incomplete; keeping {model_version()}.")
+        return False
+    _model = await asyncio.to_thread(_load_model, meta, parts)
+    logger.info(f"Scoring review sentiment with {_model.version}.")
+    return True
+
+
+async def request_rescoring():
+    """
+    Submits the rescoring job of the current model version, unless one is pending or running.
+    """
+    from app.jobs import submit_job
+
+    try:
+        await submit_job('sentiment_rescore', {'version': model_version()})
+    except Exception as e:
+        logger.error(f"Error submitting the sentiment rescoring job: {e}")
+
+
+async def _rescore(collection, fields: List[str], score, guard: str) -> int:
+    """
+    Rescores the documents of a collection whose sentiment_version is not current, in _id order
+    and batches of SENTIMENT_RESCORE_BATCH_SIZE. Each update only applies if `guard` (a field
+    every write changes) still has the value that was scored, so a concurrent write is never
+    overwritten with a stale score.
+    """
+    rescored = 0
+    last_id = None
+    while True:
+        query = {"sentiment_version": {"$ne": model_version()}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await collection.find(query, fields).sort("_id", 1).limit(SENTIMENT_RESCORE_BATCH_SIZE) \
+            .to_list(length=SENTIMENT_RESCORE_BATCH_SIZE)
+        if not batch:
+            return rescored
+        # Scoring text is CPU work; the event loop keeps serving meanwhile
+        scores = await asyncio.to_thread(lambda: [score(document) for document in batch])
+        operations = [
+            UpdateOne({"_id": document["_id"], guard: document.get(guard)}, {"$set": scored})
+            for document, scored in zip(batch, scores)
+        ]
+        result = await collection.bulk_write(operations, ordered=False)
+        rescored += result.modified_count
+        last_id = batch[-1]["_id"]
+        # Leave room for the requests being served
+        await asyncio.sleep(SENTIMENT_RESCORE_PAUSE)
+
+
+async def rescore_stale() -> dict:
+    """
+    Brings every stored score to the current model version. Idempotent, so passes running at
+    the same time only repeat each other's work.
+
+    Returns:
+        dict: The version, and the number of products and reviews rescored.
+    """
+    await refresh_model()
+    products = await _rescore(product_collection, SCORING_FIELDS + ['updated_at'], sentiment_fields, 'updated_at')
+    reviews = await _rescore(review_collection, ['_id', 'rating', 'review_content'], review_document_fields, 'review_content')
+    if products or reviews:
+        logger.info(f"Rescored {products} products and {reviews} reviews with {model_version()}.")
+    return {"version": model_version(), "products": products, "reviews": reviews}
+
+
+async def _watch_model():
+    # Picks up models other workers publish, and has the documents rescored with them
+    while True:
+        await asyncio.sleep(SENTIMENT_MODEL_POLL)
+        try:
+            if await refresh_model():
+                await request_rescoring()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error loading the published sentiment model: {e}")
+
+
+async def start_rescoring():
+    """
+    Creates the sentiment indexes, loads the published model, submits the rescoring job of its
+    version and starts watching for newly published models.
+    """
+    global _watching
+    try:
+        await create_indexes()
+    except Exception as e:
+        logger.error(f"Error creating sentiment indexes: {e}")
+    try:
+        await refresh_model()
+    except Exception as e:
+        logger.error(f"Error loading the published sentiment model: {e}")
+    await request_rescoring()
+    if _watching is None or _watching.done():
+        _watching = asyncio.ensure_future(_watch_model())
+
+
+async def record_product_write(before: Optional[dict], after: Optional[dict]):
+    """
+    Stores the sentiment of a written product's reviews if the write did not already.
+    Failures are logged and never fail the write itself; the rescoring pass catches up later.
+    """
+    if after is None:
+        return
+    fields = sentiment_changes(after)
+    if not fields:
+        return
+    try:
+        # Skipped if another write changed what is scored first; that write's hook scores it
+        await product_collection.update_one(
+            {"_id": after["_id"], "rating": after.get("rating"), "review_content": after.get("review_content")},
+            {"$set": fields},
+        )
+    except Exception as e:
+        logger.error(f"Error storing review sentiment for product {after.get('_id')}: {e}")
@@ -0,0 +1,456 @@
+# app/sentiment_model.py
+#
+# Out-of-core sentiment classifier for /analytics/sentiment_analysis. Reviews are read from the
+# product cursor in chunks of SENTIMENT_TRAIN_CHUNK_SIZE, hashed into a fixed number of sparse
+# features (HashingVectorizer needs no vocabulary, so nothing grows with the text seen) and fed
+# to an SGD logistic regression through partial_fit. Memory is bounded by the chunk size and the
+# 2**SENTIMENT_HASH_BITS coefficient vectors, whatever the number of reviews.
+#
+# The labels it learns are those of the reviews' ratings (score_rating in app/sentiment.py), never
+# the stored ones, which are this classifier's own predictions once it is published: the first
+# model a worker trains, and every model retrained on request, becomes the scoring model of
+# app/sentiment.py (publish_scoring_model), and the stored scores are redone with it.
+#
+# A review is held out for evaluation by a hash of its review_id, so the split is stable across
+# runs and a new review always lands on the same side. Evaluation is a second streaming pass over
+# the held-out reviews only, accumulated into a confusion matrix.
+#
+# Each worker keeps its model and, on later requests, catches up on products written or deleted
+# since (see changes_since in app/snapshot.py), without retraining. A ledger of the reviews the
+# model has consumed (ReviewLedger, a few bytes a review) tells catch-up which reviews of a
+# written product are new or relabelled: only those are fed to partial_fit or evaluated, so a
+# write that leaves the reviews alone (a helpful vote) changes nothing. Reviews that were removed
+# or relabelled are taken out of the sentiment distribution and, if held out, of the confusion
+# matrix. Training cannot be undone, so the model is retrained from scratch once catch-up has fed
+# or withdrawn SENTIMENT_RETRAIN_FRACTION of the reviews it was trained on.
+#
+# With snapshots, the model is instead trained once per snapshot generation by whichever process
+# writes it (publish_model) and every worker maps that one (see app/snapshot.py): its coefficient
+# arrays stay in the page cache, shared read-only by all workers, and it is as fresh as the
+# latest generation. A worker only trains its own model when asked to retrain or when the latest
+# generation has none.
+
+import asyncio
+import hashlib
+import logging
+import os
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Set, Tuple
+
+from app.cleaning import clean_text
+from app.config import (
+    SENTIMENT_HASH_BITS,
+    SENTIMENT_HOLDOUT_PERCENT,
+    SENTIMENT_RETRAIN_FRACTION,
+    SENTIMENT_TRAIN_CHUNK_SIZE,
+)
+from app.database import product_collection
+from app.fetch import iter_batches
+from app.review_extraction import REVIEW_FIELDS, ReviewRecord, iter_reviews
+from app.sentiment import SENTIMENT_LABELS, hashing_vectorizer, publish_scoring_model, score_rating
+from app.snapshot import changes_since, latest_artifact, start_watermark
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SENTIMENT_CLASSES = SENTIMENT_LABELS
+
+# Product fields the model reads
+MODEL_FIELDS = ['_id'] + REVIEW_FIELDS
+
+# Name and file of the model in snapshot generations
+MODEL_ARTIFACT = 'sentiment_model'
+MODEL_FILE = 'sentiment_model.joblib'
+
+# The model of this process, trained on first use, and the one mapped from the latest generation
+_model: Optional["StreamingSentimentModel"] = None
+_shared: Optional["StreamingSentimentModel"] = None
+_lock = asyncio.Lock()
+
+
+def is_held_out(review: ReviewRecord) -> bool:
+    """
+    Stable train/evaluation split on the review id.
+    """
+    return zlib.crc32(review.review_id.encode()) % 100 < SENTIMENT_HOLDOUT_PERCENT
+
+
+def _labelled_reviews(products: Iterable[dict]) -> Iterable[Tuple[ReviewRecord, str, str, str]]:
+    """
+    Yields (review, cleaned text, sentiment label of its rating, product _id) for every review
+    with a usable rating.
+    """
+    for product in products:
+        owner = str(product.get('_id'))
+        for review in iter_reviews(product):
+            sentiment = score_rating(review.rating)
+            if sentiment is None:
+                continue
+            yield review, clean_text(review.review_content), sentiment['label'], owner
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little')
+
+
+def _review_key(review: ReviewRecord, label: str, owner: str) -> int:
+    # A relabelled review gets a new key, so it reads as a removal plus a new review
+    return _digest(f"{owner}\x00{review.review_id}\x00{label}")
+
+
+class ReviewLedger:
+    """
+    One entry per review the model has consumed: a 64-bit key of (product _id, review id,
+    label), a hash of the product _id, the label's index, and the index of the predicted label
+    for held-out reviews (-1 for training reviews). Entries are appended in parts and joined
+    when read.
+    """
+
+    def __init__(self):
+        import numpy as np
+
+        self.keys = np.empty(0, np.uint64)
+        self.owners = np.empty(0, np.uint64)
+        self.labels = np.empty(0, np.int8)
+        self.predicted = np.empty(0, np.int8)
+        self._parts = []
+
+    def _join(self):
+        import numpy as np
+
+        if self._parts:
+            parts = [(self.keys, self.owners, self.labels, self.predicted)] + self._parts
+            self.keys, self.owners, self.labels, self.predicted = (np.concatenate(column) for column in zip(*parts))
+            self._parts = []
+
+    def __len__(self) -> int:
+        self._join()
+        return len(self.keys)
+
+    def add(self, keys: List[int], owners: List[str], labels: List[str], predicted: Optional[List[str]] = None):
+        import numpy as np
+
+        count = len(keys)
+        self._parts.append((
+            np.fromiter(keys, np.uint64, count),
+            np.fromiter(map(_digest, owners), np.uint64, count),
+            np.fromiter(map(SENTIMENT_CLASSES.index, labels), np.int8, count),
+            np.full(count, -1, np.int8) if predicted is None else np.fromiter(map(SENTIMENT_CLASSES.index, predicted), np.int8, count),
+        ))
+
+    def contains(self, keys: List[int]):
+        import numpy as np
+
+        self._join()
+        return np.isin(np.fromiter(keys, np.uint64, len(keys)), self.keys)
+
+    def withdraw(self, owners: Set[str], current: List[int]) -> Tuple[List[int], List[int]]:
+        """
+        Removes the entries of products in `owners` whose key is not in `current`, the keys
+        those products have now.
+
+        Returns:
+            tuple: (label indexes, predicted label indexes) of the removed entries.
+        """
+        import numpy as np
+
+        self._join()
+        owned = np.isin(self.owners, np.fromiter(map(_digest, owners), np.uint64, len(owners)))
+        stale = owned & ~np.isin(self.keys, np.fromiter(current, np.uint64, len(current)))
+        removed = self.labels[stale].tolist(), self.predicted[stale].tolist()
+        if stale.any():
+            keep = ~stale
+            self.keys, self.owners, self.labels, self.predicted = (
+                self.keys[keep], self.owners[keep], self.labels[keep], self.predicted[keep]
+            )
+        return removed
+
+
+class ConfusionMatrix:
+    """
+    Evaluation counts, reported in the shape of sklearn's classification_report(output_dict=True).
+    """
+
+    def __init__(self):
+        self.counts = [[0] * len(SENTIMENT_CLASSES) for _ in SENTIMENT_CLASSES]
+
+    def add(self, actual: Iterable[str], predicted: Iterable[str]):
+        for truth, guess in zip(actual, predicted):
+            self.counts[SENTIMENT_CLASSES.index(truth)][SENTIMENT_CLASSES.index(guess)] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(map(sum, self.counts))
+
+    @property
+    def accuracy(self) -> Optional[float]:
+        total = self.total
+        return sum(self.counts[i][i] for i in range(len(SENTIMENT_CLASSES))) / total if total else None
+
+    def report(self) -> dict:
+        total = self.total
+        if not total:
+            return {}
+        report = {}
+        for i, label in enumerate(SENTIMENT_CLASSES):
+            support = sum(self.counts[i])
+            predicted = sum(row[i] for row in self.counts)
+            # Like sklearn, only labels that occur in the truth or the predictions
+            if not support and not predicted:
+                continue
+            correct = self.counts[i][i]
+            precision = correct / predicted if predicted else 0.0
+            recall = correct / support if support else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            report[label] = {'precision': precision, 'recall': recall, 'f1-score': f1, 'support': float(support)}
+        labels = list(report.values())
+        report['accuracy'] = self.accuracy
+        for name, weights in (('macro avg', [1.0] * len(labels)), ('weighted avg', [m['support'] for m in labels])):
+            weight_sum = sum(weights)
+            report[name] = {
+                metric: sum(m[metric] * w for m, w in zip(labels, weights)) / weight_sum if weight_sum else 0.0
+                for metric in ('precision', 'recall', 'f1-score')
+            }
+            report[name]['support'] = float(total)
+        return report
+
+
+class StreamingSentimentModel:
+    def __init__(self):
+        from sklearn.linear_model import SGDClassifier
+
+        # Stateless, so transforming a chunk never depends on the chunks before it
+        self.vectorizer = hashing_vectorizer(SENTIMENT_HASH_BITS)
+        self.classifier = SGDClassifier(loss='log_loss', alpha=1e-5, random_state=42)
+        self.evaluation = ConfusionMatrix()
+        self.distribution = Counter()
+        self.ledger = ReviewLedger()
+        self.example: Optional[dict] = None
+        self.trained_reviews = 0
+        self.caught_up_reviews = 0
+        self.watermark: Optional[datetime] = None
+        self.generation: Optional[str] = None  # Snapshot generation it was mapped from
+
+    @property
+    def fitted(self) -> bool:
+        return self.trained_reviews > 0
+
+    def _fit(self, texts: List[str], labels: List[str]):
+        self.classifier.partial_fit(self.vectorizer.transform(texts), labels, classes=SENTIMENT_CLASSES)
+        self.trained_reviews += len(texts)
+
+    def _evaluate(self, texts: List[str], labels: List[str]) -> List[str]:
+        predicted = list(self.classifier.predict(self.vectorizer.transform(texts)))
+        self.evaluation.add(labels, predicted)
+        if self.example is None:
+            self.example = {"review": texts[0], "predicted_sentiment": predicted[0]}
+        return predicted
+
+    async def _consume(self, chunks: AsyncIterator[List[Tuple[ReviewRecord, str, str, str]]], train: bool, evaluate: bool):
+        """
+        Trains on the training reviews and/or evaluates the held-out reviews of each chunk, and
+        enters them in the ledger and the sentiment distribution. The sklearn work runs in a
+        thread so the event loop keeps serving.
+        """
+        async for chunk in chunks:
+            for held_out, wanted in ((False, train), (True, evaluate)):
+                rows = [row for row in chunk if is_held_out(row[0]) == held_out]
+                if not wanted or not rows:
+                    continue
+                texts, labels = [text for _, text, _, _ in rows], [label for _, _, label, _ in rows]
+                predicted = None
+                if held_out:
+                    # Left out of the ledger until there is a model to evaluate them with
+                    if not self.fitted:
+                        continue
+                    predicted = await asyncio.to_thread(self._evaluate, texts, labels)
+                else:
+                    await asyncio.to_thread(self._fit, texts, labels)
+                self.ledger.add(
+                    [_review_key(review, label, owner) for review, _, label, owner in rows],
+                    [owner for _, _, _, owner in rows], labels, predicted,
+                )
+                self.distribution.update(labels)
+
+    async def catch_up(self, changed: List[dict], deleted: Set[str]) -> int:
+        """
+        Brings the model up to date with products written or deleted since it was trained:
+        withdraws the reviews they no longer have (or have relabelled) from the distribution
+        and the evaluation, then trains on or evaluates their new reviews.
+
+        Returns:
+            int: Number of reviews fed to the model or withdrawn from its training.
+        """
+        rows = list(_labelled_reviews(changed))
+        keys = [_review_key(review, label, owner) for review, _, label, owner in rows]
+        owners = {str(product.get('_id')) for product in changed} | set(deleted)
+
+        withdrawn = 0
+        for label, predicted in zip(*self.ledger.withdraw(owners, keys)):
+            self.distribution[SENTIMENT_CLASSES[label]] -= 1
+            if predicted >= 0:
+                self.evaluation.counts[label][predicted] -= 1
+            else:
+                withdrawn += 1
+
+        fresh = [row for row, seen in zip(rows, self.ledger.contains(keys)) if not seen]
+        before = self.trained_reviews + self.evaluation.total
+        for start in range(0, len(fresh), SENTIMENT_TRAIN_CHUNK_SIZE):
+            await self._consume(_chunks_of(fresh[start:start + SENTIMENT_TRAIN_CHUNK_SIZE]), train=True, evaluate=True)
+        return self.trained_reviews + self.evaluation.total - before + withdrawn
+
+    def summary(self) -> dict:
+        """
+        The /analytics/sentiment_analysis response.
+        """
+        return {
+            "accuracy": self.evaluation.accuracy,
+            "classification_report": self.evaluation.report(),
+            "example_prediction": self.example,
+            "sentiment_distribution": dict(+self.distribution),
+            "training": {
+                "mode": "streaming",
+                "trained_reviews": self.trained_reviews,
+                "evaluated_reviews": self.evaluation.total,
+                "caught_up_reviews": self.caught_up_reviews,
+                "generation": self.generation,
+            },
+        }
+
+
+async def _chunks(products: AsyncIterator[List[dict]]) -> AsyncIterator[List[Tuple[ReviewRecord, str, str, str]]]:
+    """
+    Regroups product batches into chunks of SENTIMENT_TRAIN_CHUNK_SIZE labelled reviews.
+    """
+    chunk = []
+    async for batch in products:
+        for row in _labelled_reviews(batch):
+            chunk.append(row)
+            if len(chunk) >= SENTIMENT_TRAIN_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _chunks_of(rows: List[Tuple[ReviewRecord, str, str, str]]) -> AsyncIterator[List[Tuple[ReviewRecord, str, str, str]]]:
+    yield rows
+
+
+async def train_sentiment_model() -> StreamingSentimentModel:
+    """
+    Trains a model with one streaming pass over the training reviews, then scores it with a
+    second pass over the held-out reviews.
+    """
+    model = StreamingSentimentModel()
+    model.watermark = start_watermark()
+    query = {"review_id": {"$exists": True, "$ne": ""}}
+    await model._consume(
+        _chunks(iter_batches(product_collection, MODEL_FIELDS, 'sentiment_training', query=query)),
+        train=True, evaluate=False,
+    )
+    await model._consume(
+        _chunks(iter_batches(product_collection, MODEL_FIELDS, 'sentiment_evaluation', query=query)),
+        train=False, evaluate=True,
+    )
+    logger.info(
+        f"Trained sentiment model on {model.trained_reviews} reviews, "
+        f"evaluated on {model.evaluation.total}: accuracy {model.evaluation.accuracy}."
+    )
+    return model
+
+
+async def publish_scoring(model: StreamingSentimentModel, replace: bool):
+    """
+    Publishes a freshly trained model as the review scoring model (see app/sentiment.py); if
+    `replace` is False, only when none is published yet. Failures are logged, since the model
+    itself is still good to answer with.
+    """
+    if not model.fitted:
+        return
+    try:
+        await publish_scoring_model(
+            model.classifier.coef_, model.classifier.intercept_, list(model.classifier.classes_),
+            SENTIMENT_HASH_BITS, replace=replace,
+        )
+    except Exception as e:
+        logger.error(f"Error publishing the sentiment scoring model: {e}")
+
+
+async def publish_model(directory: str) -> dict:
+    """
+    Trains a model and writes it into a snapshot generation being built (see app/snapshot.py).
+    Arrays are stored uncompressed so workers can map them.
+
+    Returns:
+        dict: The artifact's manifest entry.
+    """
+    import joblib
+
+    model = await train_sentiment_model()
+    await publish_scoring(model, replace=False)
+    await asyncio.to_thread(joblib.dump, model, os.path.join(directory, MODEL_FILE))
+    return {
+        "file": MODEL_FILE,
+        "watermark": model.watermark.isoformat(),
+        "trained_reviews": model.trained_reviews,
+        "evaluated_reviews": model.evaluation.total,
+    }
+
+
+def _map_model(path: str, generation: str) -> StreamingSentimentModel:
+    import joblib
+
+    # Read-only maps: the coefficients are never copied into this process
+    model = joblib.load(path, mmap_mode='r')
+    model.generation = generation
+    return model
+
+
+async def _shared_model() -> Optional[StreamingSentimentModel]:
+    """
+    The model of the latest snapshot generation, mapped when the generation changes, or None.
+    """
+    global _shared
+    artifact = latest_artifact(MODEL_ARTIFACT)
+    if artifact is None:
+        return None
+    generation, path = artifact
+    if _shared is None or _shared.generation != generation:
+        try:
+            _shared = await asyncio.to_thread(_map_model, path, generation)
+        except Exception as e:
+            logger.error(f"Error mapping the sentiment model of snapshot {generation}: {e}")
+            return None
+    return _shared
+
+
+async def get_sentiment_model(retrain: bool = False) -> StreamingSentimentModel:
+    """
+    Returns the model of the latest snapshot generation if it has one. Otherwise (or when asked
+    to retrain) returns this process's model, updated with the reviews of every product written
+    since it was last used (or retrained when asked to, or when catch-up has drifted too far).
+    A model retrained on request is published as the review scoring model, as is the first
+    one trained when none is published; models updated by catch-up are not, so the stored
+    scores are only redone when asked for.
+    """
+    global _model
+    async with _lock:
+        if not retrain:
+            shared = await _shared_model()
+            if shared is not None:
+                # A model this process trained before is no longer needed
+                _model = None
+                return shared
+        if retrain or _model is None or not _model.fitted \
+                or _model.caught_up_reviews > SENTIMENT_RETRAIN_FRACTION * _model.trained_reviews:
+            _model = await train_sentiment_model()
+            await publish_scoring(_model, replace=retrain)
+            return _model
+        watermark, changed, deleted = await changes_since(_model.watermark, MODEL_FIELDS, 'sentiment_catch_up')
+        _model.caught_up_reviews += await _model.catch_up(changed, deleted)
+        _model.watermark = watermark
+        return _model
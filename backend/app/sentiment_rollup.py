@@ -0,0 +1,210 @@
+# app/sentiment_rollup.py
+#
+# Product counts per sentiment and rating sums per (main_category, subcategory), maintained by
+# product writes. A rebuild runs the grouping server-side into a scratch collection with the
+# thresholds document and renames it over the live one (see app/rebuilds.py). Writes keep
+# applying their deltas to the live rollup meanwhile and stamp the rows they touch; once the
+# scratch collection is in place, the rows touched since the rebuild started are regrouped from
+# the products, so writes made during the rebuild are not lost. Only a write landing between the
+# last read of the replaced rollup and the rename is.
+
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+
+from app.cleaning import safe_float_conversion
+from app.config import SENTIMENT_NEUTRAL_ABOVE, SENTIMENT_POSITIVE_MIN
+from app.database import product_collection, sentiment_rollup_collection
+from app.rebuilds import rebuild_lock, scratch_collection, swap_in
+from app.sentiment import label_for_rating
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Id of the document recording the thresholds the rollup was built with
+META_ID = "meta"
+
+
+def current_thresholds() -> dict:
+    return {"positive_min": SENTIMENT_POSITIVE_MIN, "neutral_above": SENTIMENT_NEUTRAL_ABOVE}
+
+
+def rollup_contribution(product: Optional[dict]) -> Optional[Tuple[dict, str, float]]:
+    """
+    Returns the rollup key, sentiment and rating a product contributes, if any.
+    """
+    if not product or not isinstance(product.get('category'), str):
+        return None
+    rating = safe_float_conversion(product.get('rating'))
+    # Same rule as the rebuild pipeline: zero and negative ratings ("0" included) are skipped
+    if rating is None or rating <= 0:
+        return None
+    categories = product['category'].split('|')
+    key = {
+        'main_category': categories[0].strip(),
+        'subcategory': categories[1].strip() if len(categories) > 1 else 'Unknown',
+    }
+    return key, label_for_rating(rating), rating
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _key_match(keys: Iterable[dict]) -> dict:
+    # Narrows the scan to products whose category starts with one of the keys' main categories
+    mains = sorted({key["main_category"] for key in keys})
+    return {"category": {"$regex": "^\\s*(?:" + "|".join(re.escape(main) for main in mains) + ")\\s*(?:\\||$)"}}
+
+
+def _rebuild_pipeline(keys: Optional[List[dict]] = None) -> List[dict]:
+    """
+    Aggregation that groups products by (main_category, subcategory) into rollup rows; only
+    the rows of `keys` when given, else every row.
+    """
+    rating = "$rating_numeric"
+    pipeline = [
+        {"$match": {"category": {"$type": "string"}, **(_key_match(keys) if keys else {})}},
+        {"$project": {
+            "parts": {"$split": ["$category", "|"]},
+            "rating_numeric": {"$convert": {"input": "$rating", "to": "double", "onError": None, "onNull": None}},
+        }},
+        # Same rule as safe_float_conversion: missing, unparsable and zero ratings are skipped
+        {"$match": {"rating_numeric": {"$ne": None, "$gt": 0}}},
+        {"$group": {
+            "_id": {
+                "main_category": {"$trim": {"input": {"$arrayElemAt": ["$parts", 0]}}},
+                "subcategory": {"$ifNull": [{"$trim": {"input": {"$arrayElemAt": ["$parts", 1]}}}, "Unknown"]},
+            },
+            "positive": {"$sum": {"$cond": [{"$gte": [rating, SENTIMENT_POSITIVE_MIN]}, 1, 0]}},
+            "neutral": {"$sum": {"$cond": [
+                {"$and": [{"$lt": [rating, SENTIMENT_POSITIVE_MIN]}, {"$gt": [rating, SENTIMENT_NEUTRAL_ABOVE]}]}, 1, 0
+            ]}},
+            "negative": {"$sum": {"$cond": [
+                {"$and": [{"$lt": [rating, SENTIMENT_POSITIVE_MIN]}, {"$lte": [rating, SENTIMENT_NEUTRAL_ABOVE]}]}, 1, 0
+            ]}},
+            "rating_sum": {"$sum": rating},
+            "rating_count": {"$sum": 1},
+        }},
+    ]
+    if keys:
+        pipeline.append({"$match": {"_id": {"$in": keys}}})
+    return pipeline
+
+
+def _thresholds_document() -> dict:
+    return {"_id": META_ID, "thresholds": current_thresholds()}
+
+
+async def _touched_since(collection, since: datetime) -> List[dict]:
+    rows = collection.find({"touched_at": {"$gte": since}}, {"_id": 1})
+    return [row["_id"] async for row in rows if row["_id"] != META_ID]
+
+
+async def _regroup(keys: List[dict]):
+    """
+    Recomputes the live rows of `keys` from the products, replacing what writes left in them.
+    """
+    rows = {
+        (row["_id"]["main_category"], row["_id"]["subcategory"]): row
+        async for row in product_collection.aggregate(_rebuild_pipeline(keys))
+    }
+    for key in keys:
+        row = rows.get((key["main_category"], key["subcategory"]))
+        if row is None:
+            await sentiment_rollup_collection.delete_one({"_id": key})
+        else:
+            await sentiment_rollup_collection.replace_one({"_id": key}, row, upsert=True)
+
+
+async def _read_rollup() -> Optional[List[dict]]:
+    """
+    Reads the rollup rows and the thresholds document with one query. Returns None if the
+    rollup is missing or was built with different sentiment thresholds.
+    """
+    meta, rows = None, []
+    async for row in sentiment_rollup_collection.find({"$or": [{"_id": META_ID}, {"rating_count": {"$gt": 0}}]}):
+        if row["_id"] == META_ID:
+            meta = row
+        else:
+            rows.append(row)
+    if not meta or meta.get("thresholds") != current_thresholds():
+        return None
+    return sorted(rows, key=lambda row: (row["_id"]["main_category"], row["_id"]["subcategory"]))
+
+
+async def rebuild_sentiment_rollup(force: bool = False):
+    """
+    Rebuilds the rollup with a server-side $group job. One process rebuilds at a time, and
+    unless forced the rebuild is skipped if another process already rebuilt it with the
+    current thresholds.
+    """
+    async with rebuild_lock("sentiment_rollup"):
+        if not force and await _read_rollup() is not None:
+            return
+        started = _now()
+        scratch = scratch_collection(sentiment_rollup_collection)
+        try:
+            await product_collection.aggregate(_rebuild_pipeline() + [{"$out": scratch.name}]).to_list(length=None)
+            await scratch.insert_one(_thresholds_document())
+            touched: Set[tuple] = set()
+            # Rows written to in the rollup being replaced; then, after the swap, in the new one
+            for key in await _touched_since(sentiment_rollup_collection, started):
+                touched.add((key["main_category"], key["subcategory"]))
+            await swap_in(scratch, sentiment_rollup_collection)
+        except Exception:
+            await scratch.drop()
+            raise
+        for key in await _touched_since(sentiment_rollup_collection, started):
+            touched.add((key["main_category"], key["subcategory"]))
+        if touched:
+            await _regroup([{"main_category": main, "subcategory": sub} for main, sub in sorted(touched)])
+        logger.info(f"Rebuilt sentiment rollup with thresholds {current_thresholds()}; regrouped {len(touched)} rows written meanwhile.")
+
+
+async def load_sentiment_rollup() -> List[dict]:
+    """
+    Returns the rollup rows sorted by category, rebuilding first if it is missing or was built
+    with different sentiment thresholds.
+    """
+    rows = await _read_rollup()
+    if rows is None:
+        await rebuild_sentiment_rollup()
+        rows = await _read_rollup() or []
+    return rows
+
+
+async def record_product_write(before: Optional[dict], after: Optional[dict]):
+    """
+    Moves a product's sentiment count and rating from its old rollup row to its new one.
+    Pass None for `before` on create and for `after` on delete.
+    Failures are logged and never fail the write itself.
+    """
+    old = rollup_contribution(before)
+    new = rollup_contribution(after)
+    if old == new:
+        return
+
+    try:
+        # Applied whether or not the rollup is built: a build replaces whatever this creates
+        now = _now()
+        operations = []
+        for contribution, weight in ((old, -1), (new, 1)):
+            if contribution is None:
+                continue
+            key, sentiment, rating = contribution
+            operations.append(UpdateOne(
+                {"_id": key},
+                {
+                    "$inc": {sentiment: weight, "rating_sum": weight * rating, "rating_count": weight},
+                    "$set": {"touched_at": now},
+                },
+                upsert=True,
+            ))
+        await sentiment_rollup_collection.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.error(f"Error updating sentiment rollup: {e}")
@@ -0,0 +1,116 @@
+# app/singleflight.py
+#
+# Request coalescing for the analytics endpoints. Concurrent calls of a decorated endpoint with
+# the same arguments share one computation: the first call starts it as a task and every call
+# (the first included) awaits that task through asyncio.shield, so a client that disconnects
+# only stops its own wait and never cancels the computation the others are waiting for. A
+# result is also served to calls arriving up to SINGLEFLIGHT_HOLD_SECONDS after it completed,
+# which absorbs the burst of identical requests a dashboard makes when many users open it at
+# once. Failures are never held; the next call computes again.
+#
+# The shared computation also encodes its result to JSON (see EncodedResult in
+# app/compression.py), so the calls sharing it send the same bytes, compressed once per encoding,
+# instead of each encoding and compressing the result again.
+
+import asyncio
+import functools
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, Hashable, Optional
+
+from starlette.responses import Response
+
+from app.compression import EncodedJSONResponse, EncodedResult
+from app.config import SINGLEFLIGHT_ENABLED, SINGLEFLIGHT_HOLD_SECONDS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Key -> task computing (or holding) the result for that key
+_flights: Dict[Hashable, asyncio.Task] = {}
+
+# Key -> time.monotonic() until which its finished result may be served
+_held_until: Dict[Hashable, float] = {}
+
+# Per endpoint: computations started and calls served by one that was in flight or held
+coalescing_stats = defaultdict(lambda: {'computations': 0, 'coalesced': 0})
+
+
+def _freeze(value) -> Hashable:
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+async def _compute_encoded(function, args, kwargs):
+    result = await function(*args, **kwargs)
+    # An endpoint that builds its own response is sent as it is
+    if isinstance(result, Response):
+        return result
+    return await EncodedResult.encode(result)
+
+
+def _forget(key: Hashable, task: asyncio.Task):
+    # Only drop the entry if a newer flight has not replaced it
+    if _flights.get(key) is task:
+        del _flights[key]
+        _held_until.pop(key, None)
+
+
+def _landed(key: Hashable, hold: float, task: asyncio.Task):
+    # Retrieving the exception keeps asyncio quiet when every waiter has gone
+    failed = task.cancelled() or task.exception() is not None
+    if failed or hold <= 0:
+        _forget(key, task)
+    else:
+        _held_until[key] = time.monotonic() + hold
+        # Frees the entry of a key that is not requested again
+        asyncio.get_running_loop().call_later(hold, _forget, key, task)
+
+
+def _servable(key: Hashable, task: asyncio.Task) -> bool:
+    if not task.done():
+        return True
+    # A failure stays registered until its done callback runs; never hand it out
+    if task.cancelled() or task.exception() is not None:
+        return False
+    return time.monotonic() < _held_until.get(key, 0.0)
+
+
+def singleflight(name: Optional[str] = None, hold: Optional[float] = None):
+    """
+    Decorates an async endpoint so identical concurrent calls share one computation.
+
+    Parameters:
+        name (str): Key prefix and stats name; defaults to the function name.
+        hold (float): Seconds a result keeps being served after it completed; defaults to
+            SINGLEFLIGHT_HOLD_SECONDS.
+    """
+    def decorator(function):
+        flight_name = name or function.__name__
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            if not SINGLEFLIGHT_ENABLED:
+                return await function(*args, **kwargs)
+
+            key = (flight_name, _freeze(args), _freeze(kwargs))
+            task = _flights.get(key)
+            if task is not None and not _servable(key, task):
+                task = None
+            if task is None:
+                window = SINGLEFLIGHT_HOLD_SECONDS if hold is None else hold
+                task = asyncio.ensure_future(_compute_encoded(function, args, kwargs))
+                task.add_done_callback(functools.partial(_landed, key, window))
+                _flights[key] = task
+                coalescing_stats[flight_name]['computations'] += 1
+            else:
+                coalescing_stats[flight_name]['coalesced'] += 1
+            result = await asyncio.shield(task)
+            return EncodedJSONResponse(result) if isinstance(result, EncodedResult) else result
+        return wrapper
+    return decorator
@@ -0,0 +1,632 @@
+# app/snapshot.py
+#
+# Analytical snapshots of the cleaned product and review tables. Each generation is a directory
+#
+#     <SNAPSHOT_DIR>/<generation>/products.parquet, products.arrow
+#     <SNAPSHOT_DIR>/<generation>/reviews.parquet, reviews.arrow
+#     <SNAPSHOT_DIR>/<generation>/<artifact files>
+#     <SNAPSHOT_DIR>/<generation>/manifest.json
+#
+# and <SNAPSHOT_DIR>/LATEST names the newest complete one. The Parquet files are for offline
+# readers; the uncompressed Arrow IPC files are memory-mapped by API workers, which then catch up
+# only the products written after the snapshot's watermark (stamped with updated_at by the API,
+# deletions recorded as tombstones). Products loaded outside the API carry no updated_at, so write
+# a new snapshot after a bulk import.
+#
+# Artifacts are derived state built once per generation instead of once per worker, such as the
+# fitted sentiment model (see publish_model in app/sentiment_model.py); workers map them from the
+# latest generation. Mapped pages are shared through the page cache, so the memory of a
+# generation is paid once per host whatever the number of workers. A generation is staged in a
+# .tmp directory and renamed into place before LATEST is replaced, so readers never see a partial
+# one, and a lock file lets only one process write at a time. With SNAPSHOT_BUILD_INTERVAL set,
+# every worker runs a builder loop and whichever takes the lock first writes the next generation.
+#
+# Write one from the backend directory with:
+#     python -m app.snapshot
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from app.aggregates import main_category
+from app.cleaning import clean_number_column, safe_float_column
+from app.config import (
+    ANALYTICS_SCAN_BATCH_SIZE,
+    SNAPSHOT_ARTIFACTS,
+    SNAPSHOT_BUILD_INTERVAL,
+    SNAPSHOT_DIR,
+    SNAPSHOT_KEEP,
+    SNAPSHOT_TOMBSTONE_TTL,
+    SNAPSHOT_WATERMARK_OVERLAP,
+)
+from app.database import product_collection, product_tombstone_collection
+from app.fetch import iter_batches
+from app.review_extraction import REVIEW_FIELDS, iter_reviews
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; generations are then written without the lock
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the table layout changes; older snapshots are ignored
+SNAPSHOT_FORMAT = 1
+
+LATEST_FILE = "LATEST"
+MANIFEST_FILE = "manifest.json"
+WRITE_LOCK_FILE = ".write.lock"
+
+# Product columns: text as stored, numbers cleaned with the same column cleaners as the scans
+PRODUCT_TEXT_COLUMNS = ['product_id', 'product_name', 'category']
+PRODUCT_NUMERIC_COLUMNS = {
+    'actual_price': clean_number_column,
+    'discounted_price': clean_number_column,
+    'discount_percentage': clean_number_column,
+    'rating': safe_float_column,
+    'rating_count': clean_number_column,
+}
+# Kept as plain numbers (missing or unparsable values are null)
+PRODUCT_PLAIN_NUMERIC_COLUMNS = ['inventory', 'cost_price']
+
+REVIEW_TEXT_COLUMNS = [
+    'review_id', 'product_id', 'product_name', 'user_id', 'user_name',
+    'review_title', 'review_content', 'review_date',
+]
+
+# Product fields a snapshot reads
+SNAPSHOT_FIELDS = list(dict.fromkeys(
+    ['_id'] + PRODUCT_TEXT_COLUMNS + list(PRODUCT_NUMERIC_COLUMNS) + PRODUCT_PLAIN_NUMERIC_COLUMNS + REVIEW_FIELDS
+))
+
+# The snapshot this process serves, caught up on every read
+_current: Optional["AnalyticsSnapshot"] = None
+_lock = asyncio.Lock()
+
+_builder: Optional[asyncio.Task] = None
+
+
+class SnapshotInProgress(RuntimeError):
+    """
+    Raised when another process or request is already writing a generation to the directory.
+    """
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def start_watermark() -> datetime:
+    """
+    Watermark for state built from a scan starting now: writes stamped from here on are
+    replayed by the next catch-up.
+    """
+    return _now() - timedelta(seconds=SNAPSHOT_WATERMARK_OVERLAP)
+
+
+async def changes_since(watermark: datetime, fields: Sequence[str], endpoint: str) -> Tuple[datetime, List[dict], Set[str]]:
+    """
+    Reads what changed in the products collection since `watermark` with two indexed queries.
+
+    Returns:
+        tuple: (the next watermark, the current version of every product written since,
+        the ids of products deleted since)
+    """
+    next_watermark = start_watermark()
+    changed = []
+    async for batch in iter_batches(product_collection, fields, endpoint, query={"updated_at": {"$gte": watermark}}):
+        changed.extend(batch)
+    deleted = await product_tombstone_collection.find(
+        {"deleted_at": {"$gte": watermark}}, {"_id": 1}
+    ).to_list(length=None)
+    return next_watermark, changed, {str(document['_id']) for document in deleted}
+
+
+def product_schema():
+    import pyarrow as pa
+
+    fields = [pa.field('_id', pa.string(), nullable=False)]
+    fields += [pa.field(name, pa.string()) for name in PRODUCT_TEXT_COLUMNS + ['main_category']]
+    fields += [pa.field(name, pa.float64()) for name in list(PRODUCT_NUMERIC_COLUMNS) + PRODUCT_PLAIN_NUMERIC_COLUMNS]
+    return pa.schema(fields)
+
+
+def review_schema():
+    import pyarrow as pa
+
+    fields = [pa.field('product_oid', pa.string(), nullable=False)]
+    fields += [pa.field(name, pa.string()) for name in REVIEW_TEXT_COLUMNS]
+    fields += [pa.field('rating', pa.float64()), pa.field('helpful_count', pa.int64())]
+    return pa.schema(fields)
+
+
+def _text(value) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def product_table(documents: List[dict]):
+    """
+    Builds the cleaned product table for a batch of product documents.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    columns = {'_id': [str(document['_id']) for document in documents]}
+    for field in PRODUCT_TEXT_COLUMNS:
+        columns[field] = [_text(document.get(field)) for document in documents]
+    columns['main_category'] = [main_category(document.get('category')) for document in documents]
+    for field, cleaner in PRODUCT_NUMERIC_COLUMNS.items():
+        columns[field] = cleaner([document.get(field) for document in documents], field).values
+    for field in PRODUCT_PLAIN_NUMERIC_COLUMNS:
+        values = pd.Series([document.get(field) for document in documents], dtype=object)
+        columns[field] = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64')
+
+    schema = product_schema()
+    # from_pandas turns the cleaners' NaNs into nulls
+    arrays = [pa.array(columns[field.name], field.type, from_pandas=True) for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def review_table(documents: List[dict]):
+    """
+    Builds the review table for a batch of product documents, one row per extracted review.
+    Products without reviews contribute nothing.
+    """
+    import pyarrow as pa
+
+    schema = review_schema()
+    columns = {field.name: [] for field in schema}
+    for document in documents:
+        if not document.get('review_id'):
+            continue
+        product_oid = str(document['_id'])
+        for review in iter_reviews(document):
+            columns['product_oid'].append(product_oid)
+            for field in REVIEW_TEXT_COLUMNS:
+                columns[field].append(_text(getattr(review, field)))
+            columns['rating'].append(review.rating)
+            columns['helpful_count'].append(review.helpful_count)
+    arrays = [pa.array(columns[field.name], field.type) for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class LiveTable:
+    """
+    A memory-mapped base table plus the rows that replaced part of it since. Rows of the base
+    are never copied: replaced ones are hidden by a mask, and readers stream the surviving
+    base batches followed by the replacement rows.
+    """
+
+    def __init__(self, base, key: str):
+        self.base = base
+        self.key = key
+        self.live = None  # Boolean mask over the base rows, None while every row is live
+        self.delta = base.schema.empty_table()
+        self.version = 0  # Bumped on every replace, so derived copies know when they are stale
+
+    def replace(self, keys, rows):
+        """
+        Hides every row whose key is in `keys` and appends `rows`, the current version of them.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        value_set = pa.array(sorted(keys), pa.string())
+        keep = pc.invert(pc.is_in(self.base[self.key], value_set=value_set)).combine_chunks()
+        self.live = keep if self.live is None else pc.and_(self.live, keep)
+        stale = pc.is_in(self.delta[self.key], value_set=value_set)
+        self.delta = pa.concat_tables([self.delta.filter(pc.invert(stale)), rows.cast(self.base.schema)])
+        self.version += 1
+
+    @property
+    def num_rows(self) -> int:
+        import pyarrow.compute as pc
+
+        live_rows = self.base.num_rows if self.live is None else pc.sum(self.live).as_py() or 0
+        return live_rows + self.delta.num_rows
+
+    def batches(self, columns: List[str], batch_size: int = ANALYTICS_SCAN_BATCH_SIZE) -> Iterator:
+        """
+        Yields record batches of `columns` over the live rows.
+        """
+        offset = 0
+        for batch in self.base.select(columns).to_batches(max_chunksize=batch_size):
+            rows = batch.num_rows
+            if self.live is not None:
+                batch = batch.filter(self.live.slice(offset, rows))
+            offset += rows
+            if batch.num_rows:
+                yield batch
+        yield from self.delta.select(columns).to_batches(max_chunksize=batch_size)
+
+    def to_table(self, columns: List[str]):
+        import pyarrow as pa
+
+        base = self.base.select(columns)
+        if self.live is not None:
+            base = base.filter(self.live)
+        return pa.concat_tables([base, self.delta.select(columns)])
+
+
+class AnalyticsSnapshot:
+    """
+    A loaded snapshot generation: the live product and review tables and the watermark up to
+    which they reflect MongoDB.
+    """
+
+    def __init__(self, generation: str, watermark: datetime, products, reviews):
+        self.generation = generation
+        self.watermark = watermark
+        self.products = LiveTable(products, '_id')
+        self.reviews = LiveTable(reviews, 'product_oid')
+
+    async def catch_up(self) -> int:
+        """
+        Replaces the rows of every product written or deleted since the watermark and moves the
+        watermark forward. Two indexed queries when nothing changed.
+
+        Returns:
+            int: Number of products replaced or removed.
+        """
+        watermark, changed, deleted = await changes_since(self.watermark, SNAPSHOT_FIELDS, 'snapshot_catch_up')
+        keys = {str(document['_id']) for document in changed} | deleted
+        if keys:
+            self.products.replace(keys, product_table(changed))
+            self.reviews.replace(keys, review_table(changed))
+        self.watermark = watermark
+        return len(keys)
+
+
+def _generation_dirs(directory: str) -> List[str]:
+    return sorted(
+        name for name in os.listdir(directory)
+        if not name.endswith(".tmp") and os.path.isfile(os.path.join(directory, name, MANIFEST_FILE))
+    )
+
+
+def latest_generation(directory: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, LATEST_FILE)) as pointer:
+            return pointer.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomically(path: str, content: str):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as output:
+        output.write(content)
+    os.replace(temporary, path)
+
+
+def _read_manifest(directory: str, generation: str) -> dict:
+    with open(os.path.join(directory, generation, MANIFEST_FILE)) as source:
+        return json.load(source)
+
+
+def latest_age(directory: str) -> Optional[float]:
+    """
+    Seconds since the latest generation was started, or None if there is none.
+    """
+    generation = latest_generation(directory)
+    if generation is None:
+        return None
+    try:
+        created_at = datetime.fromisoformat(_read_manifest(directory, generation)["created_at"])
+    except (OSError, ValueError, KeyError):
+        return None
+    return (_now() - created_at).total_seconds()
+
+
+def latest_artifact(name: str, directory: Optional[str] = SNAPSHOT_DIR) -> Optional[Tuple[str, str]]:
+    """
+    The (generation, file path) of an artifact in the latest generation, or None if snapshots
+    are disabled or the latest generation does not have it.
+    """
+    if not directory:
+        return None
+    generation = latest_generation(directory)
+    if generation is None:
+        return None
+    try:
+        manifest = _read_manifest(directory, generation)
+    except (OSError, ValueError):
+        return None
+    entry = manifest.get("artifacts", {}).get(name)
+    if manifest.get("format") != SNAPSHOT_FORMAT or entry is None:
+        return None
+    return generation, os.path.join(directory, generation, entry["file"])
+
+
+def _artifact_publishers() -> Dict[str, Callable[[str], Awaitable[dict]]]:
+    """
+    The artifacts built into each generation: name -> coroutine function that writes its files
+    into the staging directory and returns its manifest entry ({"file": ..., ...}).
+    """
+    # Imported here: the publishers catch up through this module
+    from app.sentiment_model import MODEL_ARTIFACT, publish_model
+
+    publishers = {MODEL_ARTIFACT: publish_model}
+    return {name: publish for name, publish in publishers.items() if name in SNAPSHOT_ARTIFACTS}
+
+
+@contextmanager
+def _write_lock(directory: str):
+    """
+    Holds the directory's write lock (an flock, released if the process dies) or raises
+    SnapshotInProgress at once.
+    """
+    with open(os.path.join(directory, WRITE_LOCK_FILE), "w") as handle:
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise SnapshotInProgress("A snapshot is already being written; try again when it is done.")
+        yield
+
+
+async def write_snapshot(directory: Optional[str] = SNAPSHOT_DIR, if_older_than: Optional[float] = None) -> Optional[dict]:
+    """
+    Writes a new snapshot generation in one streaming pass over the products, builds its
+    artifacts, then points LATEST at it and prunes generations beyond SNAPSHOT_KEEP.
+
+    Parameters:
+        directory (str): Snapshot directory.
+        if_older_than (float): Only write if the latest generation is at least this many
+            seconds old (checked under the lock, so racing builders write it once).
+
+    Returns:
+        dict: The manifest of the new generation, or None if the latest one was recent enough.
+    """
+    if not directory:
+        raise ValueError("No snapshot directory configured (set DASHBOARD_SNAPSHOT_DIR).")
+
+    os.makedirs(directory, exist_ok=True)
+    with _write_lock(directory):
+        if if_older_than is not None:
+            age = latest_age(directory)
+            if age is not None and age < if_older_than:
+                return None
+        return await _write_generation(directory)
+
+
+async def _write_tables(staging: str, schemas: dict, builders: dict) -> Dict[str, int]:
+    """
+    Streams the products into the Parquet and Arrow files of each table in `staging`. Each
+    batch's tables are built and written in a thread, so the event loop keeps serving requests.
+
+    Returns:
+        dict: rows written per table
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    outputs = {}
+
+    def write_batch(batch: List[dict]) -> Dict[str, int]:
+        written = {}
+        for name, build in builders.items():
+            table = build(batch)
+            for writer in outputs[name]:
+                writer.write_table(table)
+            written[name] = table.num_rows
+        return written
+
+    writers = []
+    try:
+        for name, schema in schemas.items():
+            parquet = pq.ParquetWriter(os.path.join(staging, f"{name}.parquet"), schema)
+            arrow = pa.ipc.new_file(os.path.join(staging, f"{name}.arrow"), schema)
+            writers += [parquet, arrow]
+            outputs[name] = (parquet, arrow)
+
+        rows = {name: 0 for name in schemas}
+        async for batch in iter_batches(product_collection, SNAPSHOT_FIELDS, 'snapshot'):
+            for name, count in (await asyncio.to_thread(write_batch, batch)).items():
+                rows[name] += count
+        return rows
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+async def _write_generation(directory: str) -> dict:
+    started = _now()
+    watermark = start_watermark()
+    generation = started.strftime("%Y%m%dT%H%M%S%fZ")
+    target = os.path.join(directory, generation)
+    staging = f"{target}.tmp"
+    os.makedirs(staging)
+
+    schemas = {'products': product_schema(), 'reviews': review_schema()}
+    builders = {'products': product_table, 'reviews': review_table}
+    try:
+        rows = await _write_tables(staging, schemas, builders)
+
+        artifacts = {}
+        for name, publish in _artifact_publishers().items():
+            try:
+                artifacts[name] = await publish(staging)
+            except Exception as e:
+                # The generation is still useful without it; workers build their own instead
+                logger.error(f"Error building artifact {name} for snapshot {generation}: {e}")
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "generation": generation,
+            "created_at": started.isoformat(),
+            "watermark": watermark.isoformat(),
+            "source": product_collection.full_name,
+            "tables": {
+                name: {
+                    "rows": rows[name],
+                    "parquet": f"{name}.parquet",
+                    "arrow": f"{name}.arrow",
+                    "schema": [{"name": field.name, "type": str(field.type)} for field in schema],
+                }
+                for name, schema in schemas.items()
+            },
+            "artifacts": artifacts,
+        }
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as output:
+            json.dump(manifest, output, indent=2)
+
+        os.rename(staging, target)
+    except BaseException:
+        # Pruning only looks at finished generations, so a failed one is removed here
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    _write_atomically(os.path.join(directory, LATEST_FILE), generation)
+
+    # Workers that still map an older generation keep reading it until they reload
+    generations = _generation_dirs(directory)
+    for old in generations[:max(len(generations) - SNAPSHOT_KEEP, 0)]:
+        if old != generation:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+    logger.info(f"Wrote snapshot {generation} with {rows['products']} products and {rows['reviews']} reviews.")
+    return manifest
+
+
+def load_snapshot(directory: str, generation: str) -> Optional[AnalyticsSnapshot]:
+    """
+    Memory-maps a snapshot generation. Returns None if it is from another format or too old
+    to catch up (its tombstones may have expired).
+    """
+    import pyarrow as pa
+
+    path = os.path.join(directory, generation)
+    manifest = _read_manifest(directory, generation)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        logger.warning(f"Ignoring snapshot {generation} written in format {manifest.get('format')}.")
+        return None
+    watermark = datetime.fromisoformat(manifest["watermark"])
+    if watermark < _now() - timedelta(seconds=SNAPSHOT_TOMBSTONE_TTL):
+        logger.warning(f"Ignoring snapshot {generation}: it is older than the tombstone TTL; write a new one.")
+        return None
+
+    tables = {}
+    for name, entry in manifest["tables"].items():
+        # The table keeps the map open; record batches point straight into the page cache
+        tables[name] = pa.ipc.open_file(pa.memory_map(os.path.join(path, entry["arrow"]), "r")).read_all()
+    return AnalyticsSnapshot(generation, watermark, tables['products'], tables['reviews'])
+
+
+async def current_snapshot() -> Optional[AnalyticsSnapshot]:
+    """
+    Returns this process's snapshot, caught up with every product write since its watermark,
+    or None when snapshots are disabled or none has been written. Switches to a newer
+    generation as soon as LATEST points at one.
+    """
+    global _current
+    if not SNAPSHOT_DIR:
+        return None
+    async with _lock:
+        generation = latest_generation(SNAPSHOT_DIR)
+        if generation is None:
+            _current = None
+            return None
+        if _current is None or _current.generation != generation:
+            try:
+                _current = load_snapshot(SNAPSHOT_DIR, generation)
+            except Exception as e:
+                logger.error(f"Error loading snapshot {generation}: {e}")
+                _current = None
+            if _current is None:
+                return None
+        await _current.catch_up()
+        return _current
+
+
+async def load_on_startup():
+    """
+    Creates the indexes catch-up relies on and maps the latest snapshot, so the first analytics
+    request does not pay for it. Failures are logged; scans then read MongoDB directly.
+    """
+    try:
+        await product_collection.create_index("updated_at")
+        await product_tombstone_collection.create_index("deleted_at", expireAfterSeconds=SNAPSHOT_TOMBSTONE_TTL)
+        if not SNAPSHOT_DIR:
+            return
+        start_builder()
+        snapshot = await current_snapshot()
+        if snapshot is None:
+            logger.info(f"No snapshot in {SNAPSHOT_DIR} yet; analytics scans read MongoDB.")
+        else:
+            logger.info(
+                f"Mapped snapshot {snapshot.generation}: {snapshot.products.num_rows} products, "
+                f"{snapshot.reviews.num_rows} reviews."
+            )
+    except Exception as e:
+        logger.error(f"Error loading analytics snapshot: {e}")
+
+
+async def run_builder(interval: float):
+    """
+    Writes a new generation whenever the latest one is `interval` seconds old. Every worker may
+    run this; the write lock and the age check under it make sure one of them writes it.
+    """
+    while True:
+        try:
+            manifest = await write_snapshot(SNAPSHOT_DIR, if_older_than=interval)
+            if manifest is not None:
+                await current_snapshot()
+        except SnapshotInProgress:
+            pass
+        except Exception as e:
+            logger.error(f"Error writing scheduled snapshot: {e}")
+        age = latest_age(SNAPSHOT_DIR)
+        await asyncio.sleep(max(interval - age, 1.0) if age is not None else interval)
+
+
+def start_builder():
+    """
+    Starts this worker's builder loop if SNAPSHOT_BUILD_INTERVAL is set.
+    """
+    global _builder
+    if not SNAPSHOT_DIR or SNAPSHOT_BUILD_INTERVAL <= 0:
+        return
+    if _builder is None or _builder.done():
+        _builder = asyncio.ensure_future(run_builder(SNAPSHOT_BUILD_INTERVAL))
+
+
+async def record_product_write(before: Optional[dict], after: Optional[dict]):
+    """
+    Records a tombstone when a product is deleted, so snapshots and other in-process copies
+    (like the review search index) drop it when catching up. Creates and updates are found
+    through their updated_at stamp.
+    """
+    if before is None or after is not None:
+        return
+    try:
+        await product_tombstone_collection.update_one(
+            {"_id": before["_id"]}, {"$set": {"deleted_at": _now()}}, upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Error recording product tombstone: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write an analytical snapshot of the cleaned products and reviews.")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="Snapshot directory (defaults to DASHBOARD_SNAPSHOT_DIR)")
+    args = parser.parse_args()
+    try:
+        manifest = asyncio.run(write_snapshot(args.dir))
+    except SnapshotInProgress as e:
+        raise SystemExit(str(e))
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# app/write_hooks.py
+#
+# Analytics bookkeeping for product writes. The product router schedules it as a background task,
+# so it runs after the response has been sent and a write's latency is its database round trip
+# alone; the precomputed structures lag the write by the time the hooks take.
+
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from app import price_buckets, price_trend, sentiment, sentiment_rollup, snapshot
+from app.config import PRODUCT_BULK_BATCH_SIZE
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def record_product_write(before: Optional[dict], after: Optional[dict]):
+    """
+    Updates every precomputed analytics structure after a product is created, updated or deleted.
+    Pass None for `before` on create and for `after` on delete. Each maintainer logs its own
+    failures, so a write never fails because of analytics bookkeeping.
+    """
+    outcomes = await asyncio.gather(
+        price_buckets.record_product_write(before, after),
+        price_trend.record_product_write(before, after),
+        sentiment_rollup.record_product_write(before, after),
+        sentiment.record_product_write(before, after),
+        snapshot.record_product_write(before, after),
+        return_exceptions=True,
+    )
+    # Runs after the response, so nothing else would report a maintainer that failed to catch its error
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            logger.error(f"Error in analytics bookkeeping for a product write: {outcome}")
+
+
+async def record_product_writes(writes: List[Tuple[Optional[dict], Optional[dict]]]):
+    """
+    Runs record_product_write for each (before, after) pair of a bulk request, concurrently
+    within batches of PRODUCT_BULK_BATCH_SIZE. Every maintainer applies commutative $inc
+    deltas, so the order the writes are recorded in does not matter.
+    """
+    for start in range(0, len(writes), PRODUCT_BULK_BATCH_SIZE):
+        await asyncio.gather(*(
+            record_product_write(before, after) for before, after in writes[start:start + PRODUCT_BULK_BATCH_SIZE]
+        ))
@@ -0,0 +1,175 @@
+# benchmarks/crud_latency.py
+#
+# Measures product create and update latency with the database access pattern the product
+# router used before (insert then read back; read, update, then read back) against the current
+# one (insert only; a single find_one_and_update). Reports p50/p99 per pattern and the number of
+# database commands each operation sent, counted with a pymongo command listener.
+#
+# It also measures the analytics bookkeeping of an update (app/write_hooks.py) awaited inline
+# before responding against scheduled after the response, as the router now does. The hooks are
+# stood in for by writes of the same shape to scratch collections: a bulk upsert per price
+# bucket and trend bin, the trend's power sums and the sentiment rollup's $inc. With the hooks
+# after the response, its latency is the update alone; the hooks still run, and still count
+# towards the commands per operation.
+#
+# Needs a MongoDB server; the benchmark writes to a scratch collection and drops it afterwards.
+# Run from the backend directory:
+#     python -m benchmarks.crud_latency --uri mongodb://localhost:27017 --operations 2000
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timezone
+
+import motor.motor_asyncio
+from pymongo import ReturnDocument, UpdateOne, monitoring
+
+COLLECTION = "crud_latency_benchmark"
+HOOK_COLLECTION = "crud_latency_benchmark_hooks"
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def product(number: int) -> dict:
+    return {
+        "product_name": f"Product {number}",
+        "category": "Electronics|Phones",
+        "actual_price": 1999.0,
+        "discounted_price": 1499.0,
+        "discount_percentage": 25.0,
+        "rating": 4.1,
+        "rating_count": 1200,
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+
+async def create_before(collection, number: int):
+    result = await collection.insert_one(product(number))
+    return await collection.find_one({"_id": result.inserted_id})
+
+
+async def create_after(collection, number: int):
+    document = product(number)
+    await collection.insert_one(document)
+    return document
+
+
+async def update_before(collection, object_id, number: int):
+    changes = {"rating": 3.0 + number % 20 / 10, "updated_at": datetime.now(timezone.utc)}
+    previous = await collection.find_one({"_id": object_id})
+    await collection.update_one({"_id": object_id}, {"$set": changes})
+    return previous, await collection.find_one({"_id": object_id})
+
+
+async def update_after(collection, object_id, number: int):
+    changes = {"rating": 3.0 + number % 20 / 10, "updated_at": datetime.now(timezone.utc)}
+    previous = await collection.find_one_and_update(
+        {"_id": object_id}, {"$set": changes}, return_document=ReturnDocument.BEFORE
+    )
+    return previous, {**previous, **changes}
+
+
+async def record_write(hooks, before: dict, after: dict):
+    # The writes app.write_hooks.record_product_write sends for an update, run concurrently like it
+    def bins(prefix: str) -> list:
+        return [
+            UpdateOne({"_id": f"{prefix}-{before['rating']}"}, {"$inc": {"count": -1, "sum": -before["rating"]}}, upsert=True),
+            UpdateOne({"_id": f"{prefix}-{after['rating']}"}, {"$inc": {"count": 1, "sum": after["rating"]}}, upsert=True),
+        ]
+
+    await asyncio.gather(
+        hooks.bulk_write(bins("bucket"), ordered=False),
+        hooks.bulk_write(bins("trend"), ordered=False),
+        hooks.update_one({"_id": "sums"}, {"$inc": {"s1": after["rating"] - before["rating"]}}, upsert=True),
+        hooks.update_one({"_id": "rollup"}, {"$inc": {"count": 0}, "$set": {"touched_at": after["updated_at"]}}, upsert=True),
+    )
+
+
+async def update_hooks_inline(collection, hooks, object_id, number: int):
+    previous, updated = await update_after(collection, object_id, number)
+    await record_write(hooks, previous, updated)
+    return updated
+
+
+async def update_hooks_after(collection, hooks, object_id, number: int, pending: list):
+    previous, updated = await update_after(collection, object_id, number)
+    # Scheduled like a background task: the response does not wait for it
+    pending.append(asyncio.ensure_future(record_write(hooks, previous, updated)))
+    return updated
+
+
+async def measure(name: str, operation, operations: int, counter: CommandCounter, pending: list = None):
+    durations = []
+    commands = counter.count
+    for number in range(operations):
+        started = time.perf_counter()
+        await operation(number)
+        durations.append(time.perf_counter() - started)
+    if pending:
+        # The deferred bookkeeping is part of the work each operation causes
+        await asyncio.gather(*pending)
+    commands = (counter.count - commands) / operations
+    durations.sort()
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+    print(
+        f"{name:>16}: p50 {statistics.median(durations) * 1000:7.2f} ms, p99 {p99 * 1000:7.2f} ms, "
+        f"{commands:.1f} commands per operation"
+    )
+
+
+async def run(uri: str, database: str, operations: int):
+    counter = CommandCounter()
+    client = motor.motor_asyncio.AsyncIOMotorClient(uri, event_listeners=[counter])
+    collection = client[database][COLLECTION]
+    hooks = client[database][HOOK_COLLECTION]
+    await collection.drop()
+    await hooks.drop()
+    try:
+        # Warm the connection pool so the first timed operation does not pay for the handshake
+        await collection.insert_one(product(-1))
+
+        await measure("create (before)", lambda n: create_before(collection, n), operations, counter)
+        await measure("create (after)", lambda n: create_after(collection, n), operations, counter)
+
+        ids = [document["_id"] async for document in collection.find({}, {"_id": 1}).limit(operations)]
+        await measure("update (before)", lambda n: update_before(collection, ids[n % len(ids)], n), operations, counter)
+        await measure("update (after)", lambda n: update_after(collection, ids[n % len(ids)], n), operations, counter)
+
+        await measure(
+            "hooks inline", lambda n: update_hooks_inline(collection, hooks, ids[n % len(ids)], n), operations, counter
+        )
+        pending = []
+        await measure(
+            "hooks after", lambda n: update_hooks_after(collection, hooks, ids[n % len(ids)], n, pending),
+            operations, counter, pending,
+        )
+    finally:
+        await collection.drop()
+        await hooks.drop()
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark product create/update round trips and their analytics bookkeeping.")
+    parser.add_argument("--uri", default="mongodb://localhost:27017", help="MongoDB connection string")
+    parser.add_argument("--database", default="amazon_benchmark", help="Scratch database")
+    parser.add_argument("--operations", type=int, default=2000, help="Timed operations per pattern")
+    args = parser.parse_args()
+    asyncio.run(run(args.uri, args.database, args.operations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/duckdb_engine.py
+#
+# Times the DuckDB analytics engine over a synthetic snapshot of cleaned products, next to the
+# same summary aggregation done in pandas on a DataFrame of the same rows.
+#
+# Run from the backend directory:
+#     python -m benchmarks.duckdb_engine --products 1000000
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+import pyarrow as pa
+
+from app import duckdb_engine
+from app.config import PRICE_BUCKET_EDGES, SUMMARY_RATING_BINS, SUMMARY_RATING_TOP_K
+from app.snapshot import AnalyticsSnapshot, product_schema, review_schema
+
+CATEGORIES = [
+    "Electronics|Phones", "Electronics|Cables", "Computers&Accessories|Mice", "Home&Kitchen|Fans",
+    "Home&Kitchen|Heaters", "OfficeProducts|Pens", "Toys&Games|Puzzles", "Health&PersonalCare|Scales",
+]
+
+
+def synthetic_products(count: int, seed: int = 42):
+    """
+    Builds a cleaned product table shaped like a snapshot, with roughly 2% missing numbers.
+    """
+    rng = np.random.default_rng(seed)
+    actual_price = rng.lognormal(7.5, 1.2, count).round()
+    discount = rng.integers(0, 95, count).astype("float64")
+
+    def with_gaps(values):
+        return pa.array(values, pa.float64(), mask=rng.random(count) < 0.02)
+
+    categories = np.array(CATEGORIES, dtype=object)[rng.integers(0, len(CATEGORIES), count)]
+    columns = {
+        '_id': pa.array([f"{i:024x}" for i in range(count)]),
+        'product_id': pa.array([f"B{i:09d}" for i in range(count)]),
+        'product_name': pa.array([f"Product {i}" for i in range(count)]),
+        'category': pa.array(categories, pa.string()),
+        'main_category': pa.array([category.split('|')[0] for category in categories], pa.string()),
+        'actual_price': with_gaps(actual_price),
+        'discounted_price': with_gaps((actual_price * (1 - discount / 100)).round()),
+        'discount_percentage': with_gaps(discount),
+        'rating': with_gaps(rng.choice(np.arange(1.0, 5.1, 0.1).round(1), count)),
+        'rating_count': with_gaps(rng.integers(1, 100000, count).astype("float64")),
+        'inventory': with_gaps(rng.integers(0, 500, count).astype("float64")),
+        'cost_price': pa.nulls(count, pa.float64()),
+    }
+    return pa.Table.from_pydict(columns, schema=product_schema())
+
+
+def pandas_summary(frame):
+    """
+    The summary's core aggregation in pandas: sales and profit, per-category totals, top sellers.
+    """
+    sales = frame['discounted_price'] * frame['rating_count']
+    cost = frame['cost_price'].fillna(frame['actual_price'] * 0.7)
+    profit = (frame['discounted_price'] - cost) * frame['rating_count']
+    data = frame.assign(sales=sales, profit=profit)
+    grouped = data.groupby('main_category', sort=False)
+    grouped.agg(total_sales=('sales', 'sum'), total_profit=('profit', 'sum'), average_discount=('discount_percentage', 'mean'))
+    data['sales'].dropna().nlargest(5)
+    data[['product_id', 'product_name', 'rating', 'rating_count']].to_dict(orient='records')
+
+
+def timed(function, runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DuckDB analytics engine on a synthetic snapshot.")
+    parser.add_argument("--products", type=int, default=1_000_000, help="Number of synthetic products")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per query (median is reported)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    products = synthetic_products(args.products)
+    print(f"Built {args.products:,} products in {time.perf_counter() - started:.1f} s")
+
+    snapshot = AnalyticsSnapshot("benchmark", None, products, review_schema().empty_table())
+    loop = asyncio.new_event_loop()
+    queries = {
+        "summary": lambda: duckdb_engine.summary(snapshot, SUMMARY_RATING_BINS, SUMMARY_RATING_TOP_K),
+        "sentiment_distribution": lambda: duckdb_engine.sentiment_rows(snapshot),
+        "price_discount_analysis": lambda: duckdb_engine.price_discount_analysis(snapshot, PRICE_BUCKET_EDGES),
+        "top_products": lambda: duckdb_engine.top_products(snapshot, None, None, None, 'popularity_score', 1, 10),
+        "top_products (category filter)": lambda: duckdb_engine.top_products(
+            snapshot, "home&kitchen|toys", 3.0, None, 'profit', 2, 10
+        ),
+    }
+    # The first call registers the table; keep it out of the timings
+    loop.run_until_complete(queries["top_products"]())
+    for name, query in queries.items():
+        seconds = timed(lambda: loop.run_until_complete(query()), args.runs)
+        print(f"{'duckdb ' + name:>40}: {seconds * 1000:8.0f} ms")
+
+    frame = products.to_pandas()
+    seconds = timed(lambda: pandas_summary(frame), args.runs)
+    print(f"{'pandas summary (frame already built)':>40}: {seconds * 1000:8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/partitioned_scan.py
+#
+# Measures a full-catalogue aggregation (the price/rating/discount correlation, by category)
+# scanned through one cursor in this process against the collection split into 2, 4, 8 ... _id
+# partitions read and reduced by the worker pool (see app/partitioned_scan.py). Reports the
+# median wall time per partition count and checks every run gives the single-cursor result.
+#
+# Needs a MongoDB server; the benchmark writes synthetic products to a scratch collection and
+# drops it afterwards. Set DASHBOARD_SCAN_WORKERS to size the pool (one per core by default).
+# Run from the backend directory:
+#     python -m benchmarks.partitioned_scan --uri mongodb://localhost:27017 --products 500000
+
+import argparse
+import asyncio
+import math
+import statistics
+import time
+
+import motor.motor_asyncio
+
+from app.partial_aggregates import PRICE_TREND_CLEANERS, CorrelationAggregation
+from app.partitioned_scan import scan_aggregate
+
+COLLECTION = "partitioned_scan_benchmark"
+AGGREGATION = CorrelationAggregation(PRICE_TREND_CLEANERS, by_category=True)
+CATEGORIES = ["Electronics|Phones", "Electronics|Audio", "Home&Kitchen|Appliances", "Computers|Accessories"]
+
+
+def product(number: int) -> dict:
+    # String fields shaped like the imported catalogue, so cleaning costs what it does in production
+    price = 199 + number * 37 % 50_000
+    discount = number % 90
+    return {
+        "product_name": f"Product {number}",
+        "category": CATEGORIES[number % len(CATEGORIES)],
+        "actual_price": f"₹{price:,}",
+        "discounted_price": f"₹{price * (100 - discount) // 100:,}",
+        "discount_percentage": f"{discount}%",
+        "rating": str(1 + number * 7 % 41 / 10),
+        "rating_count": f"{number * 13 % 100_000:,}",
+    }
+
+
+async def seed(collection, products: int, batch_size: int = 10_000):
+    for start in range(0, products, batch_size):
+        await collection.insert_many([product(n) for n in range(start, min(products, start + batch_size))])
+
+
+async def scan(collection, partitions: int, uri: str):
+    return await scan_aggregate(
+        collection, AGGREGATION.fields, 'partitioned_scan_benchmark', AGGREGATION.map, AGGREGATION.combine,
+        partitions=partitions, uri=uri,
+    )
+
+
+def correlations(result) -> dict:
+    overall, by_category = result
+    return {'overall': overall.correlation(), **{name: moments.correlation() for name, moments in by_category.items()}}
+
+
+def close(expected: dict, actual: dict) -> bool:
+    def values(result):
+        return [value for matrix in result.values() for row in matrix.values() for value in row.values()]
+
+    return expected.keys() == actual.keys() and all(
+        a == b or (a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12))
+        for a, b in zip(values(expected), values(actual))
+    )
+
+
+async def run(uri: str, database: str, products: int, partition_counts: list, runs: int):
+    client = motor.motor_asyncio.AsyncIOMotorClient(uri)
+    collection = client[database][COLLECTION]
+    await collection.drop()
+    try:
+        await seed(collection, products)
+        expected = None
+        for partitions in partition_counts:
+            # One untimed run starts the worker processes and warms their connections
+            await scan(collection, partitions, uri)
+            durations = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                result = await scan(collection, partitions, uri)
+                durations.append(time.perf_counter() - started)
+            result = correlations(result)
+            expected = expected or result
+            print(
+                f"{partitions:>3} partition(s): median {statistics.median(durations):7.2f} s over {runs} runs, "
+                f"{'same result' if close(expected, result) else 'RESULT DIFFERS'}"
+            )
+    finally:
+        await collection.drop()
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark partitioned full-catalogue scans.")
+    parser.add_argument("--uri", default="mongodb://localhost:27017", help="MongoDB connection string")
+    parser.add_argument("--database", default="amazon_benchmark", help="Scratch database")
+    parser.add_argument("--products", type=int, default=500_000, help="Synthetic products to scan")
+    parser.add_argument("--partitions", default="1,2,4,8", help="Comma separated partition counts")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per partition count")
+    args = parser.parse_args()
+    partition_counts = [int(value) for value in args.partitions.split(",")]
+    asyncio.run(run(args.uri, args.database, args.products, partition_counts, args.runs))
+
+
+if __name__ == "__main__":
+    main()
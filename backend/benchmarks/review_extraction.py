@@ -0,0 +1,135 @@
+# benchmarks/review_extraction.py
+#
+# Measures time and peak RSS of turning product documents into reviews, on synthetic products
+# streamed in cursor-sized batches (the products themselves are never all in memory):
+#   - dicts:   the previous extractor (seven split lists and a dict per review) with every
+#              review extended into one list and then a DataFrame, as the endpoints did;
+#   - columns: review_columns appending straight into one list per field, then a DataFrame;
+#   - records: iter_reviews consumed lazily (here: a rating histogram), nothing retained.
+# Each mode runs in its own process so the peak RSS of one does not hide another's.
+#
+# Run from the backend directory:
+#     python -m benchmarks.review_extraction --reviews 5000000
+
+import argparse
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from app.cleaning import safe_float_conversion
+from app.review_extraction import iter_reviews, review_columns
+
+MODES = ["dicts", "columns", "records"]
+WORDS = ["good", "bad", "great", "poor", "fast", "slow", "cheap", "sturdy", "broke", "works", "love", "value"]
+
+
+def synthetic_batches(reviews: int, per_product: int, batch_size: int = 1000):
+    """
+    Yields lists of product documents shaped like the imported catalogue, `per_product` reviews
+    each, `reviews` in all.
+    """
+    batch = []
+    for number in range(-(-reviews // per_product)):
+        count = min(per_product, reviews - number * per_product)
+        ids = range(number * per_product, number * per_product + count)
+        batch.append({
+            'product_id': f"B{number:09d}",
+            'product_name': f"Product {number}",
+            'user_id': ",".join(f"U{i:010d}" for i in ids),
+            'user_name': ",".join(f"User {i}" for i in ids),
+            'review_id': ",".join(f"R{i:010d}" for i in ids),
+            'review_title': ",".join(f"{WORDS[i % 12]} product" for i in ids),
+            'review_content': ",".join(" ".join(WORDS[(i + k) % 12] for k in range(12)) for i in ids),
+            'rating': str(1 + number % 41 / 10),
+            'review_date': "",
+            'helpful_count': ",".join(str(i % 50) for i in ids),
+        })
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def legacy_extract(product: dict) -> list:
+    """
+    The extractor before iter_reviews, kept here as the baseline.
+    """
+    user_ids = product.get("user_id", "").split(",")
+    user_names = product.get("user_name", "").split(",")
+    review_ids = product.get("review_id", "").split(",")
+    review_titles = product.get("review_title", "").split(",")
+    review_contents = product.get("review_content", "").split(",")
+    ratings = [product.get("rating")] * len(review_ids)
+    review_dates = [product.get("review_date", "")] * len(review_ids)
+    product_name = product.get("product_name", "Unknown")
+    product_id = product.get("product_id", "")
+    if "helpful_count" in product and product["helpful_count"]:
+        helpful_counts = product.get("helpful_count", "").split(",")
+    else:
+        helpful_counts = ["0"] * len(review_ids)
+    num_reviews = min(
+        len(user_ids), len(user_names), len(review_ids), len(review_titles),
+        len(review_contents), len(ratings), len(helpful_counts),
+    )
+    reviews = []
+    for i in range(num_reviews):
+        reviews.append({
+            "review_id": review_ids[i].strip(),
+            "product_id": product_id.strip(),
+            "product_name": product_name.strip(),
+            "user_id": user_ids[i].strip(),
+            "user_name": user_names[i].strip(),
+            "review_title": review_titles[i].strip(),
+            "review_content": review_contents[i].strip(),
+            "rating": safe_float_conversion(ratings[i]),
+            "review_date": review_dates[i],
+            "helpful_count": int(helpful_counts[i]) if helpful_counts[i].isdigit() else 0,
+        })
+    return reviews
+
+
+def run(mode: str, reviews: int, per_product: int) -> str:
+    import pandas as pd
+
+    started = time.perf_counter()
+    batches = synthetic_batches(reviews, per_product)
+    if mode == "dicts":
+        all_reviews = []
+        for batch in batches:
+            for product in batch:
+                all_reviews.extend(legacy_extract(product))
+        rows = len(pd.DataFrame(all_reviews))
+    elif mode == "columns":
+        rows = len(pd.DataFrame(review_columns(product for batch in batches for product in batch)))
+    else:
+        histogram = Counter(review.rating for batch in batches for product in batch for review in iter_reviews(product))
+        rows = sum(histogram.values())
+    seconds = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return f"{mode:>8}: {rows:,} reviews in {seconds:6.1f} s, peak RSS {peak_mb:8.0f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark review extraction on synthetic products.")
+    parser.add_argument("--reviews", type=int, default=5_000_000, help="Number of synthetic reviews")
+    parser.add_argument("--per-product", type=int, default=8, help="Reviews embedded in each product")
+    parser.add_argument("--mode", choices=MODES, help="Run one mode in this process")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(run(args.mode, args.reviews, args.per_product), flush=True)
+        return
+    for mode in MODES:
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.review_extraction", "--mode", mode,
+             "--reviews", str(args.reviews), "--per-product", str(args.per_product)],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# benchmarks/review_search.py
+#
+# Builds the review search index over synthetic products and times queries with common and
+# rare terms, with and without filters.
+#
+# Run from the backend directory:
+#     python -m benchmarks.review_search --reviews 1000000
+
+import argparse
+import random
+import statistics
+import string
+import time
+
+from app.review_search import ReviewIndex
+
+REVIEWS_PER_PRODUCT = 4
+WORDS_PER_REVIEW = 20
+COMMON_WORDS = ["good", "great", "bad", "quality", "product", "value", "cheap", "works"]
+
+
+def synthetic_product(number: int, vocabulary, rng) -> dict:
+    reviews = range(REVIEWS_PER_PRODUCT)
+    return {
+        "_id": f"{number:024x}",
+        "category": rng.choice(["Electronics|Phones", "Home&Kitchen|Fans", "Toys&Games|Puzzles"]),
+        "rating": str(round(rng.uniform(1, 5), 1)),
+        "review_id": ",".join(f"R{number}_{i}" for i in reviews),
+        "user_id": ",".join(f"U{number}_{i}" for i in reviews),
+        "user_name": ",".join(f"user{i}" for i in reviews),
+        "review_title": ",".join(rng.choice(COMMON_WORDS) for _ in reviews),
+        "review_content": ",".join(" ".join(rng.choices(vocabulary, k=WORDS_PER_REVIEW)) for _ in reviews),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the in-process review search index.")
+    parser.add_argument("--reviews", type=int, default=1_000_000, help="Number of synthetic reviews")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per query")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    rare = ["".join(rng.choices(string.ascii_lowercase, k=8)) for _ in range(20000)]
+    # Common words make up about a third of the text
+    vocabulary = rare + COMMON_WORDS * 1000
+
+    index = ReviewIndex()
+    started = time.perf_counter()
+    for number in range(args.reviews // REVIEWS_PER_PRODUCT):
+        index.add_product(synthetic_product(number, vocabulary, rng))
+    print(f"Indexed {index.live_docs:,} reviews ({len(index.postings):,} terms) in {time.perf_counter() - started:.1f} s")
+
+    queries = {
+        "rare terms": dict(query=f"{rare[17]} {rare[99]}"),
+        "common terms": dict(query="good quality"),
+        "common terms, rating >= 4": dict(query="good quality", min_rating=4.0),
+        "common terms, category, page 5": dict(query="great value", categories=["Toys&Games"], offset=40),
+    }
+    for name, query in queries.items():
+        durations = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            total, _ = index.search(**query)
+            durations.append(time.perf_counter() - started)
+        durations.sort()
+        print(
+            f"{name:>32}: {total:>9,} matches, p50 {statistics.median(durations) * 1000:6.1f} ms, "
+            f"max {durations[-1] * 1000:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/sharded_aggregates.py
+#
+# Times the mergeable aggregations (app/partial_aggregates.py) reduced three ways:
+#   - single:  every batch mapped and combined in this process, as one cursor would;
+#   - sharded: the shards reduced on the worker pool with run_local, partials combined here;
+#   - hosts:   each shard's partial encoded to JSON and back, then combined, as partials shipped
+#              from separate hosts through /analytics/partials would be.
+# That the three agree is checked by tests/test_partial_aggregates.py. Needs no database: the
+# products are synthetic and held in memory.
+# Run from the backend directory:
+#     python -m benchmarks.sharded_aggregates --products 200000 --shards 4
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from app.partial_aggregates import (
+    PRICE_TREND_CLEANERS,
+    CorrelationAggregation,
+    PriceBucketAggregation,
+    aggregations,
+    combine_encoded,
+    run_local,
+)
+
+# The synthetic unparsable values would log a warning per batch; runs again in each worker
+logging.disable(logging.CRITICAL)
+
+CATEGORIES = [
+    "Electronics|Phones", "Electronics|Audio", "Home&Kitchen|Appliances",
+    "Computers|Accessories", "Computers|Mice", "OfficeProducts",
+]
+
+
+def product(number: int) -> dict:
+    # Strings shaped like the imported catalogue, with some missing and unparsable values
+    price = 199 + number * 37 % 60_000
+    discount = number % 90
+    document = {
+        "product_id": f"B{number:09d}",
+        "product_name": f"Product {number}",
+        "category": CATEGORIES[number % len(CATEGORIES)],
+        "actual_price": f"₹{price:,}",
+        "discounted_price": f"₹{price * (100 - discount) // 100:,}",
+        "discount_percentage": f"{discount}%" if number % 17 else "n/a",
+        "rating": str(1 + number * 7 % 41 / 10) if number % 23 else "|",
+        "rating_count": f"{number * 13 % 100_000:,}",
+        "inventory": number * 7 % 120,
+    }
+    if number % 5 == 0:
+        document["cost_price"] = price * 0.6
+    return document
+
+
+def reduce_here(aggregation, documents: list, batch_size: int):
+    partial = aggregation.empty()
+    for start in range(0, len(documents), batch_size):
+        part = aggregation.map(documents[start:start + batch_size])
+        if part is not None:
+            partial = aggregation.combine(partial, part)
+    return partial
+
+
+async def run(products: int, shards: int, batch_size: int):
+    documents = [product(number) for number in range(products)]
+    size = -(-products // shards)
+    parts = [documents[start:start + size] for start in range(0, products, size)]
+
+    checked = dict(aggregations())
+    checked['price_buckets_edges'] = PriceBucketAggregation([0, 1000, 5000, 20000])
+    checked['correlation_by_category'] = CorrelationAggregation(PRICE_TREND_CLEANERS, by_category=True)
+
+    for name, aggregation in checked.items():
+        started = time.perf_counter()
+        aggregation.finalize(reduce_here(aggregation, documents, batch_size))
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        aggregation.finalize(await run_local(aggregation, parts, batch_size))
+        parallel = time.perf_counter() - started
+
+        started = time.perf_counter()
+        encoded = [json.loads(json.dumps(aggregation.encode(reduce_here(aggregation, part, batch_size)))) for part in parts]
+        aggregation.finalize(combine_encoded(aggregation, encoded))
+        hosts = time.perf_counter() - started
+
+        print(
+            f"{name:>24}: single {single:6.2f} s, {len(parts)} shards {parallel:6.2f} s, "
+            f"{len(parts)} hosts (serial) {hosts:6.2f} s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time sharded mergeable aggregations.")
+    parser.add_argument("--products", type=int, default=200_000, help="Synthetic products")
+    parser.add_argument("--shards", type=int, default=4, help="Shards to split them into")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Documents per map call")
+    args = parser.parse_args()
+    asyncio.run(run(args.products, args.shards, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# benchmarks/startup.py
+#
+# Measures the cold-start cost of an API worker: the wall time to import
+# app.main in a fresh interpreter and the resident set size right after.
+#
+# Run from the backend directory:
+#     python -m benchmarks.startup --runs 5
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Executed in a fresh interpreter for every run so module caches never leak between runs
+CHILD_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+# ru_maxrss is reported in kilobytes on Linux
+rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+heavy = [name for name in ('pandas', 'sklearn') if name in sys.modules]
+print(json.dumps({'seconds': elapsed, 'rss_mb': rss_mb, 'heavy_modules': heavy}))
+"""
+
+
+def run_once(analytics_enabled: bool) -> dict:
+    env = dict(os.environ)
+    env["DASHBOARD_ANALYTICS_ENABLED"] = "1" if analytics_enabled else "0"
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API worker cold start time and baseline RSS.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters per configuration")
+    args = parser.parse_args()
+
+    for analytics_enabled in (True, False):
+        results = [run_once(analytics_enabled) for _ in range(args.runs)]
+        seconds = [r["seconds"] for r in results]
+        rss = [r["rss_mb"] for r in results]
+        label = "analytics mounted" if analytics_enabled else "CRUD only"
+        print(
+            f"{label:>18}: import median {statistics.median(seconds) * 1000:.0f} ms "
+            f"(min {min(seconds) * 1000:.0f} ms), RSS median {statistics.median(rss):.1f} MB, "
+            f"heavy modules loaded: {results[-1]['heavy_modules'] or 'none'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
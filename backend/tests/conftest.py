@@ -0,0 +1,16 @@
+# tests/conftest.py
+#
+# The tests run against an in-memory MongoDB (mongomock_motor) instead of the configured cluster,
+# so the client is swapped before app.database creates it; the configured URI is ignored, since
+# resolving a mongodb+srv:// one needs DNS. Run from the backend directory:
+#     python -m pytest -q
+
+import os
+import sys
+
+import motor.motor_asyncio
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
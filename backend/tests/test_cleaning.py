@@ -0,0 +1,65 @@
+# tests/test_cleaning.py
+#
+# The column cleaners must give what the scalar helpers give, value for value.
+
+import math
+import random
+
+import pytest
+
+from app.cleaning import clean_number, clean_number_column, safe_float_column, safe_float_conversion
+
+# Inputs the two paths have disagreed on, and the shapes of the imported catalogue
+EDGE_CASES = [
+    None, "", " ", 0, 0.0, "0", "0.0", 5, 4.2, -3.5, True, False, float("nan"), float("inf"),
+    "nan", "inf", "-inf", "1e5", "1E-3", "-5", "+3", " 7 ", ".", "..", "12.5.3", "1_000", "1_0",
+    "_1", "1__0", "١٢", "٣.٥", "１２", "²", "₹1,299", "₹ 1,09,999.50", "45%", "|", "4.1",
+    "rating: 4.5 stars", "9" * 400, "0.1" * 5, 10 ** 20, 1e-7, b"5",
+]
+
+ALPHABET = "0123456789" + "٠١٢٣٤٥٦٧٨٩" + "０１２" + "..,,_-+eE% ₹|ab"
+
+
+def fuzzed(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    values = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.8:
+            values.append("".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 12))))
+        elif kind < 0.9:
+            values.append(rng.uniform(-1e6, 1e6))
+        else:
+            values.append(rng.randint(-1000, 1000))
+    return values
+
+
+def same(expected, actual) -> bool:
+    if expected is None or actual is None:
+        return expected is None and actual is None
+    if math.isinf(expected) or math.isinf(actual):
+        return expected == actual
+    # pandas' string parser may round a 17-digit decimal to the neighbouring float
+    return abs(expected - actual) <= math.ulp(expected)
+
+
+@pytest.mark.parametrize("scalar, column", [
+    (clean_number, clean_number_column),
+    (safe_float_conversion, safe_float_column),
+])
+def test_column_cleaner_matches_scalar_helper(scalar, column):
+    values = EDGE_CASES + fuzzed(5000)
+    cleaned = column(values, "fuzzed").to_list()
+    differences = [
+        (value, scalar(value), actual) for value, actual in zip(values, cleaned) if not same(scalar(value), actual)
+    ]
+    assert differences == []
+
+
+@pytest.mark.parametrize("column", [clean_number_column, safe_float_column])
+def test_rejected_counts_only_non_empty_inputs(column):
+    result = column([None, "", 0, "abc.def", "12"])
+    assert result.to_list()[:3] == [None, None, None]
+    assert result.to_list()[4] == 12.0
+    # 'abc.def' is the only non-empty input that could not be converted
+    assert result.rejected == 1
@@ -0,0 +1,246 @@
+# tests/test_duckdb_engine.py
+#
+# The DuckDB engine must answer like the pandas and MongoDB paths it replaces: the summary and
+# sentiment rows like their aggregations over the raw documents, price_discount_analysis like
+# the price buckets (up to the discount sketch's medians), and top_products like the endpoint's
+# pandas code over the snapshot and over MongoDB.
+
+import asyncio
+import gc
+import inspect
+import random
+import re
+import threading
+
+import pytest
+from bson import ObjectId
+
+from app import duckdb_engine
+from app.cleaning import safe_float_conversion
+from app.config import DISCOUNT_SKETCH_RESOLUTION, PRICE_BUCKET_EDGES
+from app.database import product_collection
+from app.partial_aggregates import (
+    PriceBucketAggregation,
+    SentimentCountsAggregation,
+    SummaryAggregation,
+    sentiment_distribution_of,
+)
+from app.routers import analytics
+from app.snapshot import AnalyticsSnapshot, LiveTable, product_table, review_schema
+
+CATEGORIES = [
+    "Electronics|Phones|Smartphones", "Electronics|Cables", "Home&Kitchen|Fans", " Home&Kitchen | Heaters",
+    "Toys & Games (Kids)|Puzzles", "Computers", None,
+]
+# Raw values as the imported catalogue has them, missing and unparsable ones included
+PRICES = ["₹{:,}", "{}", "{}.50", float("nan"), None, "N/A", ""]
+RATINGS = ["4.2", "3.9", "5", "1.0", "2.5", "", None, "0", "abc", 4.4, float("nan")]
+
+
+def products(count: int = 400, seed: int = 3) -> list:
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        price = rng.randint(50, 60000)
+        formats = rng.choices(PRICES, weights=[6, 3, 2, 1, 1, 1, 1])[0]
+        actual_price = formats.format(price) if isinstance(formats, str) and "{" in formats else formats
+        discount = rng.randint(0, 90)
+        documents.append({
+            "_id": ObjectId(),
+            "product_id": f"P{i:04d}",
+            "product_name": f"Product {i}",
+            "category": rng.choice(CATEGORIES),
+            "actual_price": actual_price,
+            "discounted_price": rng.choice([f"₹{price * (100 - discount) // 100:,}", None]),
+            "discount_percentage": rng.choice([f"{discount}%", f"{discount}%", f"{discount}%", None, float("nan")]),
+            "rating": rng.choice(RATINGS),
+            # Distinct, so every sort order is total
+            "rating_count": rng.choice([f"{1000 + i * 7:,}", f"{1000 + i * 7:,}", None]),
+        })
+    return documents
+
+
+def snapshot_of(documents: list) -> AnalyticsSnapshot:
+    return AnalyticsSnapshot("test", None, product_table(documents), review_schema().empty_table())
+
+
+def reduce(aggregation, documents: list):
+    return aggregation.finalize(aggregation.map(documents))
+
+
+def approx(value):
+    return pytest.approx(value, rel=1e-9, abs=1e-9, nan_ok=True)
+
+
+@pytest.fixture
+def documents():
+    return products()
+
+
+def test_summary_matches_the_aggregation(documents):
+    expected = reduce(SummaryAggregation(10, 20), documents)
+    actual = asyncio.run(duckdb_engine.summary(snapshot_of(documents), 10, 20))
+
+    for field in ('total_products', 'total_sales', 'total_revenue', 'total_profit', 'rating_histogram'):
+        assert actual[field] == approx(expected[field]), field
+    assert list(actual['category_stats']) == list(expected['category_stats'])
+    for category, stats in expected['category_stats'].items():
+        assert actual['category_stats'][category] == approx(stats), category
+    assert actual['top_selling_products'] == [approx(product) for product in expected['top_selling_products']]
+    # The aggregation passes the stored rating through; the snapshot holds it cleaned
+    assert actual['rating_stats'] == [
+        approx({**product, 'rating': safe_float_conversion(product['rating'])}) for product in expected['rating_stats']
+    ]
+
+
+def test_sentiment_rows_match_the_rollup_grouping(documents):
+    expected = reduce(SentimentCountsAggregation(), documents)
+    actual = sentiment_distribution_of(asyncio.run(duckdb_engine.sentiment_rows(snapshot_of(documents))))
+    assert actual == [approx(row) for row in expected]
+
+
+def assert_same_stats(actual: dict, expected: dict):
+    actual, expected = dict(actual), dict(expected)
+    # The buckets read medians from the discount sketch; the engine's are exact
+    median = expected.pop('median_discount_percentage')
+    assert actual.pop('median_discount_percentage') == pytest.approx(median, abs=DISCOUNT_SKETCH_RESOLUTION)
+    assert actual == approx(expected)
+
+
+def assert_price_analysis_matches(expected: dict, actual: dict):
+    assert_same_stats(actual['overall_stats'], expected['overall_stats'])
+    assert len(actual['per_price_range_stats']) == len(expected['per_price_range_stats'])
+    for got, want in zip(actual['per_price_range_stats'], expected['per_price_range_stats']):
+        assert_same_stats(got, want)
+    for field, correlations in expected['price_discount_correlation'].items():
+        assert actual['price_discount_correlation'][field] == pytest.approx(correlations, rel=1e-6)
+
+
+@pytest.mark.parametrize("edges", [PRICE_BUCKET_EDGES, [500, 1000, 20000]])
+def test_price_discount_analysis_matches_the_buckets(documents, edges):
+    expected = reduce(PriceBucketAggregation(edges), documents)
+    actual = asyncio.run(duckdb_engine.price_discount_analysis(snapshot_of(documents), edges))
+    assert_price_analysis_matches(expected, actual)
+
+
+def test_price_discount_analysis_skips_nan_and_null_prices():
+    documents = products(60)
+    for document, price in zip(documents, [float("nan"), None, "", "N/A"]):
+        document['actual_price'], document['discount_percentage'] = price, "30%"
+    priced = [
+        document for document in documents
+        if document['actual_price'] not in (None, "", "N/A") and document['actual_price'] == document['actual_price']
+        and isinstance(document['discount_percentage'], str)
+    ]
+    actual = asyncio.run(duckdb_engine.price_discount_analysis(snapshot_of(documents), PRICE_BUCKET_EDGES))
+    assert actual['overall_stats']['total_products'] == len(priced)
+    assert_price_analysis_matches(reduce(PriceBucketAggregation(), documents), actual)
+
+
+def test_constant_discount_has_no_correlation():
+    documents = products(50)
+    for document in documents:
+        document['discount_percentage'] = "40%"
+    expected = reduce(PriceBucketAggregation(), documents)
+    actual = asyncio.run(duckdb_engine.price_discount_analysis(snapshot_of(documents), PRICE_BUCKET_EDGES))
+    assert actual['price_discount_correlation']['actual_price']['discount_percentage'] is None
+    assert expected['price_discount_correlation']['actual_price']['discount_percentage'] is None
+    assert actual['overall_stats']['std_discount_percentage'] == approx(expected['overall_stats']['std_discount_percentage'])
+
+
+def test_price_discount_analysis_without_priced_products():
+    documents = products(20)
+    for document in documents:
+        document['actual_price'] = None
+    assert asyncio.run(duckdb_engine.price_discount_analysis(snapshot_of(documents), PRICE_BUCKET_EDGES)) is None
+
+
+async def _columns_from_mongo(collection, fields, endpoint, query=None):
+    # mongomock cannot return the RawBSONDocument batches fetch_columns reads
+    columns = {field: [] for field in fields}
+    async for document in collection.find(query or {}, {field: 1 for field in fields}):
+        for field in fields:
+            columns[field].append(document.get(field))
+    return columns
+
+
+def pandas_top_products(monkeypatch, snapshot, documents, **arguments):
+    """
+    The endpoint's own answer with the pandas engine, over the snapshot if given, else MongoDB.
+    """
+    async def no_engine():
+        return None
+
+    async def current():
+        return snapshot
+
+    async def run():
+        await product_collection.delete_many({})
+        await product_collection.insert_many(documents)
+        return await inspect.unwrap(analytics.top_products)(**arguments)
+
+    monkeypatch.setattr(analytics, '_engine_snapshot', no_engine)
+    monkeypatch.setattr(analytics, 'current_snapshot', current)
+    monkeypatch.setattr(analytics, 'fetch_columns', _columns_from_mongo)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("sort_by", ['popularity_score', 'total_sales', 'profit'])
+@pytest.mark.parametrize("categories", [None, ["Home&Kitchen"], ["toys & games (kids)", "cables"], ["Nothing|Here"]])
+@pytest.mark.parametrize("from_snapshot", [True, False])
+def test_top_products_match_the_pandas_path(monkeypatch, documents, sort_by, categories, from_snapshot):
+    snapshot = snapshot_of(documents)
+    arguments = dict(categories=categories, min_rating=2.0, max_rating=4.5, sort_by=sort_by, page=1, page_size=len(documents))
+    expected = pandas_top_products(monkeypatch, snapshot if from_snapshot else None, documents, **arguments)
+
+    regex = '|'.join(re.escape(category) for category in categories) if categories else None
+    actual = asyncio.run(duckdb_engine.top_products(snapshot, regex, 2.0, 4.5, sort_by, 1, len(documents)))
+
+    assert actual['total_count'] == expected['total_count']
+    assert [product['product_id'] for product in actual['products']] == [product['product_id'] for product in expected['products']]
+    for got, want in zip(actual['products'], expected['products']):
+        assert got == approx(want)
+    if categories == ["Nothing|Here"]:
+        assert actual['total_count'] == 0
+
+
+def test_top_products_pages(monkeypatch, documents):
+    snapshot = snapshot_of(documents)
+    first = asyncio.run(duckdb_engine.top_products(snapshot, None, None, None, 'total_sales', 1, 7))
+    second = asyncio.run(duckdb_engine.top_products(snapshot, None, None, None, 'total_sales', 2, 7))
+    expected = pandas_top_products(
+        monkeypatch, snapshot, documents,
+        categories=None, min_rating=None, max_rating=None, sort_by='total_sales', page=2, page_size=7,
+    )
+    assert first['total_count'] == second['total_count'] == expected['total_count']
+    assert [product['product_id'] for product in second['products']] == [product['product_id'] for product in expected['products']]
+    assert not {product['product_id'] for product in first['products']} & {product['product_id'] for product in second['products']}
+
+
+def test_each_snapshot_is_queried_for_its_own_products():
+    # A snapshot freed before the next is made often leaves it its id(); each must still get its own table
+    for count in range(1, 30):
+        snapshot = snapshot_of(products(count, seed=count))
+        assert asyncio.run(duckdb_engine.summary(snapshot, 10, 5))['total_products'] == count
+        del snapshot
+        gc.collect()
+
+
+def test_product_table_is_derived_off_the_event_loop(monkeypatch, documents):
+    threads = []
+    to_table = LiveTable.to_table
+
+    def recording_to_table(self, columns):
+        threads.append(threading.get_ident())
+        return to_table(self, columns)
+
+    monkeypatch.setattr(LiveTable, 'to_table', recording_to_table)
+    snapshot = snapshot_of(documents)
+
+    async def query_twice():
+        await asyncio.gather(duckdb_engine.summary(snapshot, 10, 5), duckdb_engine.sentiment_rows(snapshot))
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(query_twice())
+    # Derived once for both queries, in a worker thread
+    assert len(threads) == 1 and threads[0] != loop_thread
@@ -0,0 +1,222 @@
+# tests/test_jobs.py
+#
+# The job lifecycle of app/jobs.py: claiming, sharing identical jobs, lease expiry and takeover,
+# requeueing jobs refused by admission control, and giving up after JOB_MAX_ATTEMPTS. The task
+# endpoints are replaced by stand-ins, so only the bookkeeping runs.
+
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from app import jobs
+from app.database import analytics_job_collection
+
+
+@pytest.fixture(autouse=True)
+def job_collection():
+    async def reset():
+        await analytics_job_collection.drop()
+        await jobs.create_indexes()
+
+    asyncio.run(reset())
+    yield analytics_job_collection
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    """
+    Replaces every task's endpoint with `endpoint.run`, which the test sets.
+    """
+    class Endpoint:
+        calls = 0
+
+        async def run(self, **params):
+            return {"params": params}
+
+    stand_in = Endpoint()
+
+    async def call(**params):
+        stand_in.calls += 1
+        return await stand_in.run(**params)
+
+    monkeypatch.setattr(jobs, '_endpoint', lambda task: call)
+    return stand_in
+
+
+async def expire_lease(job_id: str):
+    await analytics_job_collection.update_one(
+        {"_id": job_id}, {"$set": {"lease_until": jobs._now() - timedelta(seconds=1)}}
+    )
+
+
+def test_claim_takes_the_oldest_due_job_once():
+    async def scenario():
+        first, _ = await jobs.submit_job('summary', {'rating_bins': 5})
+        second, _ = await jobs.submit_job('summary', {'rating_bins': 6})
+        claimed = await jobs._claim("w1")
+        assert claimed["_id"] == first["_id"]
+        assert (claimed["status"], claimed["worker"], claimed["attempts"]) == ("running", "w1", 1)
+        assert claimed["lease_until"] > claimed["started_at"]
+        assert (await jobs._claim("w2"))["_id"] == second["_id"]
+        assert await jobs._claim("w3") is None
+
+    asyncio.run(scenario())
+
+
+def test_claim_waits_for_not_before():
+    async def scenario():
+        job, _ = await jobs.submit_job('summary')
+        await analytics_job_collection.update_one(
+            {"_id": job["_id"]}, {"$set": {"not_before": jobs._now() + timedelta(minutes=5)}}
+        )
+        assert await jobs._claim("w1") is None
+
+    asyncio.run(scenario())
+
+
+def test_identical_jobs_share_one_active_key(endpoint):
+    async def scenario():
+        job, created = await jobs.submit_job('summary', {})
+        # The defaults are filled in, so spelling them out is the same job
+        same, created_again = await jobs.submit_job('summary', {'rating_bins': job['params']['rating_bins']})
+        other, created_other = await jobs.submit_job('summary', {'rating_bins': 3})
+        assert created and not created_again and created_other
+        assert same["_id"] == job["_id"] != other["_id"]
+        assert await analytics_job_collection.count_documents({"active_key": job["active_key"]}) == 1
+
+        # Still shared while running; released when finished
+        claimed = await jobs._claim("w1")
+        assert claimed["_id"] == job["_id"]
+        assert (await jobs.submit_job('summary', {}))[0]["_id"] == job["_id"]
+        await jobs._run(claimed, "w1")
+        finished = await jobs.get_job(job["_id"])
+        assert finished["status"] == "succeeded" and "active_key" not in finished
+        assert finished["result"] == {"params": job["params"]}
+        assert finished["progress"]["fraction"] == 1.0
+
+        again, created = await jobs.submit_job('summary', {})
+        assert created and again["_id"] != job["_id"]
+
+    asyncio.run(scenario())
+
+
+def test_invalid_params_are_rejected():
+    with pytest.raises(ValueError):
+        asyncio.run(jobs.submit_job('summary', {'rating_bins': 0}))
+    with pytest.raises(ValueError):
+        asyncio.run(jobs.submit_job('summary', {'unknown': 1}))
+    with pytest.raises(ValueError):
+        asyncio.run(jobs.submit_job('no_such_task'))
+
+
+def test_expired_lease_is_claimed_again():
+    async def scenario():
+        job, _ = await jobs.submit_job('summary')
+        first = await jobs._claim("w1")
+        # Leased: nobody else gets it
+        assert await jobs._claim("w2") is None
+
+        await expire_lease(job["_id"])
+        taken = await jobs._claim("w2")
+        assert taken["_id"] == job["_id"]
+        assert (taken["worker"], taken["attempts"]) == ("w2", 2)
+
+        # The first worker no longer holds the job, so its outcome is dropped
+        assert not await jobs._finish(first, "w1", {"status": "succeeded", "result": "stale"})
+        assert await jobs._finish(taken, "w2", {"status": "succeeded", "result": "fresh"})
+        assert (await jobs.get_job(job["_id"]))["result"] == "fresh"
+
+    asyncio.run(scenario())
+
+
+def test_worker_stops_a_job_it_lost(monkeypatch, endpoint):
+    monkeypatch.setattr(jobs, 'JOB_LEASE_SECONDS', 0.3)
+    cancelled = asyncio.Event()
+
+    async def forever(**params):
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    endpoint.run = forever
+
+    async def scenario():
+        job, _ = await jobs.submit_job('summary')
+        claimed = await jobs._claim("w1")
+        running = asyncio.ensure_future(jobs._run(claimed, "w1"))
+        await asyncio.sleep(0.05)
+        # Another worker takes the job over, as after an expired lease
+        await analytics_job_collection.update_one({"_id": job["_id"]}, {"$set": {"worker": "w2"}})
+        await asyncio.wait_for(running, 2)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert (await jobs.get_job(job["_id"]))["status"] == "running"
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("status_code", jobs.RETRY_STATUS_CODES)
+def test_refused_job_is_requeued_without_an_attempt(endpoint, status_code):
+    async def busy(**params):
+        raise HTTPException(status_code=status_code, detail="busy")
+
+    endpoint.run = busy
+
+    async def scenario():
+        job, _ = await jobs.submit_job('summary')
+        for _ in range(jobs.JOB_MAX_ATTEMPTS + 2):
+            claimed = await jobs._claim("w1")
+            await jobs._run(claimed, "w1")
+            requeued = await jobs.get_job(job["_id"])
+            assert requeued["status"] == "pending"
+            assert requeued["attempts"] == 0
+            assert "worker" not in requeued and "lease_until" not in requeued
+            assert requeued["active_key"] == job["active_key"]
+            # Not due until JOB_RETRY_DELAY has passed
+            assert await jobs._claim("w1") is None
+            await analytics_job_collection.update_one({"_id": job["_id"]}, {"$set": {"not_before": jobs._now()}})
+
+    asyncio.run(scenario())
+
+
+def test_failing_job_is_not_retried(endpoint):
+    async def broken(**params):
+        raise HTTPException(status_code=500, detail="Failed to fetch product data.")
+
+    endpoint.run = broken
+
+    async def scenario():
+        job, _ = await jobs.submit_job('summary')
+        await jobs._run(await jobs._claim("w1"), "w1")
+        failed = await jobs.get_job(job["_id"])
+        assert (failed["status"], failed["error"]) == ("failed", "Failed to fetch product data.")
+        assert "active_key" not in failed
+        assert await jobs._claim("w1") is None
+
+    asyncio.run(scenario())
+
+
+def test_gives_up_after_max_attempts(monkeypatch, endpoint):
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 2)
+
+    async def scenario():
+        job, _ = await jobs.submit_job('summary')
+        # Each worker dies holding the job: its lease runs out and the job is claimed again
+        for attempt in range(1, 3):
+            claimed = await jobs._claim(f"w{attempt}")
+            assert claimed["attempts"] == attempt
+            await expire_lease(job["_id"])
+
+        last = await jobs._claim("w3")
+        assert last["attempts"] == 3
+        await jobs._run(last, "w3")
+        failed = await jobs.get_job(job["_id"])
+        assert failed["status"] == "failed"
+        assert failed["error"] == "Gave up after 2 attempts."
+        assert "active_key" not in failed
+        assert endpoint.calls == 0
+
+    asyncio.run(scenario())
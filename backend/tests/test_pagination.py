@@ -0,0 +1,71 @@
+# tests/test_pagination.py
+#
+# Keyset pagination (app/pagination.py): cursors keep the BSON types of the sort values, and
+# paging through a listing returns every document once, in order, whatever the sort values are,
+# missing and null ones included.
+
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.database import database
+from app.models import User
+from app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, list_page
+
+SORT = ["user_name", "_id"]
+
+
+def test_cursor_keeps_the_types_of_its_values():
+    values = [datetime(2024, 5, 1, 12, 30, 15, 250000), 42, 4.5, "name", None, ObjectId()]
+    keys = ["a", "b", "c", "d", "e", "_id"]
+    assert decode_cursor(encode_cursor(values), keys) == values
+    assert [type(value) for value in decode_cursor(encode_cursor(values), keys)] == [type(value) for value in values]
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", encode_cursor(["a"]), encode_cursor(["a", "b"]), encode_cursor(["a", str(ObjectId())])])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, SORT)
+
+
+@pytest.fixture
+def users():
+    collection = database.get_collection("pagination_test_users")
+    documents = [
+        {"_id": ObjectId()},
+        {"_id": ObjectId(), "user_name": None},
+        {"_id": ObjectId(), "user_name": "ann"},
+        {"_id": ObjectId()},
+        {"_id": ObjectId(), "user_name": "bob"},
+        {"_id": ObjectId(), "user_name": None},
+        {"_id": ObjectId(), "user_name": "ann"},
+        {"_id": ObjectId(), "user_name": "cy"},
+    ]
+
+    async def reset():
+        await collection.drop()
+        await collection.insert_many(documents)
+
+    asyncio.run(reset())
+    return collection, documents
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 10])
+def test_pages_cover_the_listing_once(users, limit):
+    collection, documents = users
+
+    async def read_all():
+        ids, cursor = [], None
+        while True:
+            response = await list_page(collection, User, {}, SORT, cursor, limit, "user_name")
+            ids += [item["_id"] for item in json.loads(response.body)]
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if cursor is None:
+                return ids
+
+    # Missing and null names sort first, together, by _id
+    expected = sorted(documents, key=lambda user: (user.get("user_name") is not None, user.get("user_name") or "", user["_id"]))
+    assert asyncio.run(read_all()) == [str(user["_id"]) for user in expected]
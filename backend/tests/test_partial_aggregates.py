@@ -0,0 +1,132 @@
+# tests/test_partial_aggregates.py
+#
+# Every mergeable aggregation (app/partial_aggregates.py) must give the same result however the
+# catalogue is split: one batch, many batches, shards reduced on the worker pool with run_local,
+# or shards encoded to JSON and combined as partials shipped from other hosts would be. Results
+# agree up to the order floats are summed in.
+
+import asyncio
+import json
+import math
+
+import pytest
+
+from app.partial_aggregates import (
+    PRICE_TREND_CLEANERS,
+    CorrelationAggregation,
+    PriceBucketAggregation,
+    aggregations,
+    combine_encoded,
+    run_local,
+)
+
+CATEGORIES = [
+    "Electronics|Phones", "Electronics|Audio", "Home&Kitchen|Appliances", "Computers|Accessories",
+    "Computers|Mice", "OfficeProducts", None, "",
+]
+
+
+def product(number: int) -> dict:
+    # Strings shaped like the imported catalogue, with some missing and unparsable values
+    price = 199 + number * 37 % 60_000
+    discount = number % 90
+    document = {
+        "product_id": f"B{number:09d}",
+        "product_name": f"Product {number}",
+        "category": CATEGORIES[number % len(CATEGORIES)],
+        "actual_price": f"₹{price:,}" if number % 29 else float("nan"),
+        "discounted_price": f"₹{price * (100 - discount) // 100:,}" if number % 31 else None,
+        "discount_percentage": f"{discount}%" if number % 17 else "n/a",
+        "rating": str(1 + number * 7 % 41 / 10) if number % 23 else "|",
+        "rating_count": f"{number * 13 % 100_000:,}",
+        "inventory": number * 7 % 120,
+    }
+    if number % 5 == 0:
+        document["cost_price"] = price * 0.6
+    return document
+
+
+def unusable(number: int) -> dict:
+    # Contributes to no statistic but the product counts
+    return {"product_id": f"X{number}", "category": None, "actual_price": None, "rating": "", "rating_count": "n/a"}
+
+
+def same(expected, actual, path: str = "") -> list:
+    """
+    The paths where two results differ, comparing floats with a relative tolerance.
+    """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if list(expected) != list(actual):
+            return [f"{path}: keys {list(expected)[:5]} != {list(actual)[:5]}"]
+        return [d for key in expected for d in same(expected[key], actual[key], f"{path}/{key}")]
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return [f"{path}: {len(expected)} != {len(actual)} items"]
+        return [d for index, pair in enumerate(zip(expected, actual)) for d in same(*pair, f"{path}[{index}]")]
+    if isinstance(expected, float) and isinstance(actual, float):
+        if math.isnan(expected) and math.isnan(actual):
+            return []
+        return [] if math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-9) else [f"{path}: {expected} != {actual}"]
+    return [] if expected == actual else [f"{path}: {expected!r} != {actual!r}"]
+
+
+def reduce_here(aggregation, documents: list, batch_size: int):
+    partial = aggregation.empty()
+    for start in range(0, len(documents), batch_size):
+        part = aggregation.map(documents[start:start + batch_size])
+        if part is not None:
+            partial = aggregation.combine(partial, part)
+    return partial
+
+
+CHECKED = {
+    **aggregations(),
+    'price_buckets_edges': PriceBucketAggregation([0, 1000, 5000, 20000]),
+    'price_buckets_open_ended': PriceBucketAggregation([500, 2500]),
+    'correlation_by_category': CorrelationAggregation(by_category=True),
+    'price_trend_correlation_by_category': CorrelationAggregation(PRICE_TREND_CLEANERS, by_category=True),
+}
+
+
+@pytest.fixture(scope="module")
+def shards():
+    documents = [product(number) for number in range(3000)]
+    # Uneven shards, one of which holds nothing usable
+    return [documents[:1700], [unusable(number) for number in range(40)], documents[1700:2900], documents[2900:]]
+
+
+@pytest.mark.parametrize("name", list(CHECKED))
+def test_split_reductions_agree(shards, name):
+    aggregation = CHECKED[name]
+    documents = [document for shard in shards for document in shard]
+    expected = aggregation.finalize(reduce_here(aggregation, documents, len(documents)))
+
+    batched = aggregation.finalize(reduce_here(aggregation, documents, 137))
+    assert same(expected, batched) == []
+
+    sharded = aggregation.finalize(asyncio.run(run_local(aggregation, shards, 250)))
+    assert same(expected, sharded) == []
+
+    encoded = [json.loads(json.dumps(aggregation.encode(reduce_here(aggregation, shard, 250)))) for shard in shards]
+    assert same(expected, aggregation.finalize(combine_encoded(aggregation, encoded))) == []
+
+
+def test_correlation_by_category_covers_each_main_category(shards):
+    result = CHECKED['correlation_by_category'].finalize(
+        reduce_here(CHECKED['correlation_by_category'], [document for shard in shards for document in shard], 500)
+    )
+    assert set(result) == {"overall", "by_category"}
+    assert set(result["by_category"]) == {"Electronics", "Home&Kitchen", "Computers", "OfficeProducts", "Unknown"}
+
+
+def test_price_buckets_reject_edges_off_the_grid(shards):
+    aggregation = PriceBucketAggregation([0, 1234])
+    with pytest.raises(ValueError):
+        aggregation.finalize(reduce_here(aggregation, shards[0], 500))
+
+
+def test_empty_catalogue(shards):
+    for name, aggregation in CHECKED.items():
+        assert same(aggregation.finalize(aggregation.empty()), aggregation.finalize(
+            combine_encoded(aggregation, [json.loads(json.dumps(aggregation.encode(aggregation.empty())))])
+        )) == [], name
@@ -0,0 +1,71 @@
+# tests/test_partitioned_scan.py
+#
+# Both paths of scan_aggregate (app/partitioned_scan.py) reduce like _reduce_batches: a partition
+# read in a worker process, here with its client replaced by one serving raw documents from
+# memory, and the single cursor, whose batches are mapped off the event loop's thread.
+
+import asyncio
+import threading
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+from app import partitioned_scan
+from app.database import product_collection
+
+DOCUMENTS = [{"_id": number, "price": float(number % 37)} for number in range(1000)]
+
+
+def total(batch: list) -> dict:
+    return {"count": len(batch), "sum": sum(document["price"] for document in batch), "threads": {threading.get_ident()}}
+
+
+def add(partial: dict, other: dict) -> dict:
+    return {
+        "count": partial["count"] + other["count"],
+        "sum": partial["sum"] + other["sum"],
+        "threads": partial["threads"] | other["threads"],
+    }
+
+
+class RawClient:
+    """
+    Serves DOCUMENTS as the raw documents a pymongo client with RAW_CODEC_OPTIONS returns.
+    """
+
+    def __getitem__(self, database):
+        return self
+
+    def get_collection(self, name, codec_options=None):
+        return self
+
+    def find(self, query, projection, batch_size=None):
+        return (RawBSONDocument(bson.encode(document)) for document in DOCUMENTS)
+
+
+def test_partition_reduces_like_reduce_batches(monkeypatch):
+    monkeypatch.setitem(partitioned_scan._clients, "raw://test", RawClient())
+    partial, documents, size = partitioned_scan._scan_partition(
+        "raw://test", "amazon", "products", ["price"], {}, total, add, 128,
+    )
+    expected = partitioned_scan._reduce_batches(DOCUMENTS, total, add, 128)
+    assert (partial["count"], partial["sum"]) == (expected["count"], expected["sum"])
+    assert documents == len(DOCUMENTS)
+    assert size == sum(len(bson.encode(document)) for document in DOCUMENTS)
+
+
+def test_single_cursor_maps_batches_off_the_event_loop(monkeypatch):
+    async def batches(collection, fields, endpoint, query=None):
+        for start in range(0, len(DOCUMENTS), 128):
+            yield DOCUMENTS[start:start + 128]
+
+    monkeypatch.setattr(partitioned_scan, 'iter_batches', batches)
+
+    async def scan():
+        partial = await partitioned_scan.scan_aggregate(product_collection, ["price"], "test", total, add, partitions=1)
+        return partial, threading.get_ident()
+
+    partial, loop_thread = asyncio.run(scan())
+    expected = partitioned_scan._reduce_batches(DOCUMENTS, total, add, 128)
+    assert (partial["count"], partial["sum"]) == (expected["count"], expected["sum"])
+    assert loop_thread not in partial["threads"]
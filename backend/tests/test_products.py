@@ -0,0 +1,119 @@
+# tests/test_products.py
+#
+# Product writes respond before their analytics bookkeeping (app/write_hooks.py), which runs as a
+# background task, and errors the router raises itself keep their status code. A keyed bulk upsert
+# that finds its product created by another writer meanwhile reports and records an update.
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.database import product_collection
+from app.routers import products
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    writes = []
+
+    async def record(before, after):
+        writes.append((before, after))
+
+    async def record_many(pairs):
+        writes.extend(pairs)
+
+    monkeypatch.setattr(products, 'record_product_write', record)
+    monkeypatch.setattr(products, 'record_product_writes', record_many)
+    return writes
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(products.router)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_writes_record_their_hooks_after_the_response(client, recorded):
+    created = client.post("/products/", json={"product_name": "Lamp", "category": "Home", "rating": 4.0})
+    assert created.status_code == 200
+    product_id = created.json()["_id"]
+    assert len(recorded) == 1 and recorded[0][0] is None
+
+    assert client.put(f"/products/{product_id}", json={"product_name": "Lamp", "category": "Home", "rating": 2.0}).status_code == 200
+    before, after = recorded[1]
+    assert (before["rating"], after["rating"]) == (4.0, 2.0)
+
+    # Plain inserts: mongomock cannot run the UpdateOne upserts of a keyed bulk write
+    bulk = client.post("/products/bulk", json=[
+        {"product_name": "Desk", "category": "Office"},
+        {"product_name": "Chair", "category": "Office"},
+    ])
+    assert bulk.json()["succeeded"] == 2
+    assert len(recorded) == 4
+
+    assert client.delete(f"/products/{product_id}").status_code == 200
+    assert recorded[-1][1] is None and str(recorded[-1][0]["_id"]) == product_id
+
+
+def test_deleting_a_missing_product_is_not_found(client, recorded):
+    response = client.delete(f"/products/{ObjectId()}")
+    assert response.status_code == 404
+    assert client.delete("/products/not-an-id").status_code == 400
+    assert recorded == []
+
+
+class ConcurrentCreator:
+    """
+    Stands in for the products collection. Its bulk_write first lets another writer create
+    `created`, then runs the operations the way MongoDB does: an upserting UpdateOne whose filter
+    matches updates that product, and only inserts otherwise (mongomock cannot run them).
+    """
+
+    def __init__(self, created: dict):
+        self.created = created
+
+    def __getattr__(self, name):
+        return getattr(product_collection, name)
+
+    async def bulk_write(self, operations, ordered=True):
+        if self.created:
+            await product_collection.insert_one(self.created)
+            self.created = None
+        upserted = {}
+        for index, operation in enumerate(operations):
+            document = operation._doc
+            if await product_collection.find_one(operation._filter) is not None:
+                await product_collection.update_one(operation._filter, {"$set": document.get("$set", {})})
+            else:
+                inserted = {**operation._filter, **document.get("$setOnInsert", {}), **document.get("$set", {})}
+                await product_collection.insert_one(inserted)
+                upserted[index] = inserted["_id"]
+        return SimpleNamespace(upserted_ids=upserted)
+
+
+def test_upsert_racing_a_concurrent_create_reports_an_update(client, recorded, monkeypatch):
+    existing = {"_id": ObjectId(), "product_id": "RACE-1", "product_name": "Kettle", "category": "Kitchen", "rating": 3.0}
+    monkeypatch.setattr(products, 'product_collection', ConcurrentCreator(existing))
+    asyncio.run(product_collection.delete_many({"product_id": {"$in": ["RACE-1", "RACE-2"]}}))
+
+    response = client.post("/products/bulk", json=[
+        {"product_id": "RACE-1", "product_name": "Kettle", "category": "Kitchen", "rating": 4.5},
+        {"product_id": "RACE-2", "product_name": "Toaster", "category": "Kitchen"},
+    ])
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["updated", "created"]
+    # The id of the product the other writer created, not one that was never stored
+    assert results[0]["id"] == str(existing["_id"])
+    assert asyncio.run(product_collection.count_documents({"product_id": "RACE-1"})) == 1
+
+    # Recorded as a change of the existing product, not as a second one
+    created = [after for before, after in recorded if before is None]
+    assert [after["product_id"] for after in created] == ["RACE-2"]
+    before, after = next((before, after) for before, after in recorded if before is not None)
+    assert (before["_id"], before["rating"], after["rating"]) == (existing["_id"], 3.0, 4.5)
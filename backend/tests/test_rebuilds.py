@@ -0,0 +1,121 @@
+# tests/test_rebuilds.py
+#
+# Rebuilds of the precomputed analytics collections (app/rebuilds.py) keep the product writes made
+# while their scan runs: a write to a product the scan has already read, whose delta went to the
+# collection the rename replaces, is reconciled into the new one.
+
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from mongomock.collection import BulkOperationBuilder
+
+from app import partitioned_scan, price_buckets, price_trend, snapshot
+from app.aggregates import CoMoments
+from app.database import (
+    price_bucket_collection,
+    price_trend_collection,
+    product_collection,
+    product_tombstone_collection,
+)
+from app.fetch import projection_for
+
+
+def product(number: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "product_name": f"Product {number}",
+        "actual_price": f"₹{1000 + 750 * number:,}",
+        "discounted_price": f"₹{800 + 600 * number:,}",
+        "discount_percentage": f"{10 + number % 7 * 5}%",
+        "rating": str(3.0 + number % 3 * 0.5),
+        "rating_count": f"{100 + number:,}",
+    }
+
+
+@pytest.fixture
+def catalogue(monkeypatch):
+    # pymongo passes a sort to every UpdateOne of a bulk_write, which mongomock does not take
+    add_update = BulkOperationBuilder.add_update
+    monkeypatch.setattr(BulkOperationBuilder, 'add_update', lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs))
+    products = [product(number) for number in range(40)]
+
+    # Reads decoded documents: mongomock does not return raw BSON
+    async def batches(collection, fields, endpoint, query=None):
+        documents = await collection.find(query or {}, projection_for(fields)).to_list(length=None)
+        if documents:
+            yield documents
+
+    monkeypatch.setattr(partitioned_scan, 'iter_batches', batches)
+    monkeypatch.setattr(snapshot, 'iter_batches', batches)
+    monkeypatch.setattr(price_trend, '_shift', None)
+
+    async def reset():
+        for collection in (product_collection, product_tombstone_collection, price_bucket_collection, price_trend_collection):
+            await collection.drop()
+        await product_collection.insert_many(products)
+
+    asyncio.run(reset())
+    return products
+
+
+async def write_during_scan(products, hooks):
+    """
+    Updates one product and deletes another, both already read by the scan, running `hooks`
+    for each like the products router does.
+    """
+    now = datetime.now(timezone.utc)
+    before = dict(products[3])
+    changes = {"actual_price": "₹52,000", "discount_percentage": "70%", "updated_at": now}
+    await product_collection.update_one({"_id": before["_id"]}, {"$set": changes})
+    deleted = dict(products[8])
+    await product_collection.delete_one({"_id": deleted["_id"]})
+    await product_tombstone_collection.insert_one({"_id": deleted["_id"], "deleted_at": now})
+    for hook in hooks:
+        await hook(before, {**before, **changes})
+        await hook(deleted, None)
+
+
+def scan_then_write(monkeypatch, module, products, hooks):
+    scan_aggregate = module.scan_aggregate
+
+    async def scan(*args, **kwargs):
+        partial = await scan_aggregate(*args, **kwargs)
+        await write_during_scan(products, hooks)
+        return partial
+
+    monkeypatch.setattr(module, 'scan_aggregate', scan)
+
+
+def test_price_buckets_keep_writes_made_during_the_rebuild(catalogue, monkeypatch):
+    scan_then_write(monkeypatch, price_buckets, catalogue, [price_buckets.record_product_write])
+
+    async def scenario():
+        rebuilt = await price_buckets.load_price_buckets()
+        remaining = await product_collection.find({}).to_list(length=None)
+        expected = price_buckets.histogram_of(remaining)
+        assert await price_buckets._read_buckets() is not None
+        for histogram in (rebuilt, await price_buckets._read_buckets()):
+            assert {index: stats.to_document() for index, stats in histogram.buckets.items() if stats.count} == \
+                {index: stats.to_document() for index, stats in expected.buckets.items()}
+
+    asyncio.run(scenario())
+
+
+def test_price_trend_keeps_writes_made_during_the_rebuild(catalogue, monkeypatch):
+    scan_then_write(monkeypatch, price_trend, catalogue, [price_trend.record_product_write])
+
+    async def scenario():
+        stats = await price_trend.load_price_trend_stats()
+        remaining = await product_collection.find({}).to_list(length=None)
+        expected = CoMoments(price_trend.TREND_COLUMNS)
+        for row in map(price_trend._row, remaining):
+            expected.add(row)
+        assert stats.moments.n == expected.n == len(catalogue) - 1
+        assert stats.moments.mean == pytest.approx(expected.mean)
+        for row, expected_row in zip(stats.moments.comoment, expected.comoment):
+            assert row == pytest.approx(expected_row)
+        assert (stats.actual_min, stats.actual_max) == (1000.0, 52000.0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,153 @@
+# tests/test_sentiment.py
+#
+# Stored review sentiment (app/sentiment.py): the classifier of app/sentiment_model.py, once
+# published, scores reviews by their text like the classifier itself would, every worker loads
+# the same version, and publishing a model has the stored scores redone by one rescoring job.
+
+import asyncio
+import random
+
+import numpy as np
+import pytest
+from bson import ObjectId
+from mongomock.collection import BulkOperationBuilder
+
+from app import sentiment, sentiment_model
+from app.database import (
+    analytics_job_collection,
+    analytics_meta_collection,
+    product_collection,
+    review_collection,
+    sentiment_model_collection,
+)
+
+WORDS = {
+    "4.6": "great love sturdy works perfect fast".split(),
+    "3.6": "fine okay decent average works slow".split(),
+    "1.8": "terrible broke hate useless slow bad".split(),
+}
+
+
+def product(number: int, rng: random.Random) -> dict:
+    rating = rng.choice(list(WORDS))
+    reviews = rng.randint(1, 5)
+    return {
+        "_id": ObjectId(),
+        "product_id": f"P{number}",
+        "product_name": f"Product {number}",
+        "category": "Electronics|Cables",
+        "review_id": ",".join(f"R{number}-{i}" for i in range(reviews)),
+        "user_id": ",".join(f"U{i}" for i in range(reviews)),
+        "user_name": ",".join(f"user{i}" for i in range(reviews)),
+        "review_title": ",".join("title" for _ in range(reviews)),
+        "review_content": ",".join(" ".join(rng.choice(WORDS[rating]) for _ in range(5)) for _ in range(reviews)),
+        "rating": rating,
+        "helpful_count": ",".join("0" for _ in range(reviews)),
+    }
+
+
+@pytest.fixture
+def catalogue(monkeypatch):
+    # pymongo passes a sort to every UpdateOne of a bulk_write, which mongomock does not take
+    add_update = BulkOperationBuilder.add_update
+    monkeypatch.setattr(BulkOperationBuilder, 'add_update', lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs))
+    monkeypatch.setattr(sentiment, '_model', None)
+
+    rng = random.Random(5)
+    products = [product(number, rng) for number in range(200)]
+
+    async def batches(collection, fields, endpoint, query=None):
+        yield [dict(document) for document in products]
+
+    monkeypatch.setattr(sentiment_model, 'iter_batches', batches)
+
+    async def reset():
+        for collection in (product_collection, review_collection, sentiment_model_collection, analytics_job_collection):
+            await collection.drop()
+        await analytics_meta_collection.delete_one({"_id": sentiment.MODEL_ID})
+        from app import jobs
+        await jobs.create_indexes()
+
+    asyncio.run(reset())
+    return products
+
+
+async def publish(model, replace: bool = True):
+    classifier = model.classifier
+    return await sentiment.publish_scoring_model(
+        classifier.coef_, classifier.intercept_, list(classifier.classes_), sentiment_model.SENTIMENT_HASH_BITS, replace,
+    )
+
+
+def test_published_model_scores_like_the_classifier(catalogue):
+    async def scenario():
+        model = await sentiment_model.train_sentiment_model()
+        version = await publish(model)
+        assert sentiment.model_version() == version and version.startswith("text-v1/")
+
+        texts = ["great love works", "terrible broke", "okay decent", "nothing seen before"]
+        expected = model.classifier.predict_proba(model.vectorizer.transform(texts))
+        assert np.allclose(sentiment._model.probabilities(texts), expected, atol=1e-5)
+
+        scored = sentiment.score_reviews(texts + [""], [None] * 5)
+        assert [row['label'] for row in scored[:2]] == ['positive', 'negative']
+        assert scored[4] is None
+        assert all(0.0 <= row['score'] <= 1.0 for row in scored[:4])
+
+        # Another worker loads the same model
+        sentiment._model = None
+        assert await sentiment.refresh_model()
+        assert sentiment.model_version() == version
+        assert np.allclose(sentiment._model.probabilities(texts), expected, atol=1e-5)
+        assert not await sentiment.refresh_model()
+
+    asyncio.run(scenario())
+
+
+def test_publishing_only_replaces_when_asked(catalogue):
+    async def scenario():
+        model = await sentiment_model.train_sentiment_model()
+        version = await publish(model)
+        other = sentiment_model.StreamingSentimentModel()
+        other._fit(["love it", "hate it", "it is fine"], ["positive", "negative", "neutral"])
+        assert await publish(other, replace=False) is None
+        assert sentiment.model_version() == version
+
+        # Republishing the same coefficients keeps the version, so nothing is rescored
+        assert await publish(model) == version
+        replaced = await publish(other)
+        assert replaced != version and sentiment.model_version() == replaced
+        assert await sentiment_model_collection.count_documents({"version": {"$ne": replaced}}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_a_new_model_version_rescores_the_stored_sentiment(catalogue):
+    async def scenario():
+        # Stored while scoring from ratings, as before any model is published
+        documents = [{**document, **sentiment.sentiment_fields(document)} for document in catalogue]
+        await product_collection.insert_many(documents)
+        review = {"review_id": "R", "product_id": "P0", "user_id": "U", "review_title": "t",
+                  "review_content": "great love perfect", "rating": 1}
+        await review_collection.insert_one({**review, **sentiment.review_document_fields(review)})
+        assert {document['sentiment_version'] for document in documents} == {sentiment.RATING_MODEL_VERSION}
+
+        model = await sentiment_model.train_sentiment_model()
+        version = await publish(model)
+        # One job for the version, however many workers ask for it
+        await sentiment.request_rescoring()
+        jobs = await analytics_job_collection.find({"task": "sentiment_rescore"}).to_list(length=None)
+        assert [job["params"] for job in jobs] == [{"version": version}]
+
+        result = await sentiment.rescore_stale()
+        assert result == {"version": version, "products": len(documents), "reviews": 1}
+        async for stored in product_collection.find({}):
+            assert stored["sentiment_version"] == version
+            assert stored["review_sentiments"] == sentiment.sentiment_fields(stored)["review_sentiments"]
+        stored_review = await review_collection.find_one({})
+        # Scored from its text, not its rating
+        assert (stored_review["sentiment_label"], stored_review["sentiment_version"]) == ("positive", version)
+
+        assert await sentiment.rescore_stale() == {"version": version, "products": 0, "reviews": 0}
+
+    asyncio.run(scenario())
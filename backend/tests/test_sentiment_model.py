@@ -0,0 +1,101 @@
+# tests/test_sentiment_model.py
+#
+# Catch-up of the streaming sentiment model (app/sentiment_model.py) must leave the sentiment
+# distribution and the evaluation as a model trained on the current catalogue would have them:
+# writes that leave the reviews alone change nothing, relabelled reviews move, and reviews of
+# deleted products are withdrawn.
+
+import asyncio
+import random
+from collections import Counter
+
+import pytest
+from bson import ObjectId
+
+from app import sentiment_model
+from app.sentiment_model import is_held_out, _labelled_reviews
+
+WORDS = "great good fine bad terrible cheap sturdy broke love hate fast slow works".split()
+
+
+def product(number: int, rng: random.Random) -> dict:
+    reviews = rng.randint(1, 8)
+    return {
+        "_id": ObjectId(),
+        "product_id": f"P{number}",
+        "product_name": f"Product {number}",
+        "review_id": ",".join(f"R{number}-{i}" for i in range(reviews)),
+        "user_id": ",".join(f"U{i}" for i in range(reviews)),
+        "user_name": ",".join(f"user{i}" for i in range(reviews)),
+        "review_title": ",".join("title" for _ in range(reviews)),
+        "review_content": ",".join(" ".join(rng.choice(WORDS) for _ in range(6)) for _ in range(reviews)),
+        "rating": rng.choice(["1.5", "2.8", "3.6", "4.2", "4.8"]),
+        "helpful_count": ",".join(str(rng.randint(0, 9)) for _ in range(reviews)),
+    }
+
+
+@pytest.fixture
+def catalogue(monkeypatch):
+    rng = random.Random(11)
+    products = [product(number, rng) for number in range(150)]
+
+    async def batches(collection, fields, endpoint, query=None):
+        yield [dict(document) for document in products]
+
+    monkeypatch.setattr(sentiment_model, 'iter_batches', batches)
+    return products
+
+
+def expected_counts(products: list):
+    rows = list(_labelled_reviews(products))
+    return Counter(label for _, _, label, _ in rows), sum(is_held_out(review) for review, _, _, _ in rows)
+
+
+def test_catch_up_matches_a_fresh_model(catalogue):
+    async def scenario():
+        model = await sentiment_model.train_sentiment_model()
+        distribution, held_out = expected_counts(catalogue)
+        assert +model.distribution == distribution
+        assert model.evaluation.total == held_out
+        trained = model.trained_reviews
+
+        # A helpful vote: same reviews, nothing to feed
+        voted = dict(catalogue[0], helpful_count="9" + catalogue[0]["helpful_count"])
+        catalogue[0] = voted
+        assert await model.catch_up([voted], set()) == 0
+        assert model.trained_reviews == trained
+        assert +model.distribution == distribution and model.evaluation.total == held_out
+
+        # A rating edit relabels every review of the product
+        relabelled = dict(catalogue[1], rating="1.0" if catalogue[1]["rating"] != "1.5" else "4.9")
+        catalogue[1] = relabelled
+        # A new review on another product
+        grown = dict(catalogue[2])
+        for field, value in (("review_id", "R2-new"), ("user_id", "U9"), ("user_name", "new"),
+                             ("review_title", "title"), ("review_content", "love it works"), ("helpful_count", "0")):
+            grown[field] = f"{grown[field]},{value}"
+        catalogue[2] = grown
+        deleted = catalogue.pop(3)
+
+        assert await model.catch_up([relabelled, grown], {str(deleted["_id"])}) > 0
+        distribution, held_out = expected_counts(catalogue)
+        assert +model.distribution == distribution
+        assert model.evaluation.total == held_out
+        assert all(count >= 0 for row in model.evaluation.counts for count in row)
+
+        fresh = await sentiment_model.train_sentiment_model()
+        assert +fresh.distribution == +model.distribution
+        assert fresh.evaluation.total == model.evaluation.total
+
+    asyncio.run(scenario())
+
+
+def test_catch_up_of_an_unchanged_product_twice(catalogue):
+    async def scenario():
+        model = await sentiment_model.train_sentiment_model()
+        before = (Counter(model.distribution), [list(row) for row in model.evaluation.counts], model.trained_reviews)
+        for _ in range(3):
+            assert await model.catch_up(catalogue[:10], set()) == 0
+        assert (Counter(model.distribution), model.evaluation.counts, model.trained_reviews) == before
+
+    asyncio.run(scenario())
@@ -0,0 +1,61 @@
+# tests/test_snapshot.py
+#
+# Snapshot generations (app/snapshot.py) build and write the tables of each batch off the event
+# loop's thread, and a build that fails leaves nothing behind in the snapshot directory.
+
+import asyncio
+import os
+import threading
+
+import pytest
+from bson import ObjectId
+
+from app import snapshot
+
+PRODUCTS = [
+    {"_id": ObjectId(), "product_id": f"P{number}", "product_name": f"Product {number}", "category": "Home|Lamps",
+     "actual_price": "₹1,200", "discounted_price": "₹900", "discount_percentage": "25%", "rating": "4.1",
+     "rating_count": "1,024", "review_id": f"R{number}", "user_id": "U1", "user_name": "ann",
+     "review_title": "Nice", "review_content": "Works well"}
+    for number in range(5)
+]
+
+
+@pytest.fixture
+def no_artifacts(monkeypatch):
+    monkeypatch.setattr(snapshot, '_artifact_publishers', lambda: {})
+
+
+def test_batches_are_written_off_the_event_loop(tmp_path, monkeypatch, no_artifacts):
+    threads = set()
+    product_table = snapshot.product_table
+
+    def recording_table(batch):
+        threads.add(threading.get_ident())
+        return product_table(batch)
+
+    async def batches(collection, fields, endpoint, query=None):
+        yield [dict(document) for document in PRODUCTS]
+
+    monkeypatch.setattr(snapshot, 'product_table', recording_table)
+    monkeypatch.setattr(snapshot, 'iter_batches', batches)
+
+    async def write():
+        manifest = await snapshot.write_snapshot(str(tmp_path))
+        return manifest, threading.get_ident()
+
+    manifest, loop_thread = asyncio.run(write())
+    assert manifest["tables"]["products"]["rows"] == len(PRODUCTS)
+    assert threads and loop_thread not in threads
+
+
+def test_a_failed_build_leaves_no_staging_directory(tmp_path, monkeypatch, no_artifacts):
+    async def batches(collection, fields, endpoint, query=None):
+        yield [dict(document) for document in PRODUCTS]
+        raise ConnectionError("lost the cursor")
+
+    monkeypatch.setattr(snapshot, 'iter_batches', batches)
+    with pytest.raises(ConnectionError):
+        asyncio.run(snapshot.write_snapshot(str(tmp_path)))
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+    assert snapshot.latest_age(str(tmp_path)) is None